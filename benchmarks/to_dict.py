@@ -0,0 +1,61 @@
+"""Benchmark `carafe.utils.to_dict()` on large result lists.
+
+Usage: python benchmarks/to_dict.py [count] [repeat]
+"""
+
+import sys
+from timeit import repeat
+
+from carafe.utils import to_dict, serializers
+
+
+FIELDS = ('id', 'name', 'email', 'active', 'created', 'score')
+
+
+class Reflected(object):
+    """Model with a typical generic reflection based `to_dict()`."""
+    def __init__(self, _id):
+        self.id = _id
+        self.name = 'name {0}'.format(_id)
+        self.email = 'user{0}@example.com'.format(_id)
+        self.active = True
+        self.created = '2014-01-01T00:00:00'
+        self.score = _id * 1.5
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in FIELDS)
+
+
+class Declared(Reflected):
+    """Same model with declared fields for the compiled serializer."""
+    __fields__ = FIELDS
+
+
+def naive(items):
+    """Conversion as done prior to the serializer registry."""
+    return [item.to_dict() if hasattr(item, 'to_dict') else item
+            for item in items]
+
+
+def main(count=10000, times=5):
+    reflected = [Reflected(i) for i in range(count)]
+    declared = [Declared(i) for i in range(count)]
+
+    assert naive(reflected) == to_dict(declared)
+
+    cases = [
+        ('naive to_dict()', lambda: naive(reflected)),
+        ('registry to_dict()', lambda: to_dict(reflected)),
+        ('registry __fields__', lambda: to_dict(declared)),
+    ]
+
+    print('{0} objects, best of {1}'.format(count, times))
+
+    for name, func in cases:
+        serializers.clear()
+        best = min(repeat(func, number=1, repeat=times))
+        print('{0:<24}{1:>10.2f} ms'.format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -2,7 +2,7 @@
 """
 
 from .app import FlaskCarafe
-from .client import Client, JSONClient
+from .client import Client, JSONClient, ConcurrentClient, HTTPClient
 
 from .__meta__ import (
     __title__,
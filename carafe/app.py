@@ -1,10 +1,11 @@
 """Carafe's custom Flask app.
 """
 
-from flask import Flask
+from flask import Flask, request
+from werkzeug.datastructures import ImmutableDict
 
 from .request import Request
-from .response import Response
+from .response import Response, make_conditional
 
 
 class FlaskCarafe(Flask):
@@ -13,3 +14,42 @@ class FlaskCarafe(Flask):
     """
     request_class = Request
     response_class = Response
+
+    default_config = ImmutableDict(dict(
+        Flask.default_config,
+        # Automatically set ETags on JSON responses and answer matching
+        # If-None-Match requests with 304.
+        CARAFE_ETAG_ENABLED=False,
+        # Whether ETags generated from the response body are weak.
+        CARAFE_ETAG_WEAK=False,
+        # Maximum nesting depth of JSON request bodies.
+        CARAFE_REQUEST_MAX_JSON_DEPTH=None,
+        # Maximum number of keys of any object in JSON request bodies.
+        CARAFE_REQUEST_MAX_JSON_KEYS=None,
+        # Maximum number of elements of any array in JSON request bodies.
+        CARAFE_REQUEST_MAX_JSON_ARRAY_LENGTH=None,
+        # Transparently decompress gzip/deflate encoded request bodies.
+        CARAFE_REQUEST_DECOMPRESS_ENABLED=True,
+        # Maximum decompressed request body size (also limited by
+        # MAX_CONTENT_LENGTH).
+        CARAFE_REQUEST_MAX_DECOMPRESSED_LENGTH=32 * 1024 * 1024,
+        # Maximum ratio of decompressed to compressed request body size.
+        CARAFE_REQUEST_MAX_COMPRESSION_RATIO=100
+    ))
+
+    def preprocess_request(self):
+        """Extend to reject requests whose Content-Length exceeds the
+        (endpoint's) limit before any request processing or body parsing.
+        """
+        request.check_content_length()
+        return super(FlaskCarafe, self).preprocess_request()
+
+    def process_response(self, response):
+        """Extend with automatic ETag handling."""
+        response = super(FlaskCarafe, self).process_response(response)
+
+        if self.config['CARAFE_ETAG_ENABLED']:
+            response = make_conditional(
+                response, weak=self.config['CARAFE_ETAG_WEAK'])
+
+        return response
@@ -0,0 +1,425 @@
+"""Load generation and latency benchmarking of a `FlaskCarafe` app using
+carafe's test clients.
+
+A scenario is a list of requests, e.g. loaded from a JSON file::
+
+    {
+        "requests": [
+            {"name": "users", "path": "/users", "params": {"limit": 20},
+             "weight": 4},
+            {"name": "create user", "method": "POST", "path": "/users",
+             "body": {"name": "bench"}}
+        ]
+    }
+
+Each request is issued `weight` times per round of the scenario.
+
+Usage: python -m carafe.bench <module:app> <scenario.json> [options]
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict, OrderedDict
+from functools import partial
+from importlib import import_module
+from itertools import count
+from math import ceil
+from multiprocessing import Pool
+from threading import Lock, Thread
+from timeit import default_timer
+
+from flask import json
+
+from .client import JSONClient, make_client_response
+
+
+# Latency percentiles reported for each endpoint.
+PERCENTILES = (50, 90, 99)
+
+
+def load_scenario(path):
+    """Load scenario requests from JSON file at `path`. The file contains
+    either a list of requests or an object with a ``requests`` list.
+    """
+    with open(path) as fp:
+        scenario = json.load(fp)
+
+    if isinstance(scenario, dict):
+        scenario = scenario['requests']
+
+    return scenario
+
+
+def expand_scenario(scenario):
+    """Return list of scenario requests with each request repeated `weight`
+    times and defaults filled in.
+
+    >>> [step['name'] for step in expand_scenario(
+    ...     [{'path': '/a', 'weight': 2}, {'name': 'b', 'path': '/b'}])]
+    ['/a', '/a', 'b']
+    """
+    steps = []
+
+    for step in scenario:
+        step = dict(step)
+        step['method'] = step.get('method', 'GET').upper()
+        step.setdefault('name', step['path'])
+        steps += [step] * step.get('weight', 1)
+
+    return steps
+
+
+def load_app(path):
+    """Import app from `path` of the form ``module:name`` where `name` is
+    either an app or an app factory called without arguments.
+    """
+    module, _, name = path.partition(':')
+    app = getattr(import_module(module), name or 'app')
+
+    if not hasattr(app, 'wsgi_app'):
+        app = app()
+
+    return app
+
+
+def create_client(app):
+    """Return `JSONClient` for `app` whose responses have `.json`."""
+    return JSONClient(app, make_client_response(app.response_class))
+
+
+def percentile(values, percent):
+    """Return nearest-rank `percent` percentile of sorted `values`.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not values:
+        return None
+
+    index = int(ceil(percent / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+class Benchmark(object):
+    """Benchmark which issues the requests of `scenario` against `app` at
+    `concurrency` and collects the latency of each.
+
+    `mode` is either ``'thread'`` (threads sharing `app` in-process) or
+    ``'process'`` (worker processes which each load `app` which must then be
+    a ``module:name`` import path, see `load_app()`). Processes avoid the GIL
+    so they better reflect a multi-process deployment.
+
+    The first `warmup` requests of each worker aren't recorded. If
+    `cache_header` is set (see CARAFE_CACHE_STATUS_HEADER), results are also
+    broken down by its value (e.g. ``HIT`` and ``MISS``).
+
+    `client_factory` is called with the app to create each worker's client
+    and defaults to `create_client()`. Any client with an ``open(path,
+    method=..., ...)`` method returning responses with ``status_code`` and
+    ``headers`` can be used, e.g. one that calls a local server.
+    """
+    def __init__(self,
+                 app,
+                 scenario,
+                 requests=100,
+                 concurrency=1,
+                 warmup=0,
+                 mode='thread',
+                 cache_header=None,
+                 client_factory=create_client):
+        if mode not in ('thread', 'process'):
+            raise ValueError('Unknown benchmark mode: {0}'.format(mode))
+
+        if mode == 'process' and not isinstance(app, basestring):
+            raise ValueError('Process mode requires an app import path')
+
+        self.app = app
+        self.steps = expand_scenario(scenario)
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.mode = mode
+        self.cache_header = cache_header
+        self.client_factory = client_factory
+
+    def run(self):
+        """Run benchmark and return `Report`."""
+        if self.mode == 'process':
+            samples, elapsed = self.run_processes()
+        else:
+            samples, elapsed = self.run_threads()
+
+        return Report(samples, elapsed)
+
+    def run_threads(self):
+        """Run workers as threads and return collected samples and elapsed
+        time.
+        """
+        # Workers issue the next request of the scenario until `requests`
+        # have been issued.
+        counter = count()
+        lock = Lock()
+
+        def next_index():  # pylint: disable=missing-docstring
+            with lock:
+                index = next(counter)
+            return index if index < self.requests else None
+
+        clients = [self.client_factory(self.app)
+                   for _ in range(self.concurrency)]
+
+        for client in clients:
+            self.run_warmup(client)
+
+        results = [[] for _ in clients]
+        threads = [Thread(target=self.run_worker,
+                          args=(client, next_index, samples))
+                   for client, samples in zip(clients, results)]
+
+        started = default_timer()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = default_timer() - started
+
+        return ([sample for samples in results for sample in samples],
+                elapsed)
+
+    def run_processes(self):
+        """Run workers as processes and return collected samples and elapsed
+        time (of the slowest worker).
+        """
+        shares = [self.requests // self.concurrency +
+                  (1 if worker < self.requests % self.concurrency else 0)
+                  for worker in range(self.concurrency)]
+        offsets = [sum(shares[:worker]) for worker in range(self.concurrency)]
+
+        pool = Pool(self.concurrency)
+
+        try:
+            results = pool.map(partial(_run_process, self),
+                               zip(offsets, shares))
+        finally:
+            pool.close()
+            pool.join()
+
+        return ([sample for samples, _ in results for sample in samples],
+                max(elapsed for _, elapsed in results))
+
+    def run_warmup(self, client):
+        """Issue `warmup` requests with `client` without recording them."""
+        for index in range(self.warmup):
+            self.request(client, self.steps[index % len(self.steps)])
+
+    def run_worker(self, client, next_index, samples):
+        """Issue requests with `client` for indexes returned by `next_index`
+        until it returns ``None`` and append samples to `samples`.
+        """
+        while True:
+            index = next_index()
+            if index is None:
+                break
+
+            step = self.steps[index % len(self.steps)]
+            samples.append(self.request(client, step))
+
+    def request(self, client, step):
+        """Issue scenario request `step` with `client` and return sample of
+        ``(name, latency, status, cache status)``.
+        """
+        kargs = {'method': step['method']}
+
+        if step.get('params'):
+            kargs['query_string'] = step['params']
+
+        if step.get('body') is not None:
+            kargs['data'] = step['body']
+
+        if step.get('headers'):
+            kargs['headers'] = step['headers']
+
+        started = default_timer()
+
+        try:
+            response = client.open(step['path'], **kargs)
+            status = response.status_code
+            cache = (response.headers.get(self.cache_header)
+                     if self.cache_header else None)
+        except Exception:  # pylint: disable=broad-except
+            status = cache = None
+
+        return (step['name'], default_timer() - started, status, cache)
+
+
+def _run_process(benchmark, share):
+    """Process worker which issues its `share` of ``(offset, count)``
+    requests and returns collected samples and elapsed time.
+    """
+    offset, requests = share
+    client = benchmark.client_factory(load_app(benchmark.app))
+    indexes = iter(range(offset, offset + requests))
+    samples = []
+
+    benchmark.run_warmup(client)
+
+    started = default_timer()
+    benchmark.run_worker(client, partial(next, indexes, None), samples)
+
+    return (samples, default_timer() - started)
+
+
+def format_ms(value):
+    """Return latency `value` in milliseconds for display (``'n/a'`` if
+    there were no samples).
+
+    >>> format_ms(1.234), format_ms(None)
+    ('1.23', 'n/a')
+    """
+    return 'n/a' if value is None else '{0:.2f}'.format(value)
+
+
+class Report(object):
+    """Benchmark results of `samples` collected over `elapsed` seconds."""
+    def __init__(self, samples, elapsed):
+        self.samples = samples
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        """Return throughput and latency stats for all requests and per
+        endpoint. Latencies are in milliseconds.
+        """
+        endpoints = OrderedDict()
+
+        for name, latency, status, cache in self.samples:
+            endpoints.setdefault(name, []).append((latency, status, cache))
+
+        return {
+            'elapsed': self.elapsed,
+            'total': self.get_stats([sample[1:] for sample in self.samples]),
+            'endpoints': OrderedDict((name, self.get_stats(samples))
+                                     for name, samples in endpoints.items())
+        }
+
+    def get_stats(self, samples):
+        """Return stats for `samples` of ``(latency, status, cache status)``.
+        """
+        latencies = sorted(latency * 1000 for latency, _, _ in samples)
+        statuses = defaultdict(int)
+        caches = defaultdict(lambda: {'count': 0, 'latencies': []})
+
+        for latency, status, cache in samples:
+            statuses[status] += 1
+
+            if cache is not None:
+                caches[cache]['count'] += 1
+                caches[cache]['latencies'].append(latency * 1000)
+
+        stats = {
+            'count': len(samples),
+            'errors': sum(number for status, number in statuses.items()
+                          if status is None or status >= 500),
+            'statuses': dict(statuses),
+            'throughput': len(samples) / self.elapsed if self.elapsed else 0,
+            'max': latencies[-1] if latencies else None
+        }
+
+        for percent in PERCENTILES:
+            stats['p{0}'.format(percent)] = percentile(latencies, percent)
+
+        if caches:
+            stats['cache'] = dict(
+                (cache, {'count': value['count'],
+                         'p50': percentile(sorted(value['latencies']), 50)})
+                for cache, value in caches.items())
+
+        return stats
+
+    def format(self):
+        """Return report as a text table."""
+        data = self.to_dict()
+        columns = ['p{0}'.format(percent) for percent in PERCENTILES]
+        columns.append('max')
+        template = '{0:<30}{1:>8}{2:>8}{3:>10}' + ''.join(
+            '{{{0}:>10}}'.format(index + 4) for index in range(len(columns)))
+
+        lines = [template.format('endpoint', 'count', 'errors', 'req/s',
+                                 *[column + ' ms' for column in columns])]
+
+        rows = list(data['endpoints'].items()) + [('TOTAL', data['total'])]
+
+        for name, stats in rows:
+            lines.append(template.format(
+                name[:29],
+                stats['count'],
+                stats['errors'],
+                '{0:.1f}'.format(stats['throughput']),
+                *[format_ms(stats[column]) for column in columns]))
+
+            for cache, value in sorted(stats.get('cache', {}).items()):
+                lines.append('  cache {0}: {1} requests, p50 {2} ms'
+                             .format(cache, value['count'],
+                                     format_ms(value['p50'])))
+
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Command line entry point. Returns non-zero exit status if there were
+    errors or if the p99 latency of any endpoint exceeds ``--max-p99`` (or
+    there were no samples to measure it).
+    """
+    parser = argparse.ArgumentParser(description='Benchmark a carafe app.')
+    parser.add_argument('app', help='app or app factory as module:name')
+    parser.add_argument('scenario', help='scenario JSON file')
+    parser.add_argument('-n', '--requests', type=int, default=1000)
+    parser.add_argument('-c', '--concurrency', type=int, default=1)
+    parser.add_argument('-w', '--warmup', type=int, default=0,
+                        help='unrecorded warm-up requests per worker')
+    parser.add_argument('--processes', action='store_true',
+                        help='use worker processes instead of threads')
+    parser.add_argument('--cache-header',
+                        help='response header with cache HIT/MISS status')
+    parser.add_argument('--max-p99', type=float,
+                        help='fail if any endpoint p99 exceeds this (ms)')
+    parser.add_argument('--json', action='store_true',
+                        help='output report as JSON')
+    args = parser.parse_args(argv)
+
+    mode = 'process' if args.processes else 'thread'
+    app = args.app if args.processes else load_app(args.app)
+
+    report = Benchmark(app,
+                       load_scenario(args.scenario),
+                       requests=args.requests,
+                       concurrency=args.concurrency,
+                       warmup=args.warmup,
+                       mode=mode,
+                       cache_header=args.cache_header).run()
+    data = report.to_dict()
+
+    if args.json:
+        print(json.dumps(data, indent=2))
+    else:
+        print(report.format())
+
+    failed = bool(data['total']['errors'])
+
+    if args.max_p99 is not None:
+        # A run without samples can't meet the latency target.
+        failed = (failed or
+                  not data['total']['count'] or
+                  any(stats['p99'] is None or stats['p99'] > args.max_p99
+                      for stats in data['endpoints'].values()))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    raise SystemExit(main())
@@ -1,10 +1,22 @@
-"""Flask test client extensions.
+"""Flask test client extensions and an HTTP client with the same interface.
 """
 
+import errno
+import httplib
+from multiprocessing.pool import ThreadPool
+import socket
+from threading import Lock, local
+from time import sleep
+import zlib
+
 from flask.testing import FlaskClient
 from flask import json
 from werkzeug import urls
+from werkzeug.datastructures import Headers
 from werkzeug.utils import cached_property
+from werkzeug.wrappers import Response as ResponseBase
+
+from .compression import ENCODINGS
 
 
 class JsonResponseMixin(object):
@@ -62,9 +74,9 @@ class JSONClient(Client):
         kargs.setdefault('content_type', 'application/json')
 
         if (kargs['content_type'] == 'application/json'
-                and isinstance(kargs.get('data'), dict)):
-            # If data is a dict, then assume we want to send a JSON serialized
-            # string in the request.
+                and isinstance(kargs.get('data'), (dict, list))):
+            # If data is a dict or list, then assume we want to send a JSON
+            # serialized string in the request.
             try:
                 kargs['data'] = json.dumps(kargs['data'])
             except Exception:
@@ -72,3 +84,312 @@ class JSONClient(Client):
                 pass
 
         return super(JSONClient, self).open(*args, **kargs)
+
+
+class ConcurrentClient(object):
+    """Client which issues in-process requests to `app` concurrently on a
+    bounded pool of `max_workers` threads. Request methods have the same
+    signature as `client_class` (`JSONClient` by default) but return a
+    future-like `AsyncResult` whose ``get()`` returns the response. Use
+    `gather()` to wait for many requests.
+
+    Each worker thread has its own client (and therefore its own cookies).
+    """
+    def __init__(self, app, max_workers=8, client_class=JSONClient):
+        self.app = app
+        self.client_class = client_class
+        self.response_class = make_client_response(app.response_class)
+        self.pool = ThreadPool(max_workers)
+        self.local = local()
+
+    @property
+    def client(self):
+        """Client of the current worker thread."""
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.client_class(self.app,
+                                                  self.response_class)
+        return self.local.client
+
+    def call(self, method, *args, **kargs):
+        """Call client `method` with `args` and `kargs` on a worker thread and
+        return `AsyncResult`.
+        """
+        # pylint: disable=missing-docstring
+        def request():
+            return getattr(self.client, method)(*args, **kargs)
+
+        return self.pool.apply_async(request)
+
+    def open(self, *args, **kargs):
+        """Concurrent `open()`."""
+        return self.call('open', *args, **kargs)
+
+    def get(self, *args, **kargs):
+        """Concurrent `get()`."""
+        return self.call('get', *args, **kargs)
+
+    def post(self, *args, **kargs):
+        """Concurrent `post()`."""
+        return self.call('post', *args, **kargs)
+
+    def put(self, *args, **kargs):
+        """Concurrent `put()`."""
+        return self.call('put', *args, **kargs)
+
+    def patch(self, *args, **kargs):
+        """Concurrent `patch()`."""
+        return self.call('patch', *args, **kargs)
+
+    def delete(self, *args, **kargs):
+        """Concurrent `delete()`."""
+        return self.call('delete', *args, **kargs)
+
+    def close(self):
+        """Wait for pending requests and stop worker threads."""
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def gather(*results, **kargs):
+    """Wait for `AsyncResult` `results` (e.g. of `ConcurrentClient`) and return
+    their values in order. Re-raises the exception of the first failed
+    request. Accepts a `timeout` (in seconds) keyword argument for each
+    result.
+    """
+    timeout = kargs.pop('timeout', None)
+    return [result.get(timeout) for result in results]
+
+
+class ConnectionPool(object):
+    """Thread safe pool of idle keep-alive connections per host."""
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection
+    }
+
+    def __init__(self, maxsize=10, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = Lock()
+
+    def get(self, scheme, host):
+        """Return ``(connection, reused)`` for `scheme` and `host` (including
+        port) where `reused` is whether the connection was idle in the pool.
+        """
+        with self.lock:
+            idle = self.idle.get((scheme, host))
+            if idle:
+                return (idle.pop(), True)
+
+        connection = self.connection_classes[scheme](host,
+                                                     timeout=self.timeout)
+        return (connection, False)
+
+    def put(self, scheme, host, connection):
+        """Return `connection` to the pool or close it if the pool is full."""
+        with self.lock:
+            idle = self.idle.setdefault((scheme, host), [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle.clear()
+
+
+def is_connection_closed(ex):
+    """Return whether exception `ex` means that the server closed the
+    connection without sending any response.
+    """
+    if isinstance(ex, httplib.BadStatusLine):
+        # Raised with the (repr of the) empty status line.
+        return ex.line in ('', "''")
+
+    return getattr(ex, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class HTTPClient(object):
+    """JSON API client for calling services over HTTP with the same interface
+    as `JSONClient`. Connections are kept alive and reused from a per-host
+    pool of up to `pool_size` idle connections.
+
+    Requests failing due to connection errors or with a status in
+    `retry_statuses` are retried up to `retries` times waiting ``backoff *
+    2 ** attempt`` seconds between attempts. Only idempotent methods are
+    retried except that any request is retried if it failed on a reused
+    connection which the server had already closed (but never after a
+    timeout).
+
+    If `decompress` is set, gzip/deflate response bodies are requested and
+    transparently decompressed.
+    """
+    response_class = make_client_response(ResponseBase)
+    idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+    retry_statuses = (502, 503, 504)
+
+    def __init__(self,
+                 base_url='',
+                 timeout=10,
+                 retries=2,
+                 backoff=0.1,
+                 pool_size=10,
+                 decompress=True,
+                 headers=None):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.decompress = decompress
+        self.headers = Headers(headers or {})
+        self.pool = ConnectionPool(pool_size, timeout=timeout)
+
+    def get(self, url, params=None, **kargs):
+        """Send GET request with URL params."""
+        return self.open(url, method='GET', params=params, **kargs)
+
+    def post(self, url, data, **kargs):
+        """Send POST request with data."""
+        return self.open(url, method='POST', data=data, **kargs)
+
+    def put(self, url, data, **kargs):
+        """Send PUT request with data."""
+        return self.open(url, method='PUT', data=data, **kargs)
+
+    def patch(self, url, data, **kargs):
+        """Send PATCH request with data."""
+        return self.open(url, method='PATCH', data=data, **kargs)
+
+    def delete(self, url, **kargs):
+        """Send DELETE request."""
+        return self.open(url, method='DELETE', **kargs)
+
+    def head(self, url, params=None, **kargs):
+        """Send HEAD request with URL params."""
+        return self.open(url, method='HEAD', params=params, **kargs)
+
+    def open(self,
+             url,
+             method='GET',
+             params=None,
+             data=None,
+             headers=None,
+             content_type='application/json'):
+        """Send request and return response. Data is JSON serialized if it's a
+        dict or list and `content_type` is JSON.
+        """
+        url = urls.url_parse(urls.url_join(self.base_url, url))
+
+        if url.scheme not in ConnectionPool.connection_classes:
+            raise ValueError('Unsupported URL: {0}'.format(url.to_url()))
+
+        path = url.path or '/'
+        query = url.query
+
+        if params:
+            query = '&'.join(filter(None, [query, urls.url_encode(params)]))
+
+        if query:
+            path = '{0}?{1}'.format(path, query)
+
+        request_headers = Headers(self.headers)
+
+        for key, value in Headers(headers or {}).items():
+            request_headers[key] = value
+
+        if data is not None:
+            if (content_type == 'application/json' and
+                    isinstance(data, (dict, list))):
+                data = json.dumps(data)
+            elif isinstance(data, dict):
+                data = urls.url_encode(data)
+
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+
+            request_headers.setdefault('Content-Type', content_type)
+
+        if self.decompress:
+            request_headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        method = method.upper()
+        attempt = 0
+
+        while True:
+            try:
+                response = self.send(url.scheme, url.netloc, method, path,
+                                     data, request_headers)
+            except (socket.error, httplib.HTTPException) as ex:
+                if (attempt >= self.retries or
+                        (method not in self.idempotent_methods and
+                         not getattr(ex, 'stale', False))):
+                    raise
+            else:
+                if (response.status_code not in self.retry_statuses or
+                        attempt >= self.retries or
+                        method not in self.idempotent_methods):
+                    return response
+
+            sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def send(self, scheme, host, method, path, data, headers):
+        """Send request on a pooled connection and return response whose body
+        is fully read so that the connection can be reused.
+        """
+        connection, reused = self.pool.get(scheme, host)
+        sent = False
+        response = None
+
+        try:
+            connection.request(method, path, data, dict(headers))
+            sent = True
+            response = connection.getresponse()
+            body = response.read()
+        except (socket.error, httplib.HTTPException) as ex:
+            connection.close()
+            # A reused connection failing before the request was sent or
+            # being closed without any response usually means the server
+            # closed it while idle so the request wasn't processed. Timeouts
+            # never are since the server may still be processing it.
+            ex.stale = (reused and
+                        response is None and
+                        not isinstance(ex, socket.timeout) and
+                        (not sent or is_connection_closed(ex)))
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(scheme, host, connection)
+
+        response_headers = Headers(response.getheaders())
+        encoding = response_headers.get('Content-Encoding', '').lower()
+
+        if self.decompress and encoding in ENCODINGS and body:
+            try:
+                body = zlib.decompress(body, ENCODINGS[encoding])
+            except zlib.error:
+                # Raw deflate data without the zlib header.
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+            del response_headers['Content-Encoding']
+            response_headers['Content-Length'] = str(len(body))
+
+        return self.response_class(body, response.status, response_headers)
+
+    def close(self):
+        """Close pooled connections."""
+        self.pool.close()
@@ -0,0 +1,157 @@
+"""Streaming decompression of compressed (i.e. Content-Encoding) request
+bodies.
+"""
+
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+
+# zlib window bits for supported content encodings.
+ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class DecompressingStream(object):
+    """Read-only stream which decompresses `stream` as it's read. Memory use
+    is bounded by `chunk_size` regardless of how much the data expands.
+
+    Raises `RequestEntityTooLarge` if the decompressed data exceeds
+    `max_length` bytes or if it expands by more than `max_ratio` times the
+    compressed data read so far (checked once more than
+    `min_ratio_check_length` bytes have been decompressed) in order to
+    protect against decompression bombs. Raises `BadRequest` if the data
+    can't be decompressed.
+    """
+    min_ratio_check_length = 64 * 1024
+
+    def __init__(self,
+                 stream,
+                 encoding,
+                 max_length=None,
+                 max_ratio=None,
+                 chunk_size=64 * 1024):
+        self.stream = stream
+        self.encoding = encoding
+        self.max_length = max_length
+        self.max_ratio = max_ratio
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(ENCODINGS[encoding])
+        self.compressed_length = 0
+        self.length = 0
+        self.buffer = b''
+        self.tail = b''
+        self.started = False
+        self.eof = False
+        self.flushed = False
+
+    def decompress(self, data):
+        """Decompress `data` returning at most `chunk_size` bytes and keeping
+        the unprocessed remainder for the next call.
+        """
+        try:
+            result = self.decompressor.decompress(data, self.chunk_size)
+        except zlib.error:
+            if self.encoding == 'deflate' and not self.started:
+                # Some clients send raw deflate data without the zlib
+                # header.
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self.decompress(data)
+            raise BadRequest('Invalid {0} request body'.format(self.encoding))
+
+        self.started = True
+        self.tail = self.decompressor.unconsumed_tail
+
+        return result
+
+    def read_chunk(self):
+        """Return next chunk of decompressed data or an empty string at end of
+        stream.
+        """
+        while not self.eof:
+            if self.tail:
+                data = self.tail
+            else:
+                data = self.stream.read(self.chunk_size)
+                self.compressed_length += len(data)
+
+                if not data:
+                    self.eof = True
+                    break
+
+            result = self.decompress(data)
+
+            if result:
+                self.check_length(len(result))
+                return result
+
+        if not self.flushed:
+            self.flushed = True
+
+            try:
+                result = self.decompressor.flush()
+            except zlib.error:  # pragma: no cover
+                raise BadRequest(
+                    'Invalid {0} request body'.format(self.encoding))
+
+            self.check_length(len(result))
+            return result
+
+        return b''
+
+    def check_length(self, length):
+        """Add `length` to decompressed length and enforce limits."""
+        self.length += length
+
+        if self.max_length is not None and self.length > self.max_length:
+            raise RequestEntityTooLarge()
+
+        if (self.max_ratio and
+                self.length > self.min_ratio_check_length and
+                self.length > self.max_ratio * self.compressed_length):
+            raise RequestEntityTooLarge('Request body compression ratio '
+                                        'exceeds {0}'.format(self.max_ratio))
+
+    def read(self, size=-1):
+        """Read up to `size` decompressed bytes (all if `size` is negative)."""
+        chunks = [self.buffer]
+        length = len(self.buffer)
+
+        while size < 0 or length < size:
+            chunk = self.read_chunk()
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+
+        data = b''.join(chunks)
+
+        if size < 0:
+            self.buffer = b''
+            return data
+
+        self.buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        """Read a line of decompressed data."""
+        while b'\n' not in self.buffer and (size < 0 or
+                                            len(self.buffer) < size):
+            chunk = self.read_chunk()
+            if not chunk:
+                break
+            self.buffer += chunk
+
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+
+        if size >= 0:
+            end = min(end, size)
+
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b'')
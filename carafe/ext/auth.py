@@ -2,7 +2,15 @@
 authentication/authorization.
 """
 
-from flask import session, current_app
+import base64
+import hashlib
+import hmac
+import os
+from collections import Counter, OrderedDict
+from threading import Lock
+from time import time
+
+from flask import session, current_app, request, json, g
 from flask_principal import (
     Principal,
     identity_loaded,
@@ -14,12 +22,233 @@ from flask_principal import (
     TypeNeed
 )
 
+try:
+    from sqlalchemy import inspect as sa_inspect
+    from sqlalchemy.orm import subqueryload
+except ImportError:  # pragma: no cover
+    sa_inspect = subqueryload = None
+
 
 # pylint: disable=invalid-name
 login_need = TypeNeed('login')
 # pylint: enable=invalid-name
 
 
+class LazyIdentity(Identity):
+    """Identity whose `provides` are loaded by calling `loader` with the
+    identity the first time they are accessed (e.g. by a permission check).
+    """
+    def __init__(self, id, auth_type=None, loader=None):
+        # pylint: disable=redefined-builtin
+        self._provides = None
+        self.loader = loader
+        super(LazyIdentity, self).__init__(id, auth_type)
+
+    @property
+    def provides(self):
+        """Identity's needs which are loaded on first access."""
+        if self.loader is not None:
+            # Unset loader first since it populates provides.
+            loader, self.loader = self.loader, None
+            loader(self)
+        return self._provides
+
+    @provides.setter
+    def provides(self, value):
+        # pylint: disable=missing-docstring
+        self._provides = value
+
+    @property
+    def loaded(self):
+        """Whether identity's provides have been loaded."""
+        return self.loader is None
+
+
+class TokenIdentity(Identity):
+    """Identity built from the identity dict `ident` of a verified token."""
+    def __init__(self, id, ident, auth_type='token'):
+        # pylint: disable=redefined-builtin
+        self.ident = ident
+        super(TokenIdentity, self).__init__(id, auth_type)
+
+
+class TokenSigner(object):
+    """Signs and verifies compact ``<payload>.<signature>`` tokens where the
+    payload is base64 encoded JSON signed with HMAC-SHA256. Tokens are signed
+    with the first of `keys` and verified with any of them so that keys can be
+    rotated by prepending a new key and dropping the oldest once its tokens
+    have expired.
+
+    >>> signer = TokenSigner(['new', 'old'])
+    >>> token = TokenSigner(['old']).dumps({'sub': 1})
+    >>> signer.loads(token)
+    {u'sub': 1}
+    >>> signer.loads(token[:-1]) is None
+    True
+    """
+    def __init__(self, keys):
+        if not keys or not all(keys):
+            raise ValueError('TokenSigner requires non-empty keys')
+
+        self.keys = [key.encode('utf-8') if isinstance(key, unicode) else key
+                     for key in keys]
+
+    def dumps(self, payload):
+        """Return signed token of `payload`."""
+        data = b64encode(json.dumps(payload, separators=(',', ':')))
+        return '{0}.{1}'.format(data, self.sign(data, self.keys[0]))
+
+    def loads(self, token):
+        """Return payload of `token` or ``None`` if it's malformed or its
+        signature doesn't match any key.
+        """
+        if isinstance(token, unicode):
+            try:
+                token = token.encode('ascii')
+            except UnicodeEncodeError:
+                return None
+
+        data, _, signature = token.rpartition('.')
+
+        if not data:
+            return None
+
+        if not any(hmac.compare_digest(self.sign(data, key), signature)
+                   for key in self.keys):
+            return None
+
+        try:
+            return json.loads(b64decode(data))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def sign(data, key):
+        """Return signature of `data` with `key`."""
+        return b64encode(hmac.new(key, data, hashlib.sha256).digest())
+
+
+def b64encode(data):
+    """Return URL safe base64 encoding of `data` without padding."""
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def b64decode(data):
+    """Return data of URL safe base64 encoding without padding."""
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class IdentityCache(object):
+    """LRU cache of up to `maxsize` provider identity dicts keyed by user id
+    which expire after `ttl` seconds. If `backend` (e.g. the
+    `carafe.ext.cache.Cache` extension) is given, identities are also stored
+    there so that they are shared by all workers.
+
+    Hits and misses are counted for monitoring the hit rate (see `stats()`).
+    """
+    key_format = 'carafe:auth:identity:{0}'
+
+    def __init__(self, maxsize=1000, ttl=60, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Return cached identity dict of `user_id` or ``None``."""
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        """Return dict of cached identity dicts keyed by user id for
+        `user_ids` (omitting uncached users). Identities which aren't cached
+        in this worker are fetched from the backend at once.
+        """
+        idents = {}
+        missing = []
+        now = time()
+
+        with self.lock:
+            for user_id in user_ids:
+                entry = self.entries.pop(user_id, None)
+
+                if entry is not None and entry[0] > now:
+                    # Re-insert as most recently used.
+                    self.entries[user_id] = entry
+                    idents[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+
+        if missing and self.backend is not None:
+            values = self.backend_call(
+                'get_many',
+                *[self.key_format.format(user_id) for user_id in missing])
+
+            for user_id, ident in zip(missing, values or []):
+                if ident is not None:
+                    idents[user_id] = ident
+                    self.set_local(user_id, ident)
+
+        with self.lock:
+            self.hits += len(idents)
+            self.misses += len(user_ids) - len(idents)
+
+        return idents
+
+    def set(self, user_id, ident):
+        """Cache identity dict `ident` of `user_id`."""
+        self.set_local(user_id, ident)
+        self.backend_call('set', self.key_format.format(user_id), ident,
+                          timeout=self.ttl)
+
+    def set_local(self, user_id, ident):
+        """Cache identity dict `ident` of `user_id` in this worker."""
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = (time() + self.ttl, ident)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Remove cached identity of `user_id`."""
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+        self.backend_call('delete', self.key_format.format(user_id))
+
+    def clear(self):
+        """Remove all identities cached in this worker."""
+        with self.lock:
+            self.entries.clear()
+
+    def backend_call(self, method, *args, **kargs):
+        """Call backend `method` returning ``None`` if there's no backend or
+        if it fails (e.g. cache server is down).
+        """
+        if self.backend is None:
+            return None
+
+        try:
+            return getattr(self.backend, method)(*args, **kargs)
+        except Exception as ex:  # pylint: disable=broad-except
+            current_app.logger.exception(ex)
+            return None
+
+    def stats(self):
+        """Return hit, miss, and size counts and the hit rate."""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'hit_rate': float(self.hits) / total if total else 0.0
+            }
+
+
 class SQLAlchemyAuthProvider(object):
     """SQLAlchemy backed UserProvider class which provides identity information
     for logged in user.
@@ -31,13 +260,38 @@ class SQLAlchemyAuthProvider(object):
     __id_key__ = 'id'
     __roles_key__ = 'roles'
 
+    # Columns for loading identities with a single column-only query (i.e.
+    # without loading ORM instances) instead of `get_user()` and
+    # `get_roles()`. Enabled by setting `__id_column__` (e.g. ``User.id``).
+    # `__role_column__` (e.g. ``Role.name``) is reached by outer joining
+    # `__role_joins__` (e.g. ``[User.roles]``). If `__active_column__` is set,
+    # inactive users aren't identified.
+    __id_column__ = None
+    __role_column__ = None
+    __role_joins__ = ()
+    __active_column__ = None
+
+    # Maximum number of ids per IN query of `identify_many()`.
+    identify_many_chunk_size = 500
+
     def __init__(self, db_session):
         self.session = db_session
 
+        # Read columns from the class since model attributes (e.g. ``User.id``)
+        # are descriptors which fail when accessed through an instance.
+        cls = type(self)
+        self.id_column = cls.__id_column__
+        self.role_column = cls.__role_column__
+        self.role_joins = cls.__role_joins__
+        self.active_column = cls.__active_column__
+
     def identify(self, identity):
         """Identify a user via _id to provide information for role based
         authentication.
         """
+        if self.id_column is not None:
+            return self.identify_columns(identity.id)
+
         ident = {}
 
         user = self.get_user(identity.id)
@@ -64,33 +318,172 @@ class SQLAlchemyAuthProvider(object):
         """Return a list of `roles` as strings."""
         return getattr(user, self.__roles_key__, [])
 
+    def identify_many(self, ids):
+        """Identify many users with one IN query per
+        `identify_many_chunk_size` ids. Returns dict of identity dicts keyed
+        by user id which omits unknown (or inactive) users.
+        """
+        ids = list(OrderedDict.fromkeys(_id for _id in ids if _id is not None))
+        idents = {}
+
+        for index in range(0, len(ids), self.identify_many_chunk_size):
+            chunk = ids[index:index + self.identify_many_chunk_size]
+
+            if self.id_column is not None:
+                rows = OrderedDict()
+
+                for row in (self.query_identity_columns()
+                            .filter(self.id_column.in_(chunk))
+                            .all()):
+                    rows.setdefault(row[0], []).append(row)
+
+                for _id, user_rows in rows.items():
+                    ident = self.make_ident(user_rows)
+                    if ident:
+                        idents[_id] = ident
+            else:
+                for user in self.get_users(chunk):
+                    _id = getattr(user, self.__id_key__)
+                    idents[_id] = {
+                        self.__id_key__: _id,
+                        self.__roles_key__: self.get_roles(user)
+                    }
+
+        return idents
+
+    def get_users(self, ids):
+        """Return user objects for `ids` from database. If the model's roles
+        attribute is a relationship, the roles of all users are loaded with
+        one more query so that `get_roles()` doesn't query per user.
+        """
+        model_id = getattr(self.__model__, self.__id_key__)
+        query = self.session.query(self.__model__).filter(model_id.in_(ids))
+
+        if is_relationship(self.__model__, self.__roles_key__):
+            query = query.options(
+                subqueryload(getattr(self.__model__, self.__roles_key__)))
+
+        return query.all()
+
+    def identify_columns(self, _id):
+        """Identify user `_id` with a single column-only query."""
+        if _id is None:
+            return {}
+
+        rows = (self.query_identity_columns()
+                .filter(self.id_column == _id)
+                .all())
+
+        return self.make_ident(rows)
+
+    def query_identity_columns(self):
+        """Return query of ``(id, role, active)`` rows (where role and active
+        are only included if their columns are set) with one row per role.
+        """
+        columns = [self.id_column]
+
+        if self.role_column is not None:
+            columns.append(self.role_column)
+
+        if self.active_column is not None:
+            columns.append(self.active_column)
+
+        query = self.session.query(*columns)
+
+        for join in self.role_joins:
+            query = query.outerjoin(join)
+
+        return query
+
+    def make_ident(self, rows):
+        """Return identity dict from a user's identity column `rows`."""
+        if not rows:
+            return {}
+
+        if self.active_column is not None and not rows[0][-1]:
+            return {}
+
+        roles = []
+
+        if self.role_column is not None:
+            roles = [row[1] for row in rows if row[1] is not None]
+
+        return {
+            self.__id_key__: rows[0][0],
+            self.__roles_key__: roles
+        }
+
 
 class Auth(object):
     """Auth extension."""
     _extension_name = 'carafe.auth'
 
-    def __init__(self, app=None, provider=None):
+    def __init__(self, app=None, provider=None, identity_cache=None,
+                 token_store=None):
         self.principal = Principal(use_sessions=False)
         self.require = PermissionFactory()
+        self.metrics = Counter()
+        self._metrics_lock = Lock()
 
         self.app = app
         if self.app:  # pragma: no cover
-            self.init_app(app, provider)
-
-    def init_app(self, app, provider=None):
-        """Initialize app."""
+            self.init_app(app, provider, identity_cache, token_store)
+
+    def init_app(self, app, provider=None, identity_cache=None,
+                 token_store=None):
+        """Initialize app. Provider identities are cached with
+        `identity_cache` if given or if CARAFE_AUTH_IDENTITY_CACHE_ENABLED.
+        Revoked identity tokens are kept in `token_store` (e.g. the
+        `carafe.ext.cache.Cache` extension) which is required if
+        CARAFE_AUTH_TOKEN_ENABLED.
+        """
         app.config.setdefault('CARAFE_AUTH_ENABLED', True)
         app.config.setdefault('CARAFE_AUTH_SESSION_ID_KEY', 'user_id')
         app.config.setdefault('CARAFE_AUTH_IDENTITY_ID_KEY', 'id')
         app.config.setdefault('CARAFE_AUTH_IDENTITY_ROLES_KEY', 'roles')
+        app.config.setdefault('CARAFE_AUTH_LAZY_IDENTITY', False)
+        app.config.setdefault('CARAFE_AUTH_IDENTITY_CACHE_ENABLED', False)
+        app.config.setdefault('CARAFE_AUTH_IDENTITY_CACHE_SIZE', 1000)
+        app.config.setdefault('CARAFE_AUTH_IDENTITY_CACHE_TTL', 60)
+        app.config.setdefault('CARAFE_AUTH_TOKEN_ENABLED', False)
+        app.config.setdefault('CARAFE_AUTH_TOKEN_SECRET_KEYS', None)
+        app.config.setdefault('CARAFE_AUTH_TOKEN_TTL', 3600)
+        app.config.setdefault('CARAFE_AUTH_TOKEN_REFRESH', 300)
+        app.config.setdefault('CARAFE_AUTH_TOKEN_COOKIE', 'auth_token')
+        app.config.setdefault('CARAFE_AUTH_TOKEN_HEADER', 'X-Auth-Token')
 
         if not app.config['CARAFE_AUTH_ENABLED']:  # pragma: no cover
             return
 
+        if app.config['CARAFE_AUTH_TOKEN_ENABLED'] and token_store is None:
+            # Otherwise logged out tokens couldn't be revoked.
+            raise ValueError(
+                'CARAFE_AUTH_TOKEN_ENABLED requires a token_store')
+
+        if (app.config['CARAFE_AUTH_TOKEN_ENABLED'] and
+                not (app.config['CARAFE_AUTH_TOKEN_SECRET_KEYS'] or
+                     app.config.get('SECRET_KEY'))):
+            # Otherwise tokens couldn't be signed.
+            raise ValueError('CARAFE_AUTH_TOKEN_ENABLED requires '
+                             'CARAFE_AUTH_TOKEN_SECRET_KEYS or SECRET_KEY')
+
         if not hasattr(app, 'extensions'):  # pragma: no cover
             app.extensions = {}
 
-        app.extensions[self._extension_name] = {'provider': provider}
+        if (identity_cache is None and
+                app.config['CARAFE_AUTH_IDENTITY_CACHE_ENABLED']):
+            identity_cache = IdentityCache(
+                app.config['CARAFE_AUTH_IDENTITY_CACHE_SIZE'],
+                app.config['CARAFE_AUTH_IDENTITY_CACHE_TTL'])
+
+        app.extensions[self._extension_name] = {
+            'provider': provider,
+            'identity_cache': identity_cache,
+            'token_store': token_store
+        }
+
+        if app.config['CARAFE_AUTH_TOKEN_ENABLED']:
+            app.after_request(self.set_token)
 
         # NOTE: Instead of having principal use it's session loader, we'll use
         # ours.
@@ -113,6 +506,31 @@ class Auth(object):
         """Property access to config's CARAFE_AUTH_IDENTITY_ROLES_KEY."""
         return current_app.config['CARAFE_AUTH_IDENTITY_ROLES_KEY']
 
+    @property
+    def lazy_identity(self):
+        """Property access to config's CARAFE_AUTH_LAZY_IDENTITY."""
+        return current_app.config['CARAFE_AUTH_LAZY_IDENTITY']
+
+    @property
+    def token_enabled(self):
+        """Property access to config's CARAFE_AUTH_TOKEN_ENABLED."""
+        return current_app.config['CARAFE_AUTH_TOKEN_ENABLED']
+
+    @property
+    def token_signer(self):
+        """Property access to token signer of config's
+        CARAFE_AUTH_TOKEN_SECRET_KEYS (or SECRET_KEY if not set).
+        """
+        return TokenSigner(current_app.config['CARAFE_AUTH_TOKEN_SECRET_KEYS'] or
+                           [current_app.config['SECRET_KEY']])
+
+    @property
+    def token(self):
+        """Property access to identity token issued during this request (e.g.
+        to return it from a login view).
+        """
+        return g.get('carafe_auth_token')
+
     @property
     def user_id(self):
         """Property access to logged in user id."""
@@ -123,10 +541,54 @@ class Auth(object):
         """Property access to auth provider instance."""
         return current_app.extensions[self._extension_name]['provider']
 
+    @property
+    def identity_cache(self):
+        """Property access to identity cache instance (if any)."""
+        return current_app.extensions[self._extension_name]['identity_cache']
+
+    @property
+    def token_store(self):
+        """Property access to revoked token store instance (if any)."""
+        return current_app.extensions[self._extension_name]['token_store']
+
+    def require_any(self, *roles, **kargs):
+        """Return permission context (see `Permission.require`) which requires
+        any of `roles` and aborts with `http_exception` keyword argument.
+        """
+        # pylint: disable=protected-access
+        return self.require._compile(roles).require(
+            kargs.get('http_exception'))
+
+    def require_all(self, *roles, **kargs):
+        """Return permission context (see `Permission.require`) which requires
+        all of `roles` and aborts with `http_exception` keyword argument.
+        """
+        # pylint: disable=protected-access
+        return self.require._compile(roles, match_all=True).require(
+            kargs.get('http_exception'))
+
+    def incr(self, metric, amount=1):
+        """Increment `metric` counter of `metrics`."""
+        with self._metrics_lock:
+            self.metrics[metric] += amount
+
+    def create_identity(self, user_id):
+        """Return identity for `user_id` which is lazy if configured."""
+        if self.lazy_identity:
+            return LazyIdentity(user_id, loader=self.load_identity)
+        return Identity(user_id)
+
     def session_identity_loader(self):
-        """Fetch user id from session using config's auth id key"""
+        """Fetch user id from session using config's auth id key unless the
+        identity comes from a valid identity token.
+        """
+        if self.token_enabled:
+            identity = self.token_identity_loader()
+            if identity is not None:
+                return identity
+
         if self.session_id_key in session:
-            identity = Identity(session[self.session_id_key])
+            identity = self.create_identity(session[self.session_id_key])
         else:
             identity = None
 
@@ -134,14 +596,30 @@ class Auth(object):
 
     def on_identity_loaded(self, app, identity):  # pylint: disable=unused-argument
         """Called if session_identity_loader() returns an identity (i.e. not
-        None).
+        None). Lazy identities are loaded once their provides are accessed
+        instead and token identities are provided by their token.
         """
+        if isinstance(identity, TokenIdentity):
+            self.incr('identity_token')
+            self.provide(identity, identity.ident)
+            return
+
+        if isinstance(identity, LazyIdentity) and not identity.loaded:
+            self.incr('identity_deferred')
+            return
+
+        self.load_identity(identity)
+
+    def load_identity(self, identity):
+        """Load identity's provides from the auth provider."""
+        self.incr('identity_loaded')
+
         # Whatever is returned is used for our identity. Potentially, provider
         # may return a different user than original identity (e.g. app provides
         # way for admin users to access site using a different user account)
 
         if self.provider:
-            ident = self.provider.identify(identity)
+            ident = self.identify(identity)
         else:
             ident = {self.identity_id_key: None}
 
@@ -150,6 +628,10 @@ class Auth(object):
             # user possibly deleted or inactivated in another process
             self.logout()
 
+        self.provide(identity, ident)
+
+    def provide(self, identity, ident):
+        """Add needs of identity dict `ident` to `identity`."""
         # provide auth (whether user is not anonymous)
         if ident.get(self.identity_id_key):
             identity.provides.add(login_need)
@@ -158,34 +640,239 @@ class Auth(object):
         for role in ident.get(self.identity_roles_key, []):
             identity.provides.add(RoleNeed(role))
 
+    def identify(self, identity):
+        """Return provider's identity dict for `identity` using the identity
+        cache if enabled.
+        """
+        cache = self.identity_cache
+
+        if cache is None:
+            return self.provider.identify(identity)
+
+        ident = cache.get(identity.id)
+
+        if ident is None:
+            ident = self.provider.identify(identity)
+
+            # Unknown users aren't cached so that they are logged out.
+            if ident:
+                cache.set(identity.id, ident)
+
+        return ident
+
+    def identify_many(self, user_ids):
+        """Return provider's identity dicts keyed by user id for many
+        `user_ids` (omitting unknown users) using the identity cache if
+        enabled and populating it with the identities loaded from the
+        provider.
+        """
+        cache = self.identity_cache
+        idents = {}
+        # Allow generators since ids are iterated more than once.
+        user_ids = list(user_ids)
+
+        if cache is not None:
+            idents = cache.get_many(user_ids)
+
+        missing = [user_id for user_id in user_ids if user_id not in idents]
+
+        if missing:
+            loaded = self.provider.identify_many(missing)
+
+            if cache is not None:
+                for user_id, ident in loaded.items():
+                    cache.set(user_id, ident)
+
+            idents.update(loaded)
+
+        return idents
+
+    def invalidate_user(self, user_id):
+        """Remove cached identity of `user_id` (e.g. after its roles have
+        changed).
+        """
+        if self.identity_cache is not None:
+            self.identity_cache.invalidate(user_id)
+
+    def token_identity_loader(self):
+        """Return identity of the request's identity token or ``None`` if
+        there's no valid token. Tokens nearing expiry are refreshed from the
+        provider. Invalid, expired, or revoked tokens fall back to the session
+        (which loads the identity from the provider).
+        """
+        config = current_app.config
+        token = None
+
+        if config['CARAFE_AUTH_TOKEN_HEADER']:
+            token = request.headers.get(config['CARAFE_AUTH_TOKEN_HEADER'])
+
+        if not token and config['CARAFE_AUTH_TOKEN_COOKIE']:
+            token = request.cookies.get(config['CARAFE_AUTH_TOKEN_COOKIE'])
+
+        if not token:
+            return None
+
+        payload = self.verify_token(token)
+
+        if payload is None:
+            self.incr('token_rejected')
+            return None
+
+        if payload['exp'] - time() < config['CARAFE_AUTH_TOKEN_REFRESH']:
+            self.incr('token_refreshed')
+            ident = self.issue_token(payload['sub'])
+
+            if not ident:
+                return None
+        else:
+            ident = {self.identity_id_key: payload['sub'],
+                     self.identity_roles_key: payload['roles']}
+
+        return TokenIdentity(ident[self.identity_id_key], ident)
+
+    def issue_token(self, user_id):
+        """Issue identity token of `user_id` with the identity dict loaded
+        from the provider and return the identity dict. No token is issued
+        (and an empty dict is returned) for unknown users.
+        """
+        if not self.provider:
+            return {}
+
+        ident = self.identify(Identity(user_id))
+
+        if ident:
+            g.carafe_auth_token = self.token_signer.dumps({
+                'sub': ident[self.identity_id_key],
+                'roles': list(ident.get(self.identity_roles_key, [])),
+                'exp': int(time()) + current_app.config['CARAFE_AUTH_TOKEN_TTL'],
+                'jti': b64encode(os.urandom(9))
+            })
+
+        return ident
+
+    def verify_token(self, token, check_expiry=True):
+        """Return payload of `token` or ``None`` if it's invalid, expired, or
+        revoked.
+        """
+        payload = self.token_signer.loads(token)
+
+        if not isinstance(payload, dict):
+            return None
+
+        if check_expiry and payload.get('exp', 0) <= time():
+            return None
+
+        if self.token_store is not None:
+            try:
+                if self.token_store.get(self.revoked_key(payload['jti'])):
+                    return None
+            except Exception as ex:  # pylint: disable=broad-except
+                # Can't tell whether token is revoked so distrust it.
+                current_app.logger.exception(ex)
+                return None
+
+        return payload
+
+    def revoke_token(self, token=None):
+        """Revoke identity `token` (defaults to the request's token) until it
+        expires by adding it to the token store's denylist.
+        """
+        if token is None:
+            header = current_app.config['CARAFE_AUTH_TOKEN_HEADER']
+            cookie = current_app.config['CARAFE_AUTH_TOKEN_COOKIE']
+            token = ((header and request.headers.get(header)) or
+                     (cookie and request.cookies.get(cookie)))
+
+        payload = self.verify_token(token) if token else None
+
+        if payload is None or self.token_store is None:
+            return
+
+        self.token_store.set(self.revoked_key(payload['jti']), True,
+                             timeout=int(payload['exp'] - time()) + 1)
+
+    @staticmethod
+    def revoked_key(jti):
+        """Return token store key of revoked token id `jti`."""
+        return 'carafe:auth:token:revoked:{0}'.format(jti)
+
+    def set_token(self, response):
+        """Set identity token issued (or cleared) during the request on
+        `response`.
+        """
+        config = current_app.config
+        token = g.get('carafe_auth_token')
+
+        if token is None:
+            return response
+
+        if token and config['CARAFE_AUTH_TOKEN_HEADER']:
+            response.headers[config['CARAFE_AUTH_TOKEN_HEADER']] = token
+
+        if config['CARAFE_AUTH_TOKEN_COOKIE']:
+            if token:
+                response.set_cookie(config['CARAFE_AUTH_TOKEN_COOKIE'], token,
+                                    max_age=config['CARAFE_AUTH_TOKEN_TTL'],
+                                    httponly=True)
+            else:
+                response.delete_cookie(config['CARAFE_AUTH_TOKEN_COOKIE'])
+
+        return response
+
     def send_identity_changed(self, user_id):
         """Send identity changed event."""
         if user_id is None:
             identity = AnonymousIdentity()
         else:
-            identity = Identity(user_id)
+            identity = self.create_identity(user_id)
 
         identity_changed.send(
             current_app._get_current_object(), identity=identity)
 
     def login(self, user_id, propagate=True):
-        """Call after user has been authenticated for login."""
+        """Call after user has been authenticated for login. Issues an
+        identity token if CARAFE_AUTH_TOKEN_ENABLED.
+        """
         if session.get(self.session_id_key) != user_id:
             session[self.session_id_key] = user_id
+            self.invalidate_user(user_id)
             if propagate:
                 self.send_identity_changed(user_id)
 
+        if self.token_enabled:
+            self.issue_token(user_id)
+
     def logout(self, propagate=True):
-        """Call to log user out."""
+        """Call to log user out. Revokes the request's identity token if
+        CARAFE_AUTH_TOKEN_ENABLED.
+        """
+        if self.token_enabled:
+            self.revoke_token()
+            # Clear the token cookie.
+            g.carafe_auth_token = ''
+
         if session.get(self.session_id_key):
-            del session[self.session_id_key]
+            self.invalidate_user(session.pop(self.session_id_key))
             if propagate:
                 self.send_identity_changed(None)
 
 
+class AllPermission(Permission):
+    """Permission which requires all of its needs instead of any of them."""
+    def allows(self, identity):
+        """Whether `identity` provides all of the permission's needs and none
+        of its excludes.
+        """
+        if self.excludes and self.excludes.intersection(identity.provides):
+            return False
+        return self.needs.issubset(identity.provides)
+
+
 class PermissionFactory(object):
     """General purpose permissions factory which creates RoleNeed permissions
-    from attribute access.
+    from attribute access. Permissions which require any or all of several
+    roles are created with `Auth.require_any()` and `Auth.require_all()`.
+    Permissions are created once and reused.
     """
     def __init__(self):
         self._permissions = {
@@ -196,6 +883,32 @@ class PermissionFactory(object):
         """Return role permission's require method. If it doesn't exist yet,
         create it."""
         if role not in self._permissions:
-            self._permissions[role] = Permission(RoleNeed(role))
+            self._permissions[role] = Permission(self._need(role))
 
         return self._permissions[role].require
+
+    def _compile(self, roles, match_all=False):
+        """Return (cached) permission which requires any or all of `roles`."""
+        key = ('all' if match_all else 'any', frozenset(roles))
+
+        if key not in self._permissions:
+            needs = [self._need(role) for role in roles]
+            self._permissions[key] = (AllPermission(*needs) if match_all
+                                      else Permission(*needs))
+
+        return self._permissions[key]
+
+    @staticmethod
+    def _need(role):
+        """Return need of `role` (``'login'`` is the login need)."""
+        return login_need if role == 'login' else RoleNeed(role)
+
+
+def is_relationship(model, key):
+    """Return whether `key` is a relationship of SQLAlchemy mapped `model`."""
+    if sa_inspect is None or model is None:  # pragma: no cover
+        return False
+
+    mapper = sa_inspect(model, raiseerr=False)
+
+    return mapper is not None and key in mapper.relationships
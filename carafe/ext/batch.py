@@ -0,0 +1,281 @@
+"""Flask extension which provides a batch endpoint for executing multiple
+sub-requests in a single HTTP request.
+"""
+
+from collections import OrderedDict
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from flask import request, current_app, json, _request_ctx_stack
+from werkzeug.exceptions import BadRequest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from werkzeug.wrappers import Response as ResponseBase
+
+from ..response import RawJSON
+
+
+# Methods which are safe to execute concurrently.
+CONCURRENT_METHODS = ('GET', 'HEAD')
+
+
+class Batch(object):
+    """Batch extension. Registers an endpoint which accepts a JSON array of
+    ``{method, path, params, body}`` sub-requests, dispatches each one through
+    the app's WSGI stack (so that caching, auth, and signals apply as usual),
+    and returns a JSON array of ``{status, headers, body}`` results in the
+    same order.
+
+    Sub-requests share the batch request's auth identity and session via the
+    forwarded headers (CARAFE_BATCH_FORWARD_HEADERS plus the auth token header
+    CARAFE_AUTH_TOKEN_HEADER). Consecutive GET/HEAD sub-requests are executed
+    concurrently on a bounded thread pool while any other method is executed
+    serially in order.
+    """
+    _extension_name = 'carafe.batch'
+
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pool_lock = Lock()
+
+        if app:  # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize app."""
+        app.config.setdefault('CARAFE_BATCH_ENABLED', True)
+        app.config.setdefault('CARAFE_BATCH_URL', '/batch')
+        app.config.setdefault('CARAFE_BATCH_MAX_REQUESTS', 20)
+        app.config.setdefault('CARAFE_BATCH_MAX_WORKERS', 4)
+        app.config.setdefault('CARAFE_BATCH_FORWARD_HEADERS',
+                              ['Authorization', 'Cookie'])
+
+        if not app.config['CARAFE_BATCH_ENABLED']:  # pragma: no cover
+            return
+
+        if not hasattr(app, 'extensions'):  # pragma: no cover
+            app.extensions = {}
+
+        app.extensions[self._extension_name] = self
+
+        app.add_url_rule(app.config['CARAFE_BATCH_URL'],
+                         self._extension_name,
+                         self.dispatch,
+                         methods=['POST'])
+
+    @property
+    def pool(self):
+        """Lazily created thread pool shared by all batch requests."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(
+                        current_app.config['CARAFE_BATCH_MAX_WORKERS'])
+        return self._pool
+
+    def dispatch(self):
+        """Batch endpoint view."""
+        subrequests = request.get_dict()
+
+        if not isinstance(subrequests, list):
+            raise BadRequest('Batch request must be a JSON array')
+
+        if len(subrequests) > current_app.config['CARAFE_BATCH_MAX_REQUESTS']:
+            raise BadRequest('Batch request exceeds {0} requests'.format(
+                current_app.config['CARAFE_BATCH_MAX_REQUESTS']))
+
+        app = current_app._get_current_object()
+        results = [None] * len(subrequests)
+        cookies = parse_cookie_header(request.headers.get('Cookie'))
+        set_cookies = OrderedDict()
+        group = []
+
+        def run_group():  # pylint: disable=missing-docstring
+            environs = [self.create_environ(subrequests[index], cookies)
+                        for index in group]
+
+            if len(environs) > 1:
+                responses = self.pool.map(partial(self.run, app), environs)
+            else:
+                responses = [self.run(app, environ) for environ in environs]
+
+            for index, response in zip(group, responses):
+                results[index] = response
+                update_cookies(response, cookies, set_cookies)
+
+            del group[:]
+
+        for index, subrequest in enumerate(subrequests):
+            error = self.validate(subrequest)
+
+            if error is not None:
+                results[index] = error
+            elif (str(subrequest.get('method', 'GET')).upper() in
+                  CONCURRENT_METHODS):
+                group.append(index)
+            else:
+                # Writes are executed in order with the effects (e.g. session
+                # changes) of prior sub-requests.
+                run_group()
+                group.append(index)
+                run_group()
+
+        run_group()
+
+        response = current_app.response_class(
+            [self.format_result(result) for result in results])
+
+        # Cookies (e.g. session changes) set by sub-requests are passed on to
+        # the client.
+        for header in set_cookies.values():
+            response.headers.add('Set-Cookie', header)
+
+        if app.session_cookie_name in set_cookies:
+            # Don't let the batch request's own (now stale) session overwrite
+            # the session saved by a sub-request.
+            _request_ctx_stack.top.session = \
+                app.session_interface.make_null_session(app)
+
+        return response
+
+    def validate(self, subrequest):
+        """Return error response if `subrequest` is invalid."""
+        if not isinstance(subrequest, dict):
+            return self.error(400, 'Sub-request must be a JSON object')
+
+        path = subrequest.get('path')
+
+        if not isinstance(path, basestring) or not path.startswith('/'):
+            return self.error(400, 'Sub-request path must start with "/"')
+
+        if path.split('?')[0] == current_app.config['CARAFE_BATCH_URL']:
+            return self.error(400, 'Sub-request can\'t be a batch request')
+
+        if not isinstance(subrequest.get('params') or {}, (dict, basestring)):
+            return self.error(400, 'Sub-request params must be a JSON object')
+
+    def create_environ(self, subrequest, cookies):  # pylint: disable=no-self-use
+        """Return WSGI environ for `subrequest` using `cookies`."""
+        kargs = {
+            'path': subrequest['path'],
+            'method': str(subrequest.get('method', 'GET')).upper(),
+            'base_url': request.url_root,
+            'query_string': subrequest.get('params') or None,
+            'environ_base': {
+                'REMOTE_ADDR': request.environ.get('REMOTE_ADDR')
+            }
+        }
+
+        if subrequest.get('body') is not None:
+            kargs['data'] = json.dumps(subrequest['body'])
+            kargs['content_type'] = 'application/json'
+
+        builder = EnvironBuilder(**kargs)
+
+        # Share the batch request's identity and session.
+        for header in get_forward_headers():
+            if header.lower() == 'cookie':
+                if cookies:
+                    builder.headers['Cookie'] = '; '.join(
+                        '{0}={1}'.format(name, value)
+                        for name, value in cookies.items())
+            elif header in request.headers:
+                builder.headers[header] = request.headers[header]
+
+        try:
+            return builder.get_environ()
+        finally:
+            builder.close()
+
+    def run(self, app, environ):
+        """Run sub-request `environ` through `app`'s WSGI stack and return a
+        buffered response.
+        """
+        # Run in a fresh app context so that the sub-request doesn't share
+        # (and overwrite) the batch request's `g`.
+        with app.app_context():
+            try:
+                app_iter, status, headers = run_wsgi_app(app, environ,
+                                                         buffered=True)
+            except Exception as ex:  # pylint: disable=broad-except
+                app.logger.exception(ex)
+                return self.error(500, 'Internal Server Error')
+
+        return ResponseBase(app_iter, status, headers)
+
+    def error(self, status, message):  # pylint: disable=no-self-use
+        """Return error response for a sub-request."""
+        return ResponseBase(json.dumps({'message': message}),
+                            status=status,
+                            mimetype='application/json')
+
+    def format_result(self, response):  # pylint: disable=no-self-use
+        """Return batch result for sub-request `response`."""
+        data = response.get_data()
+
+        if response.mimetype == 'application/json' and data.strip():
+            # Embed JSON as is instead of decoding and re-encoding it.
+            body = RawJSON(data)
+        else:
+            body = response.get_data(as_text=True)
+
+        headers = dict((key, value) for key, value in response.headers
+                       if key.lower() not in ('set-cookie', 'content-length'))
+
+        return {
+            'status': response.status_code,
+            'headers': headers,
+            'body': body
+        }
+
+
+def get_forward_headers():
+    """Return headers forwarded to sub-requests, i.e.
+    CARAFE_BATCH_FORWARD_HEADERS plus CARAFE_AUTH_TOKEN_HEADER if auth tokens
+    are sent in a header.
+    """
+    config = current_app.config
+    headers = list(config['CARAFE_BATCH_FORWARD_HEADERS'])
+    token_header = config.get('CARAFE_AUTH_TOKEN_HEADER')
+
+    if (token_header and
+            token_header.lower() not in [header.lower()
+                                         for header in headers]):
+        headers.append(token_header)
+
+    return headers
+
+
+def parse_cookie_header(header):
+    """Parse Cookie `header` into an ordered dict of raw (i.e. still quoted)
+    cookie values.
+
+    >>> parse_cookie_header('a=1; b="x y"')
+    OrderedDict([('a', '1'), ('b', '"x y"')])
+    """
+    cookies = OrderedDict()
+
+    for pair in (header or '').split(';'):
+        name, sep, value = pair.strip().partition('=')
+        if sep:
+            cookies[name] = value
+
+    return cookies
+
+
+def update_cookies(response, cookies, set_cookies):
+    """Update raw `cookies` and `set_cookies` (cookie name to Set-Cookie
+    header) from `response`'s Set-Cookie headers.
+    """
+    for header in response.headers.getlist('Set-Cookie'):
+        name, _, value = header.split(';', 1)[0].strip().partition('=')
+
+        if value:
+            cookies[name] = value
+        else:
+            # Deleted cookie.
+            cookies.pop(name, None)
+
+        set_cookies.pop(name, None)
+        set_cookies[name] = header
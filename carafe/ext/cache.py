@@ -2,12 +2,15 @@
 """
 
 from functools import wraps
+from uuid import uuid4
 
 from flask import request, current_app
 from flask.signals import Namespace
 from werkzeug import urls
 from flask_cache import Cache as CacheBase
 
+from ..utils import format_fields
+
 
 # pylint: disable=invalid-name
 
@@ -45,6 +48,7 @@ class Cache(CacheBase):
     """
 
     view_key_format = '{namespace}:view:{path}'
+    etag_key_suffix = '#etag'
 
     def init_app(self, app, config=None):
         if config is None:
@@ -52,6 +56,8 @@ class Cache(CacheBase):
 
         config.setdefault('CARAFE_CACHE_ENABLED', True)
         config.setdefault('CARAFE_CACHE_IGNORED_REQUEST_ARGS', [])
+        config.setdefault('CARAFE_ETAG_ENABLED', False)
+        config.setdefault('CARAFE_CACHE_STATUS_HEADER', None)
 
         if not config['CARAFE_CACHE_ENABLED']:  # pragma: no cover
             return
@@ -92,6 +98,16 @@ class Cache(CacheBase):
         """Property access to config's CARAFE_CACHE_ENABLED."""
         return current_app.config['CARAFE_CACHE_ENABLED']
 
+    @property
+    def etag_enabled(self):
+        """Property access to config's CARAFE_ETAG_ENABLED."""
+        return current_app.config['CARAFE_ETAG_ENABLED']
+
+    @property
+    def status_header(self):
+        """Property access to config's CARAFE_CACHE_STATUS_HEADER."""
+        return current_app.config['CARAFE_CACHE_STATUS_HEADER']
+
     @property
     def cache_key_prefix(self):
         return current_app.config['CACHE_KEY_PREFIX']
@@ -101,7 +117,10 @@ class Cache(CacheBase):
         if not keys:  # pragma: no cover
             return
 
-        keys = [self.cache_key_prefix + k for k in keys]
+        # Cached view ETags are stored alongside their view keys.
+        keys = [self.cache_key_prefix + k + suffix
+                for k in keys
+                for suffix in ('', self.etag_key_suffix)]
         self.server.delete(*keys)
 
     def clear_prefixes(self, *prefixes):
@@ -181,17 +200,24 @@ class Cache(CacheBase):
                     path=view_path,
                     **request.view_args)
 
-                cached = self.cached(timeout=timeout,
-                                     key_prefix=key_prefix,
-                                     unless=unless)(func)
+                if (self.etag_enabled and
+                        request.method in ('GET', 'HEAD') and
+                        not (callable(unless) and unless() is True)):
+                    return self.cached_view_conditional(
+                        func, args, kargs, key_prefix, timeout)
 
                 try:
                     # Cache server could be down.
-                    result = cached(*args, **kargs)
+                    result, hit = self.call_cached(
+                        func, args, kargs, key_prefix, timeout, unless)
                 except Exception as ex:  # pragma: no cover
                     # Return function call instead.
                     current_app.logger.exception(ex)
-                    result = func(*args, **kargs)
+                    return func(*args, **kargs)
+
+                if self.status_header:
+                    result = current_app.make_response(result)
+                    self.set_status_header(result, hit)
 
                 return result
 
@@ -199,20 +225,106 @@ class Cache(CacheBase):
 
         return wrap
 
+    def cached_view_conditional(self, func, args, kargs, key_prefix, timeout):
+        """Return cached view response with a weak ETag taken from cache
+        metadata stored alongside the cached view. If the request's
+        If-None-Match contains the ETag, a 304 is returned without calling the
+        view or loading the cached value.
+        """
+        etag_key = key_prefix + self.etag_key_suffix
+
+        try:
+            # Cache server could be down.
+            etag = self.cache.get(etag_key)
+
+            if etag and request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+                self.set_status_header(response, hit=True)
+                return response
+
+            result, hit = self.call_cached(
+                func, args, kargs, key_prefix, timeout)
+
+            if not hit or not etag:
+                # View was (re)computed so the old ETag no longer applies.
+                etag = uuid4().hex
+                self.cache.set(etag_key, etag, timeout=timeout)
+        except Exception as ex:  # pragma: no cover
+            # Return function call instead.
+            current_app.logger.exception(ex)
+            return func(*args, **kargs)
+
+        response = current_app.make_response(result)
+        response.set_etag(etag, weak=True)
+        self.set_status_header(response, hit)
+
+        return response
+
+    def call_cached(self, func, args, kargs, key_prefix, timeout,
+                    unless=None):
+        """Return ``(result, hit)`` of calling view `func` through the cache
+        where `hit` is whether the cached result was returned instead of
+        calling `func`.
+        """
+        called = []
+
+        # pylint: disable=missing-docstring
+        @wraps(func)
+        def call(*args, **kargs):
+            called.append(True)
+            return func(*args, **kargs)
+
+        result = self.cached(timeout=timeout,
+                             key_prefix=key_prefix,
+                             unless=unless)(call)(*args, **kargs)
+
+        return (result, not called)
+
+    def set_status_header(self, response, hit):
+        """Set CARAFE_CACHE_STATUS_HEADER (if configured) of cached view
+        `response` to ``HIT`` or ``MISS``.
+        """
+        if self.status_header:
+            response.headers[self.status_header] = 'HIT' if hit else 'MISS'
+
     def create_view_path(self, include_request_args=False):
         """Construct view path from request.path with option to include GET
         args.
         """
         href = urls.Href(request.path)
 
+        ignored = current_app.config['CARAFE_CACHE_IGNORED_REQUEST_ARGS']
+
         if include_request_args:
-            ignored = current_app.config['CARAFE_CACHE_IGNORED_REQUEST_ARGS']
             args = dict((k, v) for k, v in request.args.lists()
                         if k not in ignored)
         else:
-            args = None
+            args = {}
+
+        # Sparse fieldsets always change the response so they are always part
+        # of the key but in a canonical form so that equivalent field
+        # specifications share the same key.
+        for key, value in self.get_fieldset_args().items():
+            if key not in ignored:
+                args[key] = value
+
+        return href(args or None)
+
+    def get_fieldset_args(self):
+        """Return request's sparse fieldset args (if any) formatted
+        canonically.
+        """
+        args = {}
+
+        for attr in ('fields', 'exclude'):
+            arg = getattr(request, attr + '_arg', None)
+            tree = getattr(request, attr, None)
+
+            if arg and tree:
+                args[arg] = format_fields(tree)
 
-        return href(args)
+        return args
 
     def on_modified_record(self, sender):
         """Common tasks to perform when a record is modified."""
@@ -1,7 +1,16 @@
 """Flask extension which integrates additional loggers with Flask app.
 """
 
+import copy
+import hashlib
 import logging
+import re
+import smtplib
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+from email.utils import formatdate
 from logging import getLogger, Formatter
 from logging.handlers import (
     SMTPHandler as SMTPHandlerBase,
@@ -9,8 +18,19 @@ from logging.handlers import (
 )
 import pprint
 from functools import partial
+from Queue import Queue, Full, Empty
+from threading import Lock, Thread, Timer
+from time import time, strftime, localtime
 
-from flask import request, current_app
+from flask import request, current_app, has_request_context, g, json
+from werkzeug.exceptions import HTTPException
+
+from ..request import RequestBody
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
 
 
 # Universal error message format for custom logger handlers. Any handler who
@@ -40,6 +60,13 @@ WARNING_FORMAT = (
     '%(asctime)s: %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
 
 
+# Value which replaces redacted data.
+REDACTED = '[REDACTED]'
+
+# Valid request ids taken from request headers.
+REQUEST_ID_PATTERN = re.compile(r'^[\w.:-]{1,128}$')
+
+
 # default pprint.pformat function to use to output request environ
 # pylint: disable=invalid-name
 pformat = partial(pprint.pformat, indent=4, depth=None)
@@ -56,25 +83,77 @@ class Logger(object):
             self.init_app(app)
 
     def init_app(self, app):
-        """Initialize app."""
+        """Initialize app. If CARAFE_LOGGER_QUEUE_ENABLED, each handler is
+        wrapped in a `QueueHandler` so that it doesn't block requests.
+        """
         app.config.setdefault('CARAFE_LOGGER_ENABLED', True)
+        app.config.setdefault('CARAFE_LOGGER_QUEUE_ENABLED', False)
+        app.config.setdefault('CARAFE_LOGGER_QUEUE_SIZE', 1000)
+        app.config.setdefault('CARAFE_LOGGER_QUEUE_DROP', 'new')
+        app.config.setdefault('CARAFE_LOGGER_QUEUE_FLUSH_TIMEOUT', 5)
+        app.config.setdefault('CARAFE_LOGGER_REQUEST_ID_HEADER', 'X-Request-Id')
 
         if not app.config['CARAFE_LOGGER_ENABLED']:  # pragma: no cover
             return
 
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
         if app.config.get('CARAFE_LOGGER_RFILE_ENABLED'):
             loggers = ([app.logger] +
                        app.config.get('CARAFE_LOGGER_RFILE_ADD_LOGGERS', []))
 
             self.add_handlers(
-                loggers, create_rotating_file_handler(app.config))
+                loggers,
+                self.wrap_handler(app, create_rotating_file_handler(app.config)))
 
         if app.config.get('CARAFE_LOGGER_SMTP_ENABLED'):
             loggers = ([app.logger] +
                        app.config.get('CARAFE_LOGGER_SMTP_ADD_LOGGERS', []))
 
             self.add_handlers(
-                loggers, create_email_handler(app.config))
+                loggers,
+                self.wrap_handler(app, create_email_handler(app.config)))
+
+    def before_request(self):  # pylint: disable=no-self-use
+        """Set request's correlation id (from the request id header if it's
+        valid) and start time.
+        """
+        header = current_app.config['CARAFE_LOGGER_REQUEST_ID_HEADER']
+        request_id = request.headers.get(header) if header else None
+
+        if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+
+        g.carafe_request_id = request_id
+        g.carafe_request_started = time()
+
+    def after_request(self, response):  # pylint: disable=no-self-use
+        """Propagate request's correlation id to response header and note
+        response status for logging.
+        """
+        header = current_app.config['CARAFE_LOGGER_REQUEST_ID_HEADER']
+        request_id = getattr(g, 'carafe_request_id', None)
+
+        if header and request_id:
+            response.headers[header] = request_id
+
+        g.carafe_response_status = response.status_code
+
+        return response
+
+    def wrap_handler(self, app, handler):  # pylint: disable=no-self-use
+        """Return `handler` wrapped in a `QueueHandler` if
+        CARAFE_LOGGER_QUEUE_ENABLED.
+        """
+        if not app.config['CARAFE_LOGGER_QUEUE_ENABLED']:
+            return handler
+
+        return QueueHandler(
+            [handler],
+            maxsize=app.config['CARAFE_LOGGER_QUEUE_SIZE'],
+            drop=app.config['CARAFE_LOGGER_QUEUE_DROP'],
+            flush_timeout=app.config['CARAFE_LOGGER_QUEUE_FLUSH_TIMEOUT'])
 
     def add_handlers(self, loggers, handlers):
         """Attach additional logging handlers to loggers."""
@@ -98,21 +177,193 @@ class Logger(object):
 
 class EnvironDataMixin(object):
     """Mixin class that exposes request data to log format."""
+    # Keyword arguments of `RequestEnviron` (e.g. its size caps).
+    environ_options = {}
 
     def get_request_environ(self):
         """Return copy of request data for debugging purposes."""
-        environ = request.environ.copy()
-        environ.update({
-            'REQUEST_BODY': request.get_data(),
-            'REQUEST_DATA': request.data,
-            'REQUEST_JSON': request.get_json(silent=True),
-            'REQUEST_FORM': request.form.to_dict(),
-            'REQUEST_FILES': request.files.to_dict(),
-            'REQUEST_HEADERS': dict(request.headers),
-            'REQUEST_ARGS': request.args.to_dict()
+        return RequestEnviron(**self.environ_options).capture()
+
+    def prepare_record(self, record):
+        """Attach lazy request environ data to log record unless it's already
+        attached (e.g. when it was queued by `QueueHandler`).
+        """
+        if not hasattr(record, 'environ'):
+            record.environ = RequestEnviron(**self.environ_options)
+
+    def uses_environ(self):
+        """Whether handler's formatter renders ``%(environ)s``."""
+        # pylint: disable=protected-access
+        return (self.formatter is not None and
+                '%(environ)' in self.formatter._fmt)
+
+
+class RequestEnviron(object):
+    """Request environ data of the current request which is only captured and
+    rendered once it's formatted (e.g. by ``%(environ)s``). `capture()` has to
+    be called while the request context is available if it's formatted later
+    (e.g. in another thread).
+
+    String values are truncated to `max_field_length` characters and the
+    rendered data (or its JSON, see `get_json_data()`) to `max_length`
+    characters. Bodies longer than
+    `max_body_length` bytes aren't read, multipart bodies aren't captured
+    (only their form fields and file names are), and binary bodies are
+    skipped. Values of `redact_headers` are replaced with ``[REDACTED]``.
+    """
+    def __init__(self, max_field_length=1024, max_body_length=64 * 1024,
+                 max_length=16 * 1024, redact_headers=('Authorization',
+                                                       'Cookie')):
+        self.max_field_length = max_field_length
+        self.max_body_length = max_body_length
+        self.max_length = max_length
+        self.redact_headers = redact_headers
+        self.captured = False
+        self.data = None
+        self.rendered = None
+        self.json_data = None
+
+    def __str__(self):
+        """Return rendered environ data (or ``''`` if there's no request)."""
+        if self.rendered is None:
+            data = self.capture()
+            self.rendered = truncate(pformat(data) if data is not None else '',
+                                     self.max_length)
+        return self.rendered
+
+    def get_json_data(self):
+        """Return captured data converted to JSON types (or ``None``) with
+        only as many keys as fit into `max_length` characters of JSON.
+        Request data and path keys are included first and the number of
+        omitted keys is noted as ``OMITTED``.
+        """
+        if self.json_data is None and self.data is not None:
+            data = jsonable(self.data)
+            keys = sorted(data, key=lambda key: (
+                not key.startswith(('REQUEST_', 'PATH_INFO', 'QUERY_STRING')),
+                key))
+            self.json_data = {}
+            length = 2
+
+            for key in keys:
+                # Length of key's item including its separator.
+                item_length = len(dumps({key: data[key]})) - 1
+
+                if (self.max_length is not None and
+                        length + item_length > self.max_length):
+                    continue
+
+                self.json_data[key] = data[key]
+                length += item_length
+
+            if len(self.json_data) < len(data):
+                self.json_data['OMITTED'] = len(data) - len(self.json_data)
+
+        return self.json_data
+
+    def capture(self):
+        """Capture and return environ data of current request (or ``None``
+        if there's no request).
+        """
+        if not self.captured and has_request_context():
+            self.captured = True
+            self.data = self.get_data()
+        return self.data
+
+    def get_data(self):
+        """Return capped copy of request data."""
+        redact = set(header.lower() for header in self.redact_headers)
+        redact_keys = set('HTTP_' + header.upper().replace('-', '_')
+                          for header in self.redact_headers)
+
+        data = dict((key, REDACTED if key in redact_keys else self.cap(value))
+                    for key, value in request.environ.items())
+
+        data.update(self.get_body_data())
+        data.update({
+            'REQUEST_HEADERS': dict(
+                (key, REDACTED if key.lower() in redact else self.cap(value))
+                for key, value in request.headers.items()),
+            'REQUEST_ARGS': dict((key, self.cap(value))
+                                 for key, value in request.args.items())
         })
 
-        return environ
+        return data
+
+    def get_body_data(self):
+        """Return capped request body data."""
+        length = request.content_length or 0
+
+        if length > self.max_body_length:
+            return {'REQUEST_BODY': '[{0} bytes not captured]'.format(length)}
+
+        if request.mimetype == 'multipart/form-data':
+            return {
+                'REQUEST_BODY': '[multipart body not captured]',
+                'REQUEST_FORM': self.cap(request.form.to_dict()),
+                'REQUEST_FILES': dict(
+                    (key, '{0} ({1})'.format(value.filename,
+                                             value.content_type))
+                    for key, value in request.files.items())
+            }
+
+        body = getattr(request, 'body', None)
+
+        try:
+            if isinstance(body, RequestBody):
+                # Share the request's already parsed body.
+                raw, json, form, data = (body.raw, body.json, body.form_dict,
+                                         body.dict)
+            else:
+                raw, json, form, data = (request.get_data(),
+                                         request.get_json(silent=True),
+                                         request.form.to_dict(),
+                                         request.data)
+        except HTTPException:
+            # Body exceeds request limits.
+            return {'REQUEST_BODY': '[invalid body not captured]'}
+
+        try:
+            raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'REQUEST_BODY': '[{0} bytes of binary data]'.format(
+                len(raw))}
+
+        return {
+            'REQUEST_BODY': self.cap(raw),
+            'REQUEST_DATA': self.cap(data),
+            'REQUEST_JSON': self.cap(json),
+            'REQUEST_FORM': self.cap(form),
+            'REQUEST_FILES': {}
+        }
+
+    def cap(self, value):
+        """Return `value` truncated to `max_field_length` characters if it's a
+        string or else its truncated representation if that's too long.
+        """
+        if isinstance(value, basestring):
+            return truncate(value, self.max_field_length)
+
+        if isinstance(value, (dict, list, tuple)):
+            text = repr(value)
+            if len(text) > self.max_field_length:
+                return truncate(text, self.max_field_length)
+
+        return value
+
+
+def truncate(text, length):
+    """Return `text` truncated to `length` characters noting the number of
+    truncated characters.
+
+    >>> truncate('abcdef', 3)
+    'abc...[3 more]'
+    >>> truncate('abc', 3)
+    'abc'
+    """
+    if length is None or len(text) <= length:
+        return text
+    return '{0}...[{1} more]'.format(text[:length], len(text) - length)
 
 
 class SMTPHandler(SMTPHandlerBase, EnvironDataMixin):
@@ -122,17 +373,251 @@ class SMTPHandler(SMTPHandlerBase, EnvironDataMixin):
 
     def getSubject(self, record):
         """Override with custom subject."""
-        return '[{0}] Application Error: {1}'.format(
-            current_app.name, request.url)
+        return record.subject
+
+    def prepare_record(self, record):
+        """Attach request environ data and email subject to log record."""
+        super(SMTPHandler, self).prepare_record(record)
+
+        if hasattr(record, 'subject'):
+            return
+
+        if has_request_context():
+            record.subject = '[{0}] Application Error: {1}'.format(
+                current_app.name, request.url)
+        else:
+            record.subject = self.subject
 
     def emit(self, record):
         """Override parent method and attach request environ data to
         log record.
         """
-        record.environ = pformat(self.get_request_environ())
+        self.prepare_record(record)
         super(SMTPHandler, self).emit(record)
 
 
+class DigestSMTPHandler(SMTPHandler):
+    """SMTP handler which aggregates records by `fingerprint()` into digest
+    emails instead of sending one email per record.
+
+    A fingerprint's first record opens a `window` second window whose records
+    are counted (keeping up to `samples` request environs) and sent as one
+    digest once the window closes. At most `fingerprint_limit` digests per
+    fingerprint and `global_limit` emails overall are sent per `rate_period`
+    seconds. Rate limited digests keep aggregating into the next window.
+    """
+    def __init__(self, *args, **kargs):
+        self.window = kargs.pop('window', 60)
+        self.samples = kargs.pop('samples', 3)
+        self.fingerprint_limit = kargs.pop('fingerprint_limit', 6)
+        self.global_limit = kargs.pop('global_limit', 60)
+        self.rate_period = kargs.pop('rate_period', 3600)
+
+        super(DigestSMTPHandler, self).__init__(*args, **kargs)
+
+        self.digests = {}
+        self.sent = deque()
+        self.fingerprint_sent = {}
+        self.timer = None
+
+    def prepare_record(self, record):
+        """Attach request environ data, email subject, and fingerprint to log
+        record.
+        """
+        super(DigestSMTPHandler, self).prepare_record(record)
+
+        if not hasattr(record, 'fingerprint'):
+            record.fingerprint = fingerprint(record)
+
+    def emit(self, record):
+        """Add record to its fingerprint's digest."""
+        try:
+            self.prepare_record(record)
+            self.add(record, time())
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def add(self, record, now):
+        """Add `record` to its fingerprint's digest at time `now`."""
+        digest = self.digests.get(record.fingerprint)
+
+        if digest is None:
+            digest = self.digests[record.fingerprint] = {
+                'record': record,
+                'message': self.format(record),
+                'count': 0,
+                'first': now,
+                'closes': now + self.window,
+                'samples': []
+            }
+            self.schedule()
+
+        digest['count'] += 1
+        digest['last'] = now
+
+        if len(digest['samples']) < self.samples:
+            # Render while the request context is available.
+            digest['samples'].append(str(record.environ))
+
+    def schedule(self):
+        """Start timer which sends digests once their window closes."""
+        if self.timer is not None and self.timer.is_alive():
+            return
+
+        if not self.digests:
+            return
+
+        delay = min(digest['closes'] for digest in self.digests.values())
+
+        self.timer = Timer(max(delay - time(), 0), self.send_due)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def send_due(self, force=False):
+        """Send digests whose window has closed (or all if `force`) unless
+        they are rate limited.
+        """
+        now = time()
+        due = []
+
+        self.acquire()
+        try:
+            for key, digest in list(self.digests.items()):
+                if not force and digest['closes'] > now:
+                    continue
+
+                if self.allow(key, now):
+                    due.append(self.digests.pop(key))
+                else:
+                    digest['closes'] = now + self.window
+
+            self.timer = None
+            self.schedule()
+        finally:
+            self.release()
+
+        for digest in due:
+            try:
+                self.send(self.get_digest_subject(digest),
+                          self.format_digest(digest))
+            except Exception:  # pylint: disable=broad-except
+                self.handleError(digest['record'])
+
+    def allow(self, key, now):
+        """Return whether a digest of fingerprint `key` may be sent at time
+        `now` and count it as sent if so.
+        """
+        start = now - self.rate_period
+        sent = self.fingerprint_sent.setdefault(key, deque())
+
+        for timestamps in (self.sent, sent):
+            while timestamps and timestamps[0] <= start:
+                timestamps.popleft()
+
+        if len(self.sent) >= self.global_limit:
+            return False
+
+        if len(sent) >= self.fingerprint_limit:
+            return False
+
+        self.sent.append(now)
+        sent.append(now)
+
+        return True
+
+    def get_digest_subject(self, digest):  # pylint: disable=no-self-use
+        """Return email subject of `digest`."""
+        subject = digest['record'].subject
+
+        if digest['count'] > 1:
+            subject = '({0}x) {1}'.format(digest['count'], subject)
+
+        return subject
+
+    def format_digest(self, digest):  # pylint: disable=no-self-use
+        """Return email body of `digest`."""
+        summary = '{0} occurrence(s) of error {1} from {2} to {3}'.format(
+            digest['count'],
+            digest['record'].fingerprint,
+            strftime('%Y-%m-%d %H:%M:%S', localtime(digest['first'])),
+            strftime('%Y-%m-%d %H:%M:%S', localtime(digest['last'])))
+        parts = [summary, digest['message']]
+
+        for environ in digest['samples'][1:]:
+            parts.append('SAMPLE REQUEST:\n\n{0}'.format(environ))
+
+        return '\n\n'.join(parts)
+
+    def send(self, subject, body):
+        """Send email with `subject` and `body`."""
+        smtp = smtplib.SMTP(self.mailhost, self.mailport or smtplib.SMTP_PORT,
+                            timeout=self._timeout)
+        msg = 'From: {0}\r\nTo: {1}\r\nSubject: {2}\r\nDate: {3}\r\n\r\n{4}'.format(
+            self.fromaddr, ','.join(self.toaddrs), subject, formatdate(), body)
+
+        if self.username:
+            if self.secure is not None:
+                smtp.ehlo()
+                smtp.starttls(*self.secure)
+                smtp.ehlo()
+            smtp.login(self.username, self.password)
+
+        smtp.sendmail(self.fromaddr, self.toaddrs, msg)
+        smtp.quit()
+
+    def flush(self):
+        """Send all digests which aren't rate limited."""
+        self.send_due(force=True)
+
+    def close(self):
+        """Send pending digests and stop timer."""
+        timer = self.timer
+
+        if timer is not None:
+            timer.cancel()
+
+        self.flush()
+
+        if self.timer is not None:
+            self.timer.cancel()
+
+        super(DigestSMTPHandler, self).close()
+
+
+def fingerprint(record):
+    """Return fingerprint of log record by exception type, location (where the
+    exception was raised or else logged) and message template (with numbers
+    masked).
+
+    >>> def record(msg, lineno=10):
+    ...     return logging.LogRecord('app', logging.ERROR, 'app.py', lineno,
+    ...                              msg, None, None)
+    >>> timeout = fingerprint(record('Timeout after 5s'))
+    >>> timeout == fingerprint(record('Timeout after 10s'))
+    True
+    >>> timeout == fingerprint(record('Timeout after 5s', lineno=20))
+    False
+    """
+    template = record.msg
+
+    if not isinstance(template, unicode):
+        template = str(template).decode('utf-8', 'replace')
+
+    parts = [record.name, re.sub(r'\d+', '#', template)]
+
+    if record.exc_info and record.exc_info[0]:
+        exc_type, _, trace = record.exc_info
+        parts.append('{0}.{1}'.format(exc_type.__module__, exc_type.__name__))
+
+        frames = traceback.extract_tb(trace) if trace else []
+        if frames:
+            parts.append('{0}:{1}'.format(frames[-1][0], frames[-1][1]))
+    else:
+        parts.append('{0}:{1}'.format(record.pathname, record.lineno))
+
+    return hashlib.sha1(u'\n'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+
 class RotatingFileHandler(RotatingFileHandlerBase, EnvironDataMixin):
     """Override `emit()` function so that request data is available to log
     formatter.
@@ -141,10 +626,277 @@ class RotatingFileHandler(RotatingFileHandlerBase, EnvironDataMixin):
         """Override parent method and attach request environ data to
         log record
         """
-        record.environ = pformat(self.get_request_environ())
+        self.prepare_record(record)
         super(RotatingFileHandler, self).emit(record)
 
 
+class JSONFormatter(Formatter):
+    """Formatter which formats records as compact JSON objects with the
+    record's time, level, logger, location, message, and exception and the
+    request's correlation id, method, path, status, user id, and duration (in
+    milliseconds) so far. Request environ data (see `RequestEnviron`) is
+    included for records of at least `environ_level`. Uses ``ujson`` if it's
+    installed.
+    """
+    def __init__(self, environ_level=logging.ERROR):
+        super(JSONFormatter, self).__init__()
+        self.environ_level = environ_level
+
+    def prepare_record(self, record):  # pylint: disable=no-self-use
+        """Attach request data to log record unless it's already attached
+        (e.g. when it was queued by `QueueHandler`).
+        """
+        if hasattr(record, 'request_data'):
+            return
+
+        record.request_data = {}
+
+        if not has_request_context():
+            return
+
+        identity = getattr(g, 'identity', None)
+        started = getattr(g, 'carafe_request_started', None)
+
+        record.request_data = {
+            'request_id': getattr(g, 'carafe_request_id', None),
+            'method': request.method,
+            'path': request.path,
+            'status': getattr(g, 'carafe_response_status', None),
+            'user_id': getattr(identity, 'id', None),
+            'duration': (round((time() - started) * 1000, 3)
+                         if started is not None else None)
+        }
+
+        if (record.levelno >= self.environ_level and
+                isinstance(getattr(record, 'environ', None), RequestEnviron)):
+            record.environ.capture()
+
+    def format(self, record):
+        """Return record as JSON."""
+        self.prepare_record(record)
+
+        data = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'location': '{0}:{1}'.format(record.pathname, record.lineno),
+            'function': record.funcName,
+            'message': record.getMessage()
+        }
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        for key, value in record.request_data.items():
+            if value is not None:
+                data[key] = value
+
+        environ = getattr(record, 'environ', None)
+
+        if (record.levelno >= self.environ_level and
+                isinstance(environ, RequestEnviron) and
+                environ.data is not None):
+            data['environ'] = environ.get_json_data()
+
+        return dumps(data)
+
+
+def jsonable(value):
+    """Return `value` with values which aren't JSON types converted to
+    strings.
+
+    >>> jsonable({'a': [1, None, object]})
+    {'a': [1, None, "<type 'object'>"]}
+    """
+    if isinstance(value, dict):
+        return dict((key if isinstance(key, basestring) else str(key),
+                     jsonable(item))
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    elif value is None or isinstance(value, (basestring, int, long, float)):
+        return value
+    else:
+        return str(value)
+
+
+def dumps(data):
+    """Return compact JSON of `data` (using ``ujson`` if it's installed)."""
+    if ujson is not None:  # pragma: no cover
+        return ujson.dumps(data)
+    return json.dumps(data, separators=(',', ':'))
+
+
+def get_request_id():
+    """Return correlation id of current request (or ``None``)."""
+    return getattr(g, 'carafe_request_id', None) if has_request_context() else None
+
+
+class QueueHandler(logging.Handler):
+    """Handler which puts records on a queue of up to `maxsize` records which
+    a background listener thread passes to `handlers`. Logging then doesn't
+    block the logging thread on slow handlers (e.g. SMTP).
+
+    Records are prepared for `handlers` when they are queued since the
+    request context is gone once they are handled. When the queue is full,
+    either the new record is dropped or the oldest queued one if `drop` is
+    ``'old'``. Dropped records are counted in `dropped`. Queued records are
+    flushed when the handler is closed (e.g. by `logging.shutdown()` at
+    exit) waiting up to `flush_timeout` seconds.
+    """
+    def __init__(self, handlers, maxsize=1000, drop='new', flush_timeout=5):
+        if drop not in ('new', 'old'):
+            raise ValueError('Unknown drop policy: {0}'.format(drop))
+
+        logging.Handler.__init__(
+            self, min(handler.level for handler in handlers))
+
+        self.handlers = handlers
+        self.queue = Queue(maxsize)
+        self.drop = drop
+        self.flush_timeout = flush_timeout
+        self.dropped = 0
+        self.thread = None
+        self.closed = False
+        self._lock = Lock()
+
+    def prepare(self, record):
+        """Return copy of `record` prepared for handling in the listener
+        thread by attaching request data and merging its arguments and
+        exception into its message. The record itself isn't modified since
+        it's shared with the logger's other handlers.
+        """
+        record = copy.copy(record)
+
+        for handler in self.handlers:
+            if isinstance(handler, EnvironDataMixin):
+                handler.prepare_record(record)
+
+                if (handler.uses_environ() and
+                        isinstance(record.environ, RequestEnviron)):
+                    record.environ.capture()
+
+            # Formatters may need request data too (e.g. `JSONFormatter`).
+            prepare = getattr(handler.formatter, 'prepare_record', None)
+            if prepare is not None:
+                prepare(record)
+
+        # Format like the default formatter so that the message includes the
+        # traceback and doesn't reference mutable arguments.
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+
+        return record
+
+    def emit(self, record):
+        """Queue `record` without blocking."""
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def enqueue(self, record):
+        """Put `record` on queue dropping a record if it's full."""
+        self.start()
+
+        try:
+            self.queue.put_nowait(record)
+            return
+        except Full:
+            pass
+
+        if self.drop == 'old':
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except Empty:  # pragma: no cover
+                pass
+
+            try:
+                self.queue.put_nowait(record)
+            except Full:  # pragma: no cover
+                pass
+
+        with self._lock:
+            self.dropped += 1
+
+    def start(self):
+        """Start listener thread unless it's running (e.g. it's not running in
+        a forked worker process).
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.listen)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def listen(self):
+        """Pass queued records to handlers until ``None`` is queued."""
+        while True:
+            record = self.queue.get()
+
+            try:
+                if record is None:
+                    return
+
+                self.handle_record(record)
+            finally:
+                self.queue.task_done()
+
+    def handle_record(self, record):
+        """Pass `record` to the handlers whose level it meets."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:  # pylint: disable=broad-except
+                    handler.handleError(record)
+
+    def flush(self):
+        """Wait up to `flush_timeout` seconds for queued records to be
+        handled.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+
+        deadline = time() + self.flush_timeout
+        done = self.queue.all_tasks_done
+
+        with done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+
+    def close(self):
+        """Flush queued records, stop listener thread, and close handlers."""
+        if not self.closed:
+            self.closed = True
+            self.flush()
+
+            if self.thread is not None and self.thread.is_alive():
+                try:
+                    self.queue.put_nowait(None)
+                    self.thread.join(self.flush_timeout)
+                except Full:  # pragma: no cover
+                    pass
+
+            for handler in self.handlers:
+                handler.close()
+
+        logging.Handler.close(self)
+
+    def stats(self):
+        """Return number of queued and dropped records."""
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped}
+
+
 def create_rotating_file_handler(config):
     """Create a rotating file logger handler."""
     kargs = {
@@ -157,10 +909,14 @@ def create_rotating_file_handler(config):
     }
 
     handler = RotatingFileHandler(**kargs)
+    handler.environ_options = create_environ_options(config)
     handler.setLevel(
         getattr(logging, config.get('CARAFE_LOGGER_RFILE_LEVEL', 'WARNING')))
 
-    handler.setFormatter(Formatter(WARNING_FORMAT))
+    if config.get('CARAFE_LOGGER_RFILE_FORMAT', 'text') == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(Formatter(WARNING_FORMAT))
 
     return handler
 
@@ -189,10 +945,38 @@ def create_email_handler(config):
         'secure': () if config.get('CARAFE_LOGGER_SMTP_USE_TLS') else None
     }
 
-    handler = SMTPHandler(**kargs)
+    if config.get('CARAFE_LOGGER_SMTP_DIGEST_ENABLED'):
+        kargs.update({
+            'window': config.get('CARAFE_LOGGER_SMTP_DIGEST_WINDOW', 60),
+            'samples': config.get('CARAFE_LOGGER_SMTP_DIGEST_SAMPLES', 3),
+            'fingerprint_limit': config.get(
+                'CARAFE_LOGGER_SMTP_DIGEST_FINGERPRINT_LIMIT', 6),
+            'global_limit': config.get(
+                'CARAFE_LOGGER_SMTP_DIGEST_GLOBAL_LIMIT', 60),
+            'rate_period': config.get(
+                'CARAFE_LOGGER_SMTP_DIGEST_RATE_PERIOD', 3600)
+        })
+        handler = DigestSMTPHandler(**kargs)
+    else:
+        handler = SMTPHandler(**kargs)
+    handler.environ_options = create_environ_options(config)
     handler.setLevel(
         getattr(logging, config.get('CARAFE_LOGGER_SMTP_LEVEL', 'ERROR')))
 
     handler.setFormatter(Formatter(ERROR_FORMAT))
 
     return handler
+
+
+def create_environ_options(config):
+    """Create `RequestEnviron` keyword arguments."""
+    return {
+        'max_field_length': config.get(
+            'CARAFE_LOGGER_ENVIRON_MAX_FIELD_LENGTH', 1024),
+        'max_body_length': config.get(
+            'CARAFE_LOGGER_ENVIRON_MAX_BODY_LENGTH', 64 * 1024),
+        'max_length': config.get('CARAFE_LOGGER_ENVIRON_MAX_LENGTH',
+                                 16 * 1024),
+        'redact_headers': config.get('CARAFE_LOGGER_ENVIRON_REDACT_HEADERS',
+                                     ['Authorization', 'Cookie'])
+    }
@@ -0,0 +1,337 @@
+"""Flask extension which records request timing metrics per URL rule.
+"""
+
+import resource
+import sys
+from bisect import bisect_left
+from threading import Lock, current_thread, local
+from time import time
+from weakref import ref
+
+from flask import request, current_app, json, g
+
+
+# Resource usage of the calling thread where supported (i.e. Linux).
+# pylint: disable=invalid-name
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD',
+                        1 if sys.platform.startswith('linux')
+                        else resource.RUSAGE_SELF)
+# pylint: enable=invalid-name
+
+
+def cpu_time():
+    """Return CPU time (in seconds) of the calling thread (or the process if
+    per thread usage isn't supported).
+    """
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Metrics(object):
+    """Metrics extension. Records wall time, CPU time, response size, and
+    status of each request keyed by the request's method and URL rule (not
+    its path) into fixed bucket histograms of CARAFE_METRICS_BUCKETS (in
+    milliseconds).
+
+    Each thread records into its own histograms so that requests don't
+    contend on a lock. Histograms of all threads are merged into a snapshot
+    on demand (see `snapshot()`), which is served as JSON from
+    CARAFE_METRICS_URL and can be logged with `log_snapshot()`. Requests
+    slower than CARAFE_METRICS_SLOW_THRESHOLD milliseconds are logged as
+    warnings.
+    """
+    _extension_name = 'carafe.metrics'
+
+    def __init__(self, app=None):
+        self.app = app
+        self.sources = {}
+
+        if app:  # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize app."""
+        app.config.setdefault('CARAFE_METRICS_ENABLED', False)
+        app.config.setdefault('CARAFE_METRICS_BUCKETS',
+                              [5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+                               5000, 10000])
+        app.config.setdefault('CARAFE_METRICS_SLOW_THRESHOLD', 1000)
+        app.config.setdefault('CARAFE_METRICS_URL', '/_metrics')
+
+        if not app.config['CARAFE_METRICS_ENABLED']:
+            return
+
+        if not hasattr(app, 'extensions'):  # pragma: no cover
+            app.extensions = {}
+
+        app.extensions[self._extension_name] = MetricsRegistry(
+            app.config['CARAFE_METRICS_BUCKETS'])
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+        if app.config['CARAFE_METRICS_URL']:
+            app.add_url_rule(app.config['CARAFE_METRICS_URL'],
+                             self._extension_name,
+                             self.snapshot_view)
+
+    @property
+    def registry(self):
+        """Property access to app's metrics registry."""
+        return current_app.extensions[self._extension_name]
+
+    def add_source(self, name, func):
+        """Include the result of calling `func` (e.g. ``auth.metrics`` or
+        identity cache stats) as `name` in snapshots.
+        """
+        self.sources[name] = func
+
+    def before_request(self):  # pylint: disable=no-self-use
+        """Start request timers."""
+        g.carafe_metrics_started = (time(), cpu_time())
+
+    def after_request(self, response):
+        """Record request with response's status and size (unless it's
+        streamed).
+        """
+        size = response.content_length
+
+        if size is None and not response.is_streamed:
+            size = len(response.get_data())
+
+        self.record(response.status_code, size)
+        return response
+
+    def teardown_request(self, exc=None):
+        """Record request which failed before it had a response."""
+        if getattr(g, 'carafe_metrics_started', None) is not None:
+            self.record(500, None)
+
+    def record(self, status, size):
+        """Record current request's timing, `status`, and `size`."""
+        started = getattr(g, 'carafe_metrics_started', None)
+
+        if started is None:
+            return
+
+        g.carafe_metrics_started = None
+
+        wall = (time() - started[0]) * 1000
+        cpu = (cpu_time() - started[1]) * 1000
+        rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+        key = '{0} {1}'.format(request.method, rule)
+
+        self.registry.add(key, wall, cpu, size, status)
+
+        threshold = current_app.config['CARAFE_METRICS_SLOW_THRESHOLD']
+
+        if threshold is not None and wall >= threshold:
+            current_app.logger.warning(
+                'Slow request: %s %s (%s) took %.1f ms (%.1f ms CPU)',
+                request.method, request.path, rule, wall, cpu)
+
+    def snapshot(self):
+        """Return merged metrics of all threads and sources."""
+        data = self.registry.snapshot()
+
+        for name, func in self.sources.items():
+            data[name] = func()
+
+        return data
+
+    def snapshot_view(self):
+        """Metrics snapshot endpoint view."""
+        return self.snapshot()
+
+    def log_snapshot(self):
+        """Log metrics snapshot as JSON (e.g. periodically from a worker)."""
+        current_app.logger.info('Request metrics: %s',
+                                json.dumps(self.snapshot(), sort_keys=True))
+
+
+class MetricsRegistry(object):
+    """Per app histograms of each thread keyed by request key. Histograms of
+    finished threads are merged into `retired` so that they aren't held per
+    thread forever.
+    """
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.started = time()
+        self.local = local()
+        self.threads = []
+        self.retired = {}
+        self.lock = Lock()
+
+    def get_histograms(self):
+        """Return histograms of calling thread."""
+        histograms = getattr(self.local, 'histograms', None)
+
+        if histograms is None:
+            histograms = self.local.histograms = {}
+
+            # Only locked once per thread.
+            with self.lock:
+                self.prune()
+                self.threads.append((ref(current_thread()), histograms))
+
+        return histograms
+
+    def prune(self):
+        """Merge histograms of finished threads into `retired`. Must be called
+        with `lock` held.
+        """
+        alive = []
+
+        for thread, histograms in self.threads:
+            thread = thread()
+
+            if thread is not None and thread.is_alive():
+                alive.append((ref(thread), histograms))
+            else:
+                self.merge(self.retired, histograms)
+
+        self.threads = alive
+
+    def merge(self, merged, histograms):
+        """Merge `histograms` into `merged` histograms."""
+        for key, histogram in histograms.items():
+            if key not in merged:
+                merged[key] = Histogram(self.bounds)
+            merged[key].merge(histogram)
+
+    def add(self, key, wall, cpu, size, status):
+        """Add request to calling thread's histogram of `key`."""
+        histograms = self.get_histograms()
+        histogram = histograms.get(key)
+
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.bounds)
+
+        histogram.add(wall, cpu, size, status)
+
+    def snapshot(self):
+        """Return merged histograms of all threads."""
+        merged = {}
+
+        with self.lock:
+            self.prune()
+            self.merge(merged, self.retired)
+            threads = list(self.threads)
+
+        for _, histograms in threads:
+            self.merge(merged, histograms)
+
+        return {
+            'uptime': round(time() - self.started, 3),
+            'endpoints': dict((key, histogram.to_dict())
+                              for key, histogram in merged.items())
+        }
+
+
+class Histogram(object):
+    """Fixed bucket histogram of request wall times (in milliseconds) with
+    CPU time, response size, and status counts. The last bucket holds wall
+    times above the highest of `bounds`.
+    """
+    __slots__ = ('bounds', 'buckets', 'count', 'wall', 'wall_max', 'cpu',
+                 'size', 'sized', 'statuses')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.wall = 0.0
+        self.wall_max = 0.0
+        self.cpu = 0.0
+        self.size = 0
+        self.sized = 0
+        self.statuses = {}
+
+    def add(self, wall, cpu, size, status):
+        """Add request."""
+        self.buckets[bisect_left(self.bounds, wall)] += 1
+        self.count += 1
+        self.wall += wall
+        self.wall_max = max(self.wall_max, wall)
+        self.cpu += cpu
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        if size is not None:
+            self.size += size
+            self.sized += 1
+
+    def merge(self, other):
+        """Add requests of `other` histogram."""
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+
+        self.count += other.count
+        self.wall += other.wall
+        self.wall_max = max(self.wall_max, other.wall_max)
+        self.cpu += other.cpu
+        self.size += other.size
+        self.sized += other.sized
+
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def percentile(self, percent):
+        """Return upper bound of bucket which contains the `percent`
+        percentile of wall times clamped to the maximum wall time (which is
+        also returned for the last bucket).
+
+        >>> histogram = Histogram([10, 100])
+        >>> for wall in [1, 2, 50, 500]:
+        ...     histogram.add(wall, 0, None, 200)
+        >>> histogram.percentile(50), histogram.percentile(75)
+        (10, 100)
+        >>> histogram.percentile(99)
+        500.0
+        >>> histogram = Histogram([10, 100])
+        >>> histogram.add(2, 0, None, 200)
+        >>> histogram.percentile(50)
+        2.0
+        """
+        if not self.count:
+            return None
+
+        rank = percent / 100.0 * self.count
+        seen = 0
+
+        wall_max = round(self.wall_max, 3)
+
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], wall_max)
+                break
+
+        return wall_max
+
+    def to_dict(self):
+        """Return histogram summary."""
+        labels = ['le_{0}'.format(bound) for bound in self.bounds] + ['inf']
+
+        return {
+            'count': self.count,
+            'errors': sum(count for status, count in self.statuses.items()
+                          if status >= 500),
+            'statuses': dict((str(status), count)
+                             for status, count in self.statuses.items()),
+            'wall': {
+                'mean': round(self.wall / self.count, 3),
+                'max': round(self.wall_max, 3),
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'buckets': dict(zip(labels, self.buckets))
+            },
+            'cpu': {'mean': round(self.cpu / self.count, 3)},
+            'size': {
+                'total': self.size,
+                'mean': (round(float(self.size) / self.sized, 1)
+                         if self.sized else None)
+            }
+        }
@@ -0,0 +1,378 @@
+"""Flask extension which records a sample of requests to a file for replaying
+against an app (e.g. for realistic performance testing).
+"""
+
+import atexit
+import random
+from Queue import Queue, Full
+from threading import Lock, Thread
+from time import sleep, time
+
+from flask import request, current_app, json, g
+from werkzeug.exceptions import HTTPException
+
+from ..client import JSONClient, make_client_response
+
+
+# Value which replaces redacted data.
+REDACTED = '[REDACTED]'
+
+
+class Recorder(object):
+    """Recorder extension. Writes a sample of requests to
+    CARAFE_RECORDER_FILENAME as JSON lines of ``{time, method, path, args,
+    headers, json|form|data}``. Values of args and body keys containing any of
+    CARAFE_RECORDER_REDACT_KEYS and of recorded headers in
+    CARAFE_RECORDER_REDACT_HEADERS are replaced with ``[REDACTED]``.
+
+    Recordings are queued and written by a background thread so that
+    requests don't wait on file I/O. When the queue is full, recordings are
+    dropped and counted in `dropped`.
+    """
+    _extension_name = 'carafe.recorder'
+
+    def __init__(self, app=None):
+        self.app = app
+        self.lock = Lock()
+        self.files = {}
+        self.queue = Queue()
+        self.thread = None
+        self.dropped = 0
+        self.flush_timeout = 5
+
+        # Write queued recordings at exit.
+        atexit.register(self.close)
+
+        if app:  # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize app."""
+        app.config.setdefault('CARAFE_RECORDER_ENABLED', False)
+        app.config.setdefault('CARAFE_RECORDER_FILENAME', 'requests.jsonl')
+        app.config.setdefault('CARAFE_RECORDER_SAMPLE_RATE', 1.0)
+        app.config.setdefault('CARAFE_RECORDER_HEADERS',
+                              ['Accept', 'Accept-Encoding', 'Content-Type',
+                               'If-None-Match'])
+        app.config.setdefault('CARAFE_RECORDER_REDACT_HEADERS',
+                              ['Authorization', 'Cookie'])
+        app.config.setdefault('CARAFE_RECORDER_REDACT_KEYS',
+                              ['password', 'secret', 'token'])
+        app.config.setdefault('CARAFE_RECORDER_MAX_BODY_LENGTH', 64 * 1024)
+        app.config.setdefault('CARAFE_RECORDER_RAW_BODIES', False)
+        app.config.setdefault('CARAFE_RECORDER_QUEUE_SIZE', 1000)
+        app.config.setdefault('CARAFE_RECORDER_FLUSH_TIMEOUT', 5)
+
+        if not app.config['CARAFE_RECORDER_ENABLED']:
+            return
+
+        if self.thread is None or not self.thread.is_alive():
+            self.queue = Queue(app.config['CARAFE_RECORDER_QUEUE_SIZE'])
+
+        self.flush_timeout = app.config['CARAFE_RECORDER_FLUSH_TIMEOUT']
+
+        if not hasattr(app, 'extensions'):  # pragma: no cover
+            app.extensions = {}
+
+        app.extensions[self._extension_name] = self
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        """Capture sampled request before it's processed. Its body is captured
+        once the view has run (see `teardown_request`).
+        """
+        rate = current_app.config['CARAFE_RECORDER_SAMPLE_RATE']
+
+        if rate < 1 and random.random() >= rate:
+            return
+
+        g.carafe_recording = self.capture()
+
+    def after_request(self, response):  # pylint: disable=no-self-use
+        """Add response status to recording."""
+        recording = getattr(g, 'carafe_recording', None)
+
+        if recording is not None:
+            recording['status'] = response.status_code
+
+        return response
+
+    def teardown_request(self, exc=None):
+        """Add request body to recording and write it once request is
+        finished.
+        """
+        recording = getattr(g, 'carafe_recording', None)
+
+        if recording is not None:
+            g.carafe_recording = None
+            recording.update(self.capture_body())
+            self.write(recording)
+
+    def capture(self):  # pylint: disable=no-self-use
+        """Return recording of the current request without its body."""
+        config = current_app.config
+        redact_headers = [header.lower() for header in
+                          config['CARAFE_RECORDER_REDACT_HEADERS']]
+
+        recording = {
+            'time': round(time(), 3),
+            'method': request.method,
+            'path': request.path
+        }
+
+        if request.args:
+            recording['args'] = redact(dict(request.args.lists()),
+                                       get_redact_keys())
+
+        headers = {}
+
+        for header in config['CARAFE_RECORDER_HEADERS']:
+            if header in request.headers:
+                headers[header] = (REDACTED
+                                   if header.lower() in redact_headers
+                                   else request.headers[header])
+
+        if headers:
+            recording['headers'] = headers
+
+        return recording
+
+    def capture_body(self):  # pylint: disable=no-self-use
+        """Return request body as ``json``, ``form``, or ``data`` item of
+        recording. Bodies which are too large or which the view read from the
+        request stream directly (e.g. with `Request.iter_json`) aren't
+        captured. Other bodies (e.g. text or invalid JSON) can't be redacted
+        so they are only captured (as ``data``) if CARAFE_RECORDER_RAW_BODIES.
+        """
+        max_length = current_app.config['CARAFE_RECORDER_MAX_BODY_LENGTH']
+
+        if (not request.content_length or
+                (max_length is not None and
+                 request.content_length > max_length) or
+                is_stream_consumed()):
+            return {}
+
+        redact_keys = get_redact_keys()
+
+        try:
+            body = request.body
+
+            if body.json is not None:
+                return {'json': redact(body.json, redact_keys)}
+            elif body.is_form:
+                return {'form': redact(dict(body.form.lists()), redact_keys)}
+            elif current_app.config['CARAFE_RECORDER_RAW_BODIES']:
+                return {'data': body.raw.decode('utf-8')}
+
+            return {}
+        except HTTPException:
+            # Invalid bodies and bodies which exceed limits aren't recorded.
+            return {}
+        except UnicodeDecodeError:
+            # Binary bodies aren't recorded.
+            return {}
+
+    def write(self, recording):
+        """Queue `recording` to be appended to CARAFE_RECORDER_FILENAME."""
+        self.start()
+
+        try:
+            self.queue.put_nowait(
+                (current_app.config['CARAFE_RECORDER_FILENAME'], recording))
+        except Full:
+            with self.lock:
+                self.dropped += 1
+
+    def start(self):
+        """Start writer thread unless it's running (e.g. it's not running in
+        a forked worker process).
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.listen)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def listen(self):
+        """Write queued recordings until ``None`` is queued. Files are flushed
+        whenever the queue is empty.
+        """
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                self.write_line(*item)
+
+                if self.queue.empty():
+                    for fp in self.files.values():
+                        fp.flush()
+            except Exception:  # pylint: disable=broad-except
+                with self.lock:
+                    self.dropped += 1
+            finally:
+                self.queue.task_done()
+
+    def write_line(self, filename, recording):
+        """Append `recording` as a JSON line to `filename`."""
+        if filename not in self.files:
+            self.files[filename] = open(filename, 'a')
+
+        self.files[filename].write(
+            json.dumps(recording, separators=(',', ':'), sort_keys=True) +
+            '\n')
+
+    def flush(self):
+        """Wait up to CARAFE_RECORDER_FLUSH_TIMEOUT seconds for queued
+        recordings to be written.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return
+
+        deadline = time() + self.flush_timeout
+        done = self.queue.all_tasks_done
+
+        with done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+
+    def close(self):
+        """Write queued recordings, stop writer thread, and close recording
+        files. The writer thread is started again by the next recording.
+        """
+        self.flush()
+
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)
+                self.thread.join(self.flush_timeout)
+            except Full:  # pragma: no cover
+                pass
+
+        with self.lock:
+            for fp in self.files.values():
+                fp.close()
+            self.files.clear()
+
+
+def get_redact_keys():
+    """Return lowercased CARAFE_RECORDER_REDACT_KEYS."""
+    return [key.lower()
+            for key in current_app.config['CARAFE_RECORDER_REDACT_KEYS']]
+
+
+def is_stream_consumed():
+    """Whether the current request's stream was read without buffering the
+    body (e.g. with `Request.iter_json`) so that it can't be read again.
+    """
+    return ('stream' in request.__dict__ and
+            getattr(request, '_cached_data', None) is None and
+            'form' not in request.__dict__)
+
+
+def redact(data, keys):
+    """Return copy of `data` with the values of dict keys which contain any of
+    `keys` replaced recursively.
+
+    >>> redact({'user': [{'Password': 'x'}]}, ['password'])
+    {'user': [{'Password': '[REDACTED]'}]}
+    """
+    if isinstance(data, dict):
+        return dict((key, REDACTED
+                     if any(part in key.lower() for part in keys)
+                     else redact(value, keys))
+                    for key, value in data.items())
+    elif isinstance(data, list):
+        return [redact(value, keys) for value in data]
+    else:
+        return data
+
+
+def iter_recordings(filename):
+    """Generate recordings from recorded `filename`."""
+    with open(filename) as fp:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Replayer(object):
+    """Replays the recordings of `filename` against `app` with a `JSONClient`
+    (or the given `client`).
+
+    If `speed` is set, the original inter-arrival timing of recordings is
+    honored and scaled by `speed` (e.g. ``2`` replays twice as fast).
+    Otherwise requests are replayed as fast as possible. Replayed requests
+    shouldn't be recorded to `filename` (e.g. set CARAFE_RECORDER_SAMPLE_RATE
+    to ``0``) since it's read as it's replayed.
+    """
+    def __init__(self, app, filename, speed=None, client=None):
+        self.app = app
+        self.filename = filename
+        self.speed = speed
+        self.client = client or JSONClient(
+            app, make_client_response(app.response_class))
+
+    def __iter__(self):
+        """Replay recordings generating ``(recording, response)`` tuples."""
+        started = first = None
+
+        for recording in iter_recordings(self.filename):
+            if self.speed:
+                if first is None:
+                    started, first = time(), recording['time']
+
+                delay = (started + (recording['time'] - first) / self.speed -
+                         time())
+
+                if delay > 0:
+                    sleep(delay)
+
+            yield (recording, self.request(recording))
+
+    def replay(self):
+        """Replay all recordings and return the number of replayed requests
+        by response status.
+        """
+        statuses = {}
+
+        for _, response in self:
+            statuses[response.status_code] = \
+                statuses.get(response.status_code, 0) + 1
+
+        return statuses
+
+    def request(self, recording):
+        """Issue request of `recording` and return the response."""
+        headers = dict(recording.get('headers', {}))
+        kargs = {
+            'method': recording['method'],
+            'query_string': recording.get('args'),
+            'content_type': headers.pop('Content-Type', None)
+        }
+
+        if 'json' in recording:
+            kargs['data'] = recording['json']
+            kargs['content_type'] = 'application/json'
+        elif 'form' in recording:
+            # Files aren't recorded so forms are always replayed URL encoded.
+            kargs['data'] = recording['form']
+            kargs['content_type'] = 'application/x-www-form-urlencoded'
+        elif 'data' in recording:
+            kargs['data'] = recording['data'].encode('utf-8')
+
+        if kargs['content_type'] is None:
+            del kargs['content_type']
+
+        return self.client.open(recording['path'], headers=headers, **kargs)
@@ -0,0 +1,267 @@
+"""Incremental JSON parsing of request bodies with size and nesting limits.
+"""
+
+import codecs
+import re
+
+from flask import json
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+
+# JSON string (or an unterminated one at the end of the text).
+_string = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"?', re.S)
+_non_brackets = re.compile(r'[^\[\]{}]+')
+_empty_containers = re.compile(r'\[\]|\{\}')
+_whitespace = re.compile(r'\s*')
+
+
+def check_depth(text, max_depth):
+    """Raise `BadRequest` if the container nesting depth of JSON `text`
+    exceeds `max_depth`. Strings are removed and the remaining brackets are
+    paired off innermost first using regular expression substitutions (i.e.
+    without a Python level loop over the text) so this is much cheaper than
+    parsing `text`.
+
+    >>> check_depth('[[1], {"a": "[[["}]', 2)
+    >>> check_depth('[[[1]]]', 2)
+    Traceback (most recent call last):
+    ...
+    BadRequest: 400: Bad Request
+    """
+    if not max_depth or text.count('[') + text.count('{') <= max_depth:
+        return
+
+    brackets = _non_brackets.sub('', _string.sub('', text))
+    depth = 0
+
+    while brackets:
+        depth += 1
+
+        if depth > max_depth:
+            raise BadRequest('JSON nesting depth exceeds {0}'
+                             .format(max_depth))
+
+        reduced = _empty_containers.sub('', brackets)
+
+        if len(reduced) == len(brackets):
+            # Unbalanced brackets which the parser will reject.
+            return
+
+        brackets = reduced
+
+
+def check_value(value, max_depth=None, max_keys=None, max_array_length=None):
+    """Raise `BadRequest` if parsed JSON `value` has containers nested more
+    than `max_depth` deep, an object with more than `max_keys` keys or an
+    array with more than `max_array_length` elements. Only containers are
+    visited.
+
+    >>> check_value({'a': [1, 2, 3], 'b': '[,,,]'}, max_depth=2, max_keys=2,
+    ...             max_array_length=3)
+    >>> check_value([1, [2, 3], 4], max_array_length=2)
+    Traceback (most recent call last):
+    ...
+    BadRequest: 400: Bad Request
+    """
+    containers = (dict, list)
+
+    if (not isinstance(value, containers) or
+            (max_depth is None and not (max_keys or max_array_length))):
+        return
+
+    # Visit containers one nesting level at a time.
+    level = [value]
+    depth = 0
+
+    while level:
+        depth += 1
+
+        if max_depth is not None and depth > max_depth:
+            raise BadRequest('JSON nesting depth exceeds {0}'
+                             .format(max_depth))
+
+        nested = []
+
+        for value in level:
+            if isinstance(value, dict):
+                if max_keys and len(value) > max_keys:
+                    raise BadRequest('JSON object keys exceed {0}'
+                                     .format(max_keys))
+                values = value.itervalues()
+            else:
+                if max_array_length and len(value) > max_array_length:
+                    raise BadRequest('JSON array elements exceed {0}'
+                                     .format(max_array_length))
+                values = value
+
+            nested.extend([item for item in values
+                           if isinstance(item, containers)])
+
+        level = nested
+
+
+class JSONArrayStream(object):
+    """Iterator over the elements of a top-level JSON array read
+    incrementally from `stream`. Only one element (plus a read chunk) is held
+    in memory at a time so that bulk payloads can be processed as they
+    arrive. Elements are parsed straight from the read buffer with
+    `decoder`'s ``raw_decode``.
+
+    Raises `RequestEntityTooLarge` if more than `max_content_length` bytes are
+    read and `BadRequest` if the body isn't a JSON array, if an element's
+    nesting depth (counting the top-level array) exceeds `max_depth`, if the
+    array (or any nested array) has more than `max_array_length` elements, or
+    if any object has more than `max_keys` keys.
+    """
+    def __init__(self,
+                 stream,
+                 max_depth=None,
+                 max_content_length=None,
+                 max_keys=None,
+                 max_array_length=None,
+                 charset='utf-8',
+                 chunk_size=64 * 1024,
+                 decoder=None):
+        self.stream = stream
+        self.max_depth = max_depth
+        self.max_content_length = max_content_length
+        self.max_keys = max_keys
+        self.max_array_length = max_array_length
+        self.chunk_size = chunk_size
+        self.decoder = decoder or json.JSONDecoder()
+        self.charset_decoder = codecs.getincrementaldecoder(charset)('strict')
+        self.bytes_read = 0
+        self.buffer = u''
+        self.eof = False
+
+    def __iter__(self):
+        # Account for the top-level array.
+        max_depth = self.max_depth - 1 if self.max_depth else None
+        max_keys = self.max_keys
+        max_array_length = self.max_array_length
+        check = max_depth is not None or max_keys or max_array_length
+        match_whitespace = _whitespace.match
+
+        pos = self.skip_whitespace(self.expect('[', 0))
+        length = 0
+
+        if self.buffer[pos] == ']':
+            return
+
+        while True:
+            length += 1
+
+            if max_array_length and length > max_array_length:
+                raise BadRequest('JSON array elements exceed {0}'
+                                 .format(max_array_length))
+
+            value, pos = self.decode(pos)
+
+            if check:
+                check_value(value,
+                            max_depth=max_depth,
+                            max_keys=max_keys,
+                            max_array_length=max_array_length)
+
+            yield value
+
+            pos = match_whitespace(self.buffer, pos).end()
+
+            if pos == len(self.buffer):
+                pos = self.skip_whitespace(pos)
+
+            char = self.buffer[pos]
+
+            if char == ']':
+                break
+            elif char != ',':
+                raise BadRequest('Invalid JSON array')
+
+            pos = self.skip_whitespace(pos + 1)
+
+    def read(self, keep_from, size=0):
+        """Read next chunk (or chunks until at least `size` characters are
+        read) into buffer discarding text before `keep_from`. Returns
+        ``False`` if there is nothing left to read.
+        """
+        if self.eof:
+            return False
+
+        texts = []
+        length = 0
+
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            self.bytes_read += len(chunk)
+
+            if (self.max_content_length is not None and
+                    self.bytes_read > self.max_content_length):
+                raise RequestEntityTooLarge()
+
+            if not chunk:
+                self.eof = True
+
+            try:
+                text = self.charset_decoder.decode(chunk, final=self.eof)
+            except UnicodeDecodeError:
+                raise BadRequest('Invalid request body encoding')
+
+            texts.append(text)
+            length += len(text)
+
+            if self.eof or length >= size:
+                break
+
+        self.buffer = self.buffer[keep_from:] + u''.join(texts)
+
+        return True
+
+    def decode(self, pos):
+        """Return ``(value, end)`` of the array element beginning at `pos`,
+        reading more data as needed.
+        """
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, pos)
+            except ValueError:
+                # Element is either invalid or incomplete.
+                end = None
+            except RuntimeError:
+                raise BadRequest('JSON nesting too deep')
+
+            # A number at the end of the buffer may continue in the next
+            # chunk.
+            if end is not None and (end < len(self.buffer) or self.eof):
+                return (value, end)
+
+            # Read at least as much again as the element's buffered text
+            # before retrying so that large elements aren't reparsed once per
+            # chunk.
+            if not self.read(pos, len(self.buffer) - pos):
+                raise BadRequest('Invalid JSON array element')
+
+            pos = 0
+
+    def skip_whitespace(self, pos):
+        """Return position of next non-whitespace character after `pos`,
+        reading more data as needed.
+        """
+        while True:
+            pos = _whitespace.match(self.buffer, pos).end()
+
+            if pos < len(self.buffer):
+                return pos
+
+            if not self.read(pos):
+                raise BadRequest('Incomplete JSON array')
+
+            pos = 0
+
+    def expect(self, char, pos):
+        """Return position after expected `char`."""
+        pos = self.skip_whitespace(pos)
+
+        if self.buffer[pos] != char:
+            raise BadRequest('Expected JSON array')
+
+        return pos + 1
@@ -0,0 +1,235 @@
+"""Cursor based pagination for list endpoints.
+"""
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from operator import attrgetter, itemgetter
+
+from flask import json, request, current_app, stream_with_context
+from werkzeug import urls
+from werkzeug.exceptions import BadRequest
+
+from .response import dumps
+from .utils import _to_dict
+
+
+NEXT = 'next'
+PREV = 'prev'
+
+
+def encode_cursor(value, direction=NEXT):
+    """Encode key `value` and paging `direction` into an opaque, URL safe
+    cursor. Encoding is deterministic so the same position always results in
+    the same cursor (and therefore the same cached view key).
+
+    >>> cursor = encode_cursor(10)
+    >>> assert decode_cursor(cursor) == (NEXT, 10)
+    """
+    data = json.dumps([direction, value], separators=(',', ':'),
+                      sort_keys=True)
+    return urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode `cursor` into a ``(direction, value)`` tuple. Raises
+    `BadRequest` if cursor is invalid or its value isn't a scalar (e.g. a
+    forged list or object).
+    """
+    try:
+        cursor = str(cursor)
+        data = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, value = json.loads(data.decode('utf-8'))
+    except Exception:
+        raise BadRequest('Invalid cursor')
+
+    if (direction not in (NEXT, PREV) or
+            (value is not None and
+             not isinstance(value, (basestring, int, long, float)))):
+        raise BadRequest('Invalid cursor')
+
+    return (direction, value)
+
+
+def query_fetcher(query, column):
+    """Return fetch function for `CursorPaginator` which fetches rows from an
+    SQLAlchemy `query` keyed and ordered by `column`.
+    """
+    def fetch(value, direction, limit):  # pylint: disable=missing-docstring
+        if direction == PREV:
+            if value is not None:
+                query_ = query.filter(column < value)
+            else:  # pragma: no cover
+                query_ = query
+            query_ = query_.order_by(column.desc())
+        else:
+            if value is not None:
+                query_ = query.filter(column > value)
+            else:
+                query_ = query
+            query_ = query_.order_by(column)
+
+        return query_.limit(limit).all()
+
+    return fetch
+
+
+class CursorPaginator(object):
+    """Cursor (i.e. keyset) paginator. Unlike offset pagination, fetching a
+    page costs the same regardless of how deep the page is.
+
+    `fetch` is a callable with signature ``fetch(value, direction, limit)``
+    which returns up to `limit` items whose key is greater than `value` in
+    ascending key order for ``direction == 'next'`` or less than `value` in
+    descending key order for ``direction == 'prev'``. A `value` of ``None``
+    means start from the beginning. See `query_fetcher()` for SQLAlchemy
+    queries.
+
+    `key` is the attribute name (or dict key or callable) used to get the
+    cursor value from an item. Cursor values have to be strings or numbers.
+    """
+    cursor_arg = 'cursor'
+    limit_arg = 'limit'
+
+    def __init__(self, fetch, key='id', default_limit=20, max_limit=100):
+        self.fetch = fetch
+        self.key = key
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+
+    def get_key(self, item):
+        """Return cursor value of `item`."""
+        if callable(self.key):
+            return self.key(item)
+        elif isinstance(item, dict):
+            return itemgetter(self.key)(item)
+        else:
+            return attrgetter(self.key)(item)
+
+    def get_limit(self, limit=None):
+        """Return page limit from `limit` or request args bounded by
+        `max_limit`.
+        """
+        if limit is None:
+            limit = request.args.get(self.limit_arg, type=int)
+
+        if not limit or limit < 1:
+            limit = self.default_limit
+
+        return min(limit, self.max_limit)
+
+    def paginate(self, cursor=None, limit=None):
+        """Return `Page` for `cursor` (defaults to request's cursor arg).
+        Fetches ``limit + 1`` items to determine whether there are more items
+        beyond the page.
+        """
+        if cursor is None:
+            cursor = request.args.get(self.cursor_arg)
+
+        direction, value = decode_cursor(cursor) if cursor else (NEXT, None)
+        limit = self.get_limit(limit)
+
+        items = list(self.fetch(value, direction, limit + 1))
+        has_more = len(items) > limit
+        items = items[:limit]
+
+        next_cursor = prev_cursor = None
+
+        if direction == PREV:
+            items.reverse()
+
+            if items:
+                next_cursor = encode_cursor(self.get_key(items[-1]), NEXT)
+
+                if has_more:
+                    prev_cursor = encode_cursor(self.get_key(items[0]), PREV)
+        elif items:
+            if has_more:
+                next_cursor = encode_cursor(self.get_key(items[-1]), NEXT)
+
+            if value is not None:
+                prev_cursor = encode_cursor(self.get_key(items[0]), PREV)
+
+        return Page(items,
+                    limit=limit,
+                    next_cursor=next_cursor,
+                    prev_cursor=prev_cursor,
+                    cursor_arg=self.cursor_arg)
+
+
+class Page(object):
+    """Page of items returned by `CursorPaginator`."""
+    def __init__(self,
+                 items,
+                 limit,
+                 next_cursor=None,
+                 prev_cursor=None,
+                 cursor_arg='cursor'):
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.cursor_arg = cursor_arg
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def next_url(self):
+        """URL of next page."""
+        return self.make_url(self.next_cursor)
+
+    @property
+    def prev_url(self):
+        """URL of previous page."""
+        return self.make_url(self.prev_cursor)
+
+    def make_url(self, cursor):
+        """Return current request URL with cursor arg set to `cursor`."""
+        if cursor is None:
+            return None
+
+        args = dict(request.args.lists())
+        args[self.cursor_arg] = cursor
+
+        return urls.Href(request.path, sort=True)(args)
+
+    def get_meta(self):
+        """Return paging metadata."""
+        return {
+            'limit': self.limit,
+            'next': self.next_url,
+            'prev': self.prev_url
+        }
+
+    def to_dict(self, namespace='items', fields=None, exclude=None):
+        """Return page items and paging metadata as a dict."""
+        data = self.get_meta()
+        data[namespace] = _to_dict(self.items, fields=fields, exclude=exclude)
+        return data
+
+    def iter_json(self, namespace='items', fields=None, exclude=None):
+        """Generate the JSON encoding of `to_dict()` in chunks, converting and
+        encoding one item at a time.
+        """
+        meta = dumps(self.get_meta(), separators=(',', ':'))
+
+        yield '{{{0}:['.format(dumps(namespace))
+
+        for index, item in enumerate(self.items):
+            if index:
+                yield ','
+            yield dumps(_to_dict(item, fields=fields, exclude=exclude),
+                        separators=(',', ':'))
+
+        yield '],{0}\n'.format(meta[1:])
+
+    def stream(self, namespace='items', fields=None, exclude=None, **kargs):
+        """Return streaming JSON `Response` of page."""
+        return current_app.response_class(
+            stream_with_context(self.iter_json(namespace=namespace,
+                                               fields=fields,
+                                               exclude=exclude)),
+            mimetype='application/json',
+            **kargs)
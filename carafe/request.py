@@ -1,17 +1,177 @@
 """Extension of flask.Request.
 """
 
-from flask import Request as RequestBase
+from io import BytesIO
+
+from flask import Request as RequestBase, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.http import parse_options_header
+from werkzeug.utils import cached_property
+
+from .compression import DecompressingStream, ENCODINGS
+from .jsonstream import JSONArrayStream, check_depth, check_value
+from .utils import parse_fields
 
 
 class Request(RequestBase):
     """Subclass of flask.Request with some added features"""
 
+    # Request args used to specify sparse fieldsets.
+    fields_arg = 'fields'
+    exclude_arg = 'exclude'
+
     @property
     def data(self):
         """Property access to get_dict()."""
         return self.get_dict()
 
+    @cached_property
+    def fields(self):
+        """Sparse fieldset tree of field paths to include in the response
+        parsed once from the `fields_arg` request arg (e.g.
+        ``?fields=id,author.name``).
+        """
+        return parse_fields(self.args.getlist(self.fields_arg))
+
+    @cached_property
+    def exclude(self):
+        """Sparse fieldset tree of field paths to omit from the response
+        parsed once from the `exclude_arg` request arg (e.g.
+        ``?exclude=author.email``).
+        """
+        return parse_fields(self.args.getlist(self.exclude_arg))
+
+    @cached_property
+    def body(self):
+        """Request scoped `RequestBody` which parses the request body once for
+        all consumers.
+        """
+        return RequestBody(self)
+
+    @cached_property
+    def stream(self):
+        """Extend with transparent decompression of compressed (i.e.
+        Content-Encoding gzip or deflate) request bodies.
+        """
+        stream = super(Request, self).stream
+
+        if not self.is_compressed:
+            return stream
+
+        if self.content_encoding not in ENCODINGS:
+            raise UnsupportedMediaType(
+                'Unsupported content encoding: {0}'
+                .format(self.content_encoding))
+
+        config = current_app.config
+        limits = [limit for limit in
+                  (config.get('CARAFE_REQUEST_MAX_DECOMPRESSED_LENGTH'),
+                   self.max_content_length)
+                  if limit is not None]
+        max_length = min(limits) if limits else None
+
+        return DecompressingStream(
+            stream,
+            self.content_encoding,
+            max_length=max_length,
+            max_ratio=config.get('CARAFE_REQUEST_MAX_COMPRESSION_RATIO'))
+
+    @property
+    def is_compressed(self):
+        """Whether request body has a content encoding which should be
+        decompressed.
+        """
+        return (self.content_encoding not in (None, '', 'identity') and
+                current_app.config.get('CARAFE_REQUEST_DECOMPRESS_ENABLED'))
+
+    def _load_form_data(self):
+        """Extend so that compressed form data is parsed using its
+        decompressed length instead of the (compressed) content length.
+        """
+        if (not self.is_compressed or
+                'form' in self.__dict__ or
+                not self.want_form_data_parsed):
+            return super(Request, self)._load_form_data()
+
+        data = self.get_data()
+        mimetype, options = parse_options_header(
+            self.environ.get('CONTENT_TYPE', ''))
+        parser = self.make_form_data_parser()
+
+        # pylint: disable=attribute-defined-outside-init
+        values = parser.parse(BytesIO(data), mimetype, len(data), options)
+        self.__dict__['stream'], self.__dict__['form'], \
+            self.__dict__['files'] = values
+
+    @cached_property
+    def limits(self):
+        """Request body limits from config overridden by any limits set on
+        the matched endpoint's view with `request_limits()`.
+        """
+        config = current_app.config
+        limits = {
+            'max_content_length': config.get('MAX_CONTENT_LENGTH'),
+            'max_json_depth': config.get('CARAFE_REQUEST_MAX_JSON_DEPTH'),
+            'max_json_keys': config.get('CARAFE_REQUEST_MAX_JSON_KEYS'),
+            'max_json_array_length': config.get(
+                'CARAFE_REQUEST_MAX_JSON_ARRAY_LENGTH')
+        }
+
+        view = current_app.view_functions.get(self.endpoint)
+        limits.update(getattr(view, 'request_limits', {}))
+
+        return limits
+
+    @property
+    def max_content_length(self):
+        """Override to use the endpoint's content length limit if set."""
+        if current_app:
+            return self.limits['max_content_length']
+
+    @property
+    def max_json_depth(self):
+        """Maximum nesting depth of JSON request body."""
+        return self.limits['max_json_depth']
+
+    @property
+    def max_json_keys(self):
+        """Maximum number of keys of any object in JSON request body."""
+        return self.limits['max_json_keys']
+
+    @property
+    def max_json_array_length(self):
+        """Maximum number of elements of any array in JSON request body."""
+        return self.limits['max_json_array_length']
+
+    def check_content_length(self):
+        """Raise `RequestEntityTooLarge` if the request's content length
+        exceeds `max_content_length` (i.e. config's MAX_CONTENT_LENGTH or the
+        endpoint's limit).
+        """
+        max_content_length = self.max_content_length
+
+        if (max_content_length is not None and
+                (self.content_length or 0) > max_content_length):
+            raise RequestEntityTooLarge()
+
+    def iter_json(self, chunk_size=64 * 1024):
+        """Return iterator over the elements of a top-level JSON array request
+        body which are parsed incrementally as they are read from the request
+        stream. Content length limits are enforced as the body is read and
+        nesting depth, key count, and array length limits as each element is
+        parsed.
+        """
+        self.check_content_length()
+
+        return JSONArrayStream(
+            self.stream,
+            max_depth=self.max_json_depth,
+            max_content_length=self.max_content_length,
+            max_keys=self.max_json_keys,
+            max_array_length=self.max_json_array_length,
+            charset=self.mimetype_params.get('charset', 'utf-8'),
+            chunk_size=chunk_size)
+
     def get_dict(self, force=True, silent=True, cache=True):
         """Attempt to return request data as a dict. This is similar to
         `get_json` but is more permissive in trying to return something useful.
@@ -22,7 +182,111 @@ class Request(RequestBase):
         if data is not None:
             return data
 
-        data = self.get_json(force=force, silent=silent, cache=cache)
+        if force and silent:
+            data = self.body.dict
+        else:
+            data = self.body.get_dict(force=force, silent=silent)
+
+        if cache:
+            self._cached_dict = data
+
+        return data
+
+
+class RequestBody(object):
+    """Parsed request body which holds the raw body, the decoded JSON or form
+    data, and the dict view of it. Each is computed at most once per request
+    and shared by all consumers (e.g. `Request.get_dict()` and the logger).
+    """
+    form_mimetypes = ('application/x-www-form-urlencoded',
+                      'multipart/form-data')
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def is_form(self):
+        """Whether the request body is form data."""
+        return self.request.mimetype in self.form_mimetypes
+
+    @cached_property
+    def raw(self):
+        """Raw request body. For multipart requests whose form data was
+        already parsed, this is empty since the body isn't buffered.
+        """
+        return self.request.get_data()
+
+    @cached_property
+    def json(self):
+        """Decoded JSON body or ``None``. The body is decoded as JSON whatever
+        its content type (like ``get_json(force=True)``) except for multipart
+        form data which isn't buffered.
+        """
+        if self.request.mimetype == 'multipart/form-data':
+            return None
+
+        if not self.is_form or self.raw.lstrip()[:1] in (b'{', b'['):
+            # Form data which isn't JSON isn't checked against JSON limits.
+            self.check_limits()
+
+        return self.check_value(self.request.get_json(force=True, silent=True))
+
+    def check_limits(self):
+        """Enforce request's content length and JSON nesting depth limits on
+        the body before it's parsed as JSON.
+        """
+        self.request.check_content_length()
+
+        max_content_length = self.request.max_content_length
+
+        # The body may be longer than its Content-Length header says (e.g.
+        # once decompressed).
+        if (max_content_length is not None and
+                len(self.raw) > max_content_length):
+            raise RequestEntityTooLarge()
+
+        check_depth(self.raw, self.request.max_json_depth)
+
+    def check_value(self, data):
+        """Enforce request's JSON key count and array length limits on parsed
+        JSON `data` and return it.
+        """
+        check_value(data,
+                    max_keys=self.request.max_json_keys,
+                    max_array_length=self.request.max_json_array_length)
+        return data
+
+    @cached_property
+    def form(self):
+        """Request form data."""
+        if self.request.mimetype != 'multipart/form-data':
+            # Buffer the body first so that it's still available as `raw`
+            # after form parsing (which then parses from the buffer).
+            self.raw  # pylint: disable=pointless-statement
+        return self.request.form
+
+    @cached_property
+    def form_dict(self):
+        """Request form data as a dict."""
+        if self.json is None:
+            return self.dict
+        return self.form.to_dict()
+
+    @cached_property
+    def dict(self):
+        """Request body as a dict from JSON with a fallback to form data."""
+        return self.get_dict()
+
+    def get_dict(self, force=True, silent=True):
+        """Return request body as a dict from JSON (see `flask.Request.get_json`
+        for `force` and `silent`) with a fallback to form data.
+        """
+        if force and silent:
+            data = self.json
+        else:
+            self.check_limits()
+            data = self.check_value(
+                self.request.get_json(force=force, silent=silent))
 
         if data is None:
             # fallback to form data
@@ -31,9 +295,33 @@ class Request(RequestBase):
         if hasattr(data, 'to_dict'):
             data = data.to_dict()
 
-        data = data or {}
+        return data or {}
 
-        if cache:
-            self._cached_dict = data
 
-        return data
+def request_limits(**limits):
+    """Decorator which overrides the request body limits (see
+    `Request.limits`) of a view. Supported limits are `max_content_length`,
+    `max_json_depth`, `max_json_keys`, and `max_json_array_length` where
+    ``None`` disables a limit. Must be applied to the view function that's
+    registered with the route (i.e. below ``@app.route``).
+
+    >>> @request_limits(max_content_length=1024, max_json_depth=4)
+    ... def view(): pass
+    >>> sorted(view.request_limits.items())
+    [('max_content_length', 1024), ('max_json_depth', 4)]
+    """
+    unknown = set(limits) - set(['max_content_length',
+                                 'max_json_depth',
+                                 'max_json_keys',
+                                 'max_json_array_length'])
+
+    if unknown:
+        raise TypeError('Unknown request limits: {0}'.format(
+            ', '.join(sorted(unknown))))
+
+    def decorator(func):  # pylint: disable=missing-docstring
+        func.request_limits = dict(getattr(func, 'request_limits', {}),
+                                   **limits)
+        return func
+
+    return decorator
@@ -1,13 +1,21 @@
 """Extension of flask.Response.
 """
 
+import zlib
+from uuid import uuid4
+
 from flask import Response as ResponseBase, json, current_app, request
 
 
+# String which `RawJSON` objects are encoded as by `dumps()` before their
+# encoded strings are spliced in.
+RAW_JSON_PLACEHOLDER = '__carafe_raw_json__'
+
+
 class Response(ResponseBase):
     """Extend flask.Response with support for list/dict conversion to JSON."""
     def __init__(self, content=None, *args, **kargs):
-        if isinstance(content, (list, dict)):
+        if isinstance(content, (list, dict, RawJSON)):
             kargs['mimetype'] = 'application/json'
             content = to_json(content)
 
@@ -16,12 +24,26 @@ class Response(ResponseBase):
     @classmethod
     def force_type(cls, response, environ=None):
         """Override with support for list/dict."""
-        if isinstance(response, (list, dict)):
+        if isinstance(response, (list, dict, RawJSON)):
             return cls(response)
         else:
             return super(Response, cls).force_type(response, environ)
 
 
+class RawJSON(object):
+    """Wrapper around an already encoded JSON string. When it's found anywhere
+    in the content passed to `to_json()`, the encoded string is written
+    verbatim instead of being decoded and re-encoded.
+    """
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+    def __repr__(self):  # pragma: no cover
+        return '{0}({1!r})'.format(self.__class__.__name__, self.encoded)
+
+
 def to_json(content):
     """Converts content to json while respecting config options."""
     indent = None
@@ -32,4 +54,77 @@ def to_json(content):
         indent = 2
         separators = (', ', ': ')
 
-    return (json.dumps(content, indent=indent, separators=separators), '\n')
+    if isinstance(content, RawJSON):
+        return (content.encoded, '\n')
+
+    return (dumps(content, indent=indent, separators=separators), '\n')
+
+
+def dumps(content, **kargs):
+    """Serialize `content` to JSON using the app's JSON encoder while writing
+    any `RawJSON` objects verbatim.
+    """
+    encoded, fragments = _dumps(content, RAW_JSON_PLACEHOLDER, kargs)
+
+    if not fragments:
+        return encoded
+
+    parts = encoded.split('"{0}"'.format(RAW_JSON_PLACEHOLDER))
+
+    if len(parts) != len(fragments) + 1:
+        # Content contains the placeholder itself so use one unique to this
+        # call instead.
+        placeholder = '__carafe_raw_json_{0}__'.format(uuid4().hex)
+        encoded, fragments = _dumps(content, placeholder, kargs)
+        parts = encoded.split('"{0}"'.format(placeholder))
+
+    # Placeholders are encoded in the same order as `fragments`.
+    spliced = [parts[0]]
+
+    for fragment, part in zip(fragments, parts[1:]):
+        spliced.append(fragment)
+        spliced.append(part)
+
+    return ''.join(spliced)
+
+
+def _dumps(content, placeholder, kargs):
+    """Return ``(encoded, fragments)`` where `encoded` is the JSON of
+    `content` with `RawJSON` objects encoded as `placeholder` strings and
+    `fragments` are their encoded strings.
+    """
+    encoder = current_app.json_encoder()
+    fragments = []
+
+    def default(obj):  # pylint: disable=missing-docstring
+        if isinstance(obj, RawJSON):
+            fragments.append(obj.encoded)
+            return placeholder
+        return encoder.default(obj)
+
+    return (json.dumps(content, default=default, **kargs), fragments)
+
+
+def generate_etag(data):
+    """Return a fast, non-cryptographic ETag value for `data` using its length
+    and CRC32 checksum.
+    """
+    return '{0:x}-{1:08x}'.format(len(data), zlib.crc32(data) & 0xffffffff)
+
+
+def make_conditional(response, weak=False):
+    """Set an ETag on a successful JSON `response` to a GET/HEAD request (if
+    it doesn't already have one) and make it conditional to the current
+    request so that a matching If-None-Match results in a 304.
+    """
+    if (request.method not in ('GET', 'HEAD') or
+            response.status_code != 200 or
+            response.mimetype != 'application/json' or
+            response.is_streamed or
+            response.direct_passthrough):
+        return response
+
+    if 'etag' not in response.headers:
+        response.set_etag(generate_etag(response.get_data()), weak=weak)
+
+    return response.make_conditional(request)
@@ -1,10 +1,14 @@
 """General purpose utility functions.
 """
 
+import keyword
+import re
 from functools import wraps, partial
-from threading import Thread
+from inspect import getmro
+from operator import attrgetter
+from threading import Thread, local
 
-from flask import jsonify as _jsonify
+from flask import request, jsonify as _jsonify
 
 
 class classproperty(object):  # pylint: disable=invalid-name
@@ -57,9 +61,78 @@ def async(func):
     return wrapper
 
 
-def to_dict(data=None, namespace=None):
-    """Decorator enabled version of `_to_dict()`."""
-    __to_dict = partial(_to_dict, namespace=namespace)
+def parse_fields(value):
+    """Parse sparse fieldset specification into a nested dict tree. `value`
+    can be a comma delimited string of dot delimited field paths, a list of
+    such strings, or an already parsed tree.
+
+    >>> tree = parse_fields('id,author.name,author.email')
+    >>> assert tree == {'id': {}, 'author': {'name': {}, 'email': {}}}
+    >>> assert parse_fields(['id', 'name']) == {'id': {}, 'name': {}}
+    >>> assert parse_fields(None) == {}
+    """
+    if not value:
+        return {}
+
+    if isinstance(value, dict):
+        return value
+
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+
+    tree = {}
+    for spec in value:
+        for path in spec.split(','):
+            path = path.strip()
+            if not path:
+                continue
+
+            node = tree
+            for name in path.split('.'):
+                node = node.setdefault(name, {})
+
+    return tree
+
+
+def format_fields(tree):
+    """Format a sparse fieldset tree into a canonical (i.e. sorted) comma
+    delimited string of dot delimited field paths.
+
+    >>> format_fields(parse_fields('b,a.y,a.x'))
+    'a.x,a.y,b'
+    """
+    def iterpaths(node, prefix):  # pylint: disable=missing-docstring
+        for name, subnode in node.items():
+            path = prefix + name
+            if subnode:
+                for subpath in iterpaths(subnode, path + '.'):
+                    yield subpath
+            else:
+                yield path
+
+    return ','.join(sorted(iterpaths(tree or {}, '')))
+
+
+def to_dict(data=None,
+            namespace=None,
+            fields=None,
+            exclude=None,
+            sparse=False):
+    """Decorator enabled version of `_to_dict()`. When `sparse` is ``True``,
+    `fields` and `exclude` are taken from the current request's sparse
+    fieldset args (see `carafe.request.Request.fields`).
+    """
+    def __to_dict(data):  # pylint: disable=missing-docstring
+        if sparse:
+            _fields = getattr(request, 'fields', None)
+            _exclude = getattr(request, 'exclude', None)
+        else:
+            _fields, _exclude = fields, exclude
+
+        return _to_dict(data,
+                        namespace=namespace,
+                        fields=_fields,
+                        exclude=_exclude)
 
     if data is None:
         # pylint: disable=missing-docstring
@@ -74,16 +147,22 @@ def to_dict(data=None, namespace=None):
         return __to_dict(data)
 
 
-def _to_dict(data, namespace=None):
+def _to_dict(data, namespace=None, fields=None, exclude=None):
     """Converts elements of `data` using `data.to_dict()` or
-    `data[].to_dict()`. Optionally namespaces data into a container dict using
-    `namespace` as key.
+    `data[].to_dict()` (see `SerializerRegistry`). Optionally namespaces data
+    into a container dict using `namespace` as key. Optionally restricts
+    output to a sparse fieldset using `fields` and/or `exclude` (see
+    `parse_fields()`).
     """
-    if isinstance(data, list):
-        data = [item.to_dict() if hasattr(item, 'to_dict') else item
-                for item in data]
-    elif hasattr(data, 'to_dict'):
-        data = data.to_dict()
+    if fields or exclude:
+        data = _to_sparse_dict(data,
+                               parse_fields(fields),
+                               parse_fields(exclude))
+    elif isinstance(data, list):
+        data = serializers.convert_list(data)
+    elif _has_to_dict(data):
+        # Track the object so that back-references to it are cut short.
+        data = serializers.convert_nested(data)
 
     if namespace is not None:
         data = {namespace: data}
@@ -91,6 +170,250 @@ def _to_dict(data, namespace=None):
     return data
 
 
+_missing = object()
+
+
+def _to_sparse_dict(data, fields, exclude):
+    """Convert `data` while only including the field paths in `fields` and
+    omitting the field paths in `exclude`. Objects which declare their
+    `__fields__` are read via attribute access when `fields` is set so that
+    unrequested attributes and relationships are never loaded. Only fields
+    the object would normally serialize can be requested.
+    """
+    if isinstance(data, (list, tuple)):
+        return [_to_sparse_dict(item, fields, exclude) for item in data]
+
+    if fields:
+        if isinstance(data, dict):
+            getter = data.get
+        elif get_declared_fields(data.__class__):
+            getter = partial(_get_declared_field, data)
+        elif _has_to_dict(data):
+            getter = serializers.get(data.__class__)(data).get
+        else:
+            return data
+
+        result = {}
+        for name, subfields in fields.items():
+            value = getter(name, _missing)
+            if value is not _missing:
+                result[name] = _to_sparse_dict(
+                    value, subfields, exclude.get(name, {}))
+
+        for name, subexclude in exclude.items():
+            if not subexclude:
+                result.pop(name, None)
+    elif _has_to_dict(data):
+        declared = get_declared_fields(data.__class__)
+
+        if exclude and declared:
+            # Only read declared fields which aren't excluded outright.
+            fields = dict((name, {}) for name in declared
+                          if exclude.get(name) != {})
+            return _to_sparse_dict(data, fields, exclude)
+
+        result = serializers.get(data.__class__)(data)
+
+        if exclude:
+            result = _to_sparse_dict(result, fields, exclude)
+    elif isinstance(data, dict) and exclude:
+        # Copy so that the original dict isn't mutated.
+        result = dict(data)
+
+        for name, subexclude in exclude.items():
+            if name not in result:
+                continue
+            elif subexclude:
+                result[name] = _to_sparse_dict(result[name], {}, subexclude)
+            else:
+                del result[name]
+    else:
+        result = data
+
+    return result
+
+
+def _get_declared_field(obj, name, default):
+    """Return attribute `name` of `obj` if it's one of the object's declared
+    `__fields__` or else `default`.
+    """
+    if name.startswith('_') or name not in obj.__fields__:
+        return default
+    return getattr(obj, name, default)
+
+
+def _has_to_dict(obj):
+    """Return whether `obj` can be converted by `to_dict()`."""
+    return hasattr(obj, 'to_dict') or hasattr(obj, '__fields__')
+
+
+class SerializerRegistry(object):
+    """Registry of per-class conversion functions used by `to_dict()`. The
+    first time a class is seen, a serializer is compiled for it so that type
+    checks and attribute lookups are done once per class instead of once per
+    object.
+
+    If a class declares its field names in a ``__fields__`` attribute (and
+    doesn't override ``to_dict()`` below that declaration, see
+    `get_declared_fields()`), its serializer is a generated function which
+    reads those attributes directly instead of calling its ``to_dict()``
+    method. Values of the declared fields listed in ``__nested__`` are
+    serializable objects (or lists of them) which are converted too.
+    Otherwise, the class' ``to_dict()`` method is used if it has one.
+    """
+    def __init__(self):
+        self._serializers = {}
+        self._local = local()
+
+    def get(self, cls):
+        """Return serializer for `cls`, compiling it if needed."""
+        try:
+            return self._serializers[cls]
+        except KeyError:
+            serializer = self._serializers[cls] = self.compile(cls)
+            return serializer
+
+    def register(self, cls, serializer):
+        """Register a custom `serializer` callable for `cls`."""
+        self._serializers[cls] = serializer
+
+    def clear(self):
+        """Remove all compiled and registered serializers."""
+        self._serializers.clear()
+
+    def compile(self, cls):
+        """Compile serializer for `cls`."""
+        fields = get_declared_fields(cls)
+        nested = frozenset(getattr(cls, '__nested__', None) or ())
+
+        if fields and all(_identifier.match(name) and
+                          not keyword.iskeyword(name) for name in fields):
+            # Generate a dict literal (e.g. `{'id': obj.id}`) which is the
+            # fastest way to build the dict. Only nested fields are passed
+            # through `convert`.
+            source = 'lambda obj: {{{0}}}'.format(', '.join(
+                ('{0!r}: convert(obj.{0})' if name in nested else
+                 '{0!r}: obj.{0}').format(str(name))
+                for name in fields))
+            # pylint: disable=eval-used
+            return eval(source, {'convert': self.convert_nested})
+        elif fields:
+            return partial(self._convert_fields, attrgetter(*fields), fields,
+                           [name for name in fields if name in nested])
+        elif callable(getattr(cls, 'to_dict', None)):
+            return _call_to_dict
+        else:
+            # Object may still provide `to_dict` dynamically.
+            return _to_dict_or_self
+
+    def _convert_fields(self, getter, fields, nested, obj):
+        """Return dict of `fields` of `obj` read with `getter` (for field
+        names which aren't identifiers) converting `nested` fields.
+        """
+        values = getter(obj)
+        data = (dict(zip(fields, values)) if len(fields) > 1
+                else {fields[0]: values})
+
+        for name in nested:
+            data[name] = self.convert_nested(data[name])
+
+        return data
+
+    def convert_list(self, items):
+        """Convert list of `items` using their class' serializer."""
+        result = []
+        append = result.append
+        last_cls = serializer = None
+
+        for item in items:
+            cls = item.__class__
+
+            # Lists are typically homogeneous so avoid the registry lookup
+            # when the class hasn't changed.
+            if cls is not last_cls:
+                serializer = self.get(cls)
+                last_cls = cls
+
+            append(serializer(item))
+
+        return result
+
+    def convert_nested(self, value):
+        """Convert nested field `value` which is a serializable object or a
+        list of them. Objects which are already being converted (i.e.
+        back-references) are converted to ``None``.
+        """
+        if value is None or isinstance(value, _scalar_types):
+            return value
+        elif isinstance(value, (list, tuple)):
+            return [self.convert_nested(item) for item in value]
+        elif not _has_to_dict(value):
+            return value
+
+        active = getattr(self._local, 'active', None)
+
+        if active is None:
+            active = self._local.active = set()
+
+        key = id(value)
+
+        if key in active:
+            return None
+
+        active.add(key)
+
+        try:
+            return self.get(value.__class__)(value)
+        finally:
+            active.discard(key)
+
+
+def get_declared_fields(cls):
+    """Return the ``__fields__`` declared by `cls` (as a tuple) unless the
+    class declaring them (or a subclass of it which `cls` derives from)
+    defines its own ``to_dict()`` which then takes precedence.
+
+    >>> class Model(object):
+    ...     def to_dict(self):
+    ...         return {}
+    >>> class User(Model):
+    ...     __fields__ = ('id',)
+    >>> class Admin(User):
+    ...     def to_dict(self):
+    ...         return {'admin': True}
+    >>> get_declared_fields(User), get_declared_fields(Admin)
+    (('id',), ())
+    """
+    for klass in getmro(cls):
+        if 'to_dict' in vars(klass):
+            return ()
+        elif '__fields__' in vars(klass):
+            return tuple(klass.__fields__ or ())
+
+    return ()
+
+
+# pylint: disable=invalid-name
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_scalar_types = (basestring, int, long, float)
+# pylint: enable=invalid-name
+
+
+def _call_to_dict(obj):
+    """Return ``obj.to_dict()``."""
+    return obj.to_dict()
+
+
+def _to_dict_or_self(obj):
+    """Return ``obj.to_dict()`` if available else `obj`."""
+    return obj.to_dict() if hasattr(obj, 'to_dict') else obj
+
+
+# pylint: disable=invalid-name
+serializers = SerializerRegistry()
+# pylint: enable=invalid-name
+
+
 def jsonify(func=None, *args, **kargs):
     """Function or decorator that returns jsonfiy response"""
     if callable(func):
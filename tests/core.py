@@ -4,6 +4,9 @@ from carafe import FlaskCarafe
 from carafe.ext.logger import Logger
 from carafe.ext.cache import Cache
 from carafe.ext.auth import Auth
+from carafe.ext.batch import Batch
+from carafe.ext.recorder import Recorder
+from carafe.ext.metrics import Metrics
 
 # extensions for use
 # each object below should expose an "init_app" function/method
@@ -13,3 +16,6 @@ from carafe.ext import session
 logger = Logger()
 cache = Cache()
 auth = Auth()
+batch = Batch()
+recorder = Recorder()
+metrics = Metrics()
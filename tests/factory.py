@@ -20,5 +20,8 @@ def create_app(package_name, config=None, options=None, **flask_options):
     core.auth.init_app(app, **opts['auth'])
     core.cache.init_app(app)
     core.logger.init_app(app)
+    core.batch.init_app(app)
+    core.recorder.init_app(app)
+    core.metrics.init_app(app)
 
     return app
@@ -1,13 +1,18 @@
 
 from collections import namedtuple
+from time import sleep
 
-from flask import session, request
+from flask import session, request, g
+from flask_principal import Identity, RoleNeed, PermissionDenied
+from sqlalchemy import create_engine, event, Column as SAColumn, ForeignKey, Integer, Boolean, String, Table
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, sessionmaker
 
 import carafe
-from carafe.ext.auth import SQLAlchemyAuthProvider
+from carafe.ext.auth import SQLAlchemyAuthProvider, IdentityCache, TokenSigner, PermissionFactory
 
 from . import factory
-from .core import auth
+from .core import auth, cache
 from .base import TestBase
 
 
@@ -131,6 +136,28 @@ class TestAuth(TestAuthBase):
         self.assertStatus(self.client.get('/manager'), 200)
         self.assertStatus(self.client.get('/general'), 401)
 
+    def test_composite_permission(self):
+        """Test any-of and all-of role permissions"""
+        @self.app.route('/any')
+        @auth.require_any('admin', 'manager', http_exception=403)
+        def any_role():
+            return ''
+
+        @self.app.route('/all')
+        @auth.require_all('admin', 'manager', http_exception=403)
+        def all_roles():
+            return ''
+
+        self.assertStatus(self.client.get('/any'), 403)
+
+        self.login(self.manager_user_id)
+        self.assertStatus(self.client.get('/any'), 200)
+        self.assertStatus(self.client.get('/all'), 403)
+
+        self.login(self.admin_user_id)
+        self.assertStatus(self.client.get('/any'), 200)
+        self.assertStatus(self.client.get('/all'), 200)
+
     def test_user_invalidated_offline(self):
         """Test that user is logged out if their account is removed offline"""
         orig_user = Session.Storage.users[self.regular_user_id]
@@ -161,3 +188,626 @@ class TestAuthProviderMissing(TestAuthBase):
         self.client.post('/session', {'user_id': self.regular_user_id})
         self.assertEqual(self.client.get('/session').json['user_id'], self.regular_user_id)
         self.assertStatus(self.client.get('/auth'), 401)
+
+
+class CountingAuthProvider(SQLAlchemyAuthProvider):
+    def __init__(self, *args, **kargs):
+        super(CountingAuthProvider, self).__init__(*args, **kargs)
+        self.calls = 0
+
+    def identify(self, identity):
+        self.calls += 1
+        return super(CountingAuthProvider, self).identify(identity)
+
+
+class TestAuthLazyIdentity(TestAuthBase):
+    class __config__(object):
+        SECRET_KEY = 'secret key'
+        CARAFE_AUTH_LAZY_IDENTITY = True
+
+    def create_app(self):
+        self.provider = CountingAuthProvider(Session())
+        app = factory.create_app(__name__, config=self.__config__,
+                                 options={'auth': {'provider': self.provider}})
+        self.init_app(app)
+
+        return app
+
+    def setUp(self):
+        super(TestAuthLazyIdentity, self).setUp()
+
+        @self.app.route('/public')
+        def public():
+            return ''
+
+        @self.app.route('/admin')
+        @auth.require.admin(403)
+        def admin():
+            # identity is only loaded once per request
+            auth.require.login(401)(lambda: None)()
+            return ''
+
+    def test_lazy_identity(self):
+        self.login(self.admin_user_id)
+        self.provider.calls = 0
+        metrics = auth.metrics.copy()
+
+        # identity isn't loaded unless permissions are checked
+        self.assertStatus(self.client.get('/public'), 200)
+        self.assertEqual(self.provider.calls, 0)
+
+        self.assertStatus(self.client.get('/admin'), 200)
+        self.assertEqual(self.provider.calls, 1)
+
+        self.login(self.regular_user_id)
+        self.assertStatus(self.client.get('/admin'), 403)
+        self.assertStatus(self.client.get('/auth'), 200)
+
+        # login request defers both the session identity and the new identity
+        self.assertEqual(auth.metrics['identity_deferred'] - metrics['identity_deferred'], 6)
+        self.assertEqual(auth.metrics['identity_loaded'] - metrics['identity_loaded'], 3)
+
+    def test_lazy_identity_invalidated_offline(self):
+        orig_user = Session.Storage.users[self.regular_user_id]
+
+        self.login(self.regular_user_id)
+        del Session.Storage.users[self.regular_user_id]
+
+        try:
+            self.assertStatus(self.client.get('/auth'), 401)
+            self.assertNotIn('user_id', self.client.get('/session').json)
+        finally:
+            Session.Storage.users[self.regular_user_id] = orig_user
+
+
+class TestAuthIdentityCache(TestAuthBase):
+    class __config__(object):
+        SECRET_KEY = 'secret key'
+        CACHE_TYPE = 'simple'
+
+    def create_app(self):
+        self.provider = CountingAuthProvider(Session())
+        self.identity_cache = IdentityCache(maxsize=2, ttl=60, backend=cache)
+        app = factory.create_app(__name__, config=self.__config__,
+                                 options={'auth': {'provider': self.provider,
+                                                   'identity_cache': self.identity_cache}})
+        self.init_app(app)
+
+        return app
+
+    def setUp(self):
+        super(TestAuthIdentityCache, self).setUp()
+
+        @self.app.route('/admin')
+        @auth.require.admin(403)
+        def admin():
+            return ''
+
+        @self.app.route('/invalidate/<int:user_id>', methods=['POST'])
+        def invalidate(user_id):
+            auth.invalidate_user(user_id)
+            return ''
+
+    def test_identity_cache(self):
+        self.login(self.admin_user_id)
+        calls = self.provider.calls
+
+        for _ in range(3):
+            self.assertStatus(self.client.get('/admin'), 200)
+
+        self.assertEqual(self.provider.calls, calls)
+        self.assertTrue(self.identity_cache.stats()['hits'] >= 3)
+
+    def test_invalidate_on_login(self):
+        self.login(self.manager_user_id)
+        self.assertStatus(self.client.get('/admin'), 403)
+
+        user = Session.Storage.users[self.manager_user_id]
+        Session.Storage.users[self.manager_user_id] = user._replace(roles=['admin'])
+
+        try:
+            # cached roles are used until invalidated
+            self.assertStatus(self.client.get('/admin'), 403)
+
+            self.client.post('/invalidate/{0}'.format(self.manager_user_id), {})
+            self.assertStatus(self.client.get('/admin'), 200)
+
+            Session.Storage.users[self.manager_user_id] = user
+
+            # logging out and in again also reloads the identity
+            self.logout()
+            self.login(self.manager_user_id)
+            self.assertStatus(self.client.get('/admin'), 403)
+        finally:
+            Session.Storage.users[self.manager_user_id] = user
+
+    def test_cache_backend(self):
+        with self.app.test_request_context():
+            self.identity_cache.set(1, {'id': 1, 'roles': []})
+            self.identity_cache.clear()
+
+            other = IdentityCache(backend=cache)
+            self.assertEqual(other.get(1), {'id': 1, 'roles': []})
+            self.assertEqual(self.identity_cache.get(1), {'id': 1, 'roles': []})
+
+            self.identity_cache.invalidate(1)
+            self.assertIsNone(IdentityCache(backend=cache).get(1))
+
+
+class TestAuthToken(TestAuthBase):
+    class __config__(object):
+        SECRET_KEY = 'secret key'
+        CACHE_TYPE = 'simple'
+        CARAFE_AUTH_TOKEN_ENABLED = True
+        CARAFE_AUTH_TOKEN_SECRET_KEYS = ['key 1']
+
+    def create_app(self):
+        self.provider = CountingAuthProvider(Session())
+        app = factory.create_app(__name__, config=self.__config__,
+                                 options={'auth': {'provider': self.provider, 'token_store': cache}})
+        self.init_app(app)
+
+        return app
+
+    def setUp(self):
+        super(TestAuthToken, self).setUp()
+
+        @self.app.route('/admin')
+        @auth.require.admin(403)
+        def admin():
+            return ''
+
+        # client which only authenticates with the token header
+        self.header_client = self.app.test_client(use_cookies=False)
+
+    def get_token(self, user_id):
+        return self.login(user_id).headers['X-Auth-Token']
+
+    def test_token_cookie(self):
+        response = self.login(self.admin_user_id)
+        self.assertIn('auth_token=', response.headers['Set-Cookie'])
+        self.assertIn('HttpOnly', response.headers['Set-Cookie'])
+
+        calls = self.provider.calls
+
+        for _ in range(3):
+            self.assertStatus(self.client.get('/admin'), 200)
+
+        # identity is built from the token
+        self.assertEqual(self.provider.calls, calls)
+        self.assertTrue(auth.metrics['identity_token'] >= 3)
+
+    def test_token_header(self):
+        token = self.get_token(self.manager_user_id)
+        headers = {'X-Auth-Token': token}
+
+        self.assertStatus(self.header_client.get('/auth'), 401)
+        self.assertStatus(self.header_client.get('/auth', headers=headers), 200)
+        self.assertStatus(self.header_client.get('/admin', headers=headers), 403)
+
+        self.assertStatus(self.header_client.get('/auth', headers={'X-Auth-Token': token[:-2]}), 401)
+        self.assertStatus(self.header_client.get('/auth', headers={'X-Auth-Token': 'foo'}), 401)
+
+    def test_token_expired(self):
+        self.app.config['CARAFE_AUTH_TOKEN_TTL'] = -1
+        token = self.get_token(self.regular_user_id)
+
+        self.assertStatus(self.header_client.get('/auth', headers={'X-Auth-Token': token}), 401)
+
+    def test_token_refresh(self):
+        token = self.get_token(self.manager_user_id)
+        calls = self.provider.calls
+        user = Session.Storage.users[self.manager_user_id]
+        Session.Storage.users[self.manager_user_id] = user._replace(roles=['admin'])
+
+        try:
+            headers = {'X-Auth-Token': token}
+            self.assertStatus(self.header_client.get('/admin', headers=headers), 403)
+
+            # token nearing expiry is refreshed from the provider
+            self.app.config['CARAFE_AUTH_TOKEN_REFRESH'] = 3600
+            response = self.header_client.get('/admin', headers=headers)
+
+            self.assertStatus(response, 200)
+            self.assertEqual(self.provider.calls, calls + 1)
+            self.assertNotEqual(response.headers['X-Auth-Token'], token)
+        finally:
+            Session.Storage.users[self.manager_user_id] = user
+
+    def test_key_rotation(self):
+        headers = {'X-Auth-Token': self.get_token(self.regular_user_id)}
+
+        self.app.config['CARAFE_AUTH_TOKEN_SECRET_KEYS'] = ['key 2', 'key 1']
+        self.assertStatus(self.header_client.get('/auth', headers=headers), 200)
+
+        self.app.config['CARAFE_AUTH_TOKEN_SECRET_KEYS'] = ['key 2']
+        self.assertStatus(self.header_client.get('/auth', headers=headers), 401)
+
+    def test_logout_revokes_token(self):
+        token = self.get_token(self.regular_user_id)
+        headers = {'X-Auth-Token': token}
+
+        self.assertStatus(self.header_client.get('/auth', headers=headers), 200)
+
+        response = self.header_client.delete('/session', headers=headers)
+        self.assertIn('auth_token=;', response.headers['Set-Cookie'])
+
+        self.assertStatus(self.header_client.get('/auth', headers=headers), 401)
+
+        # other tokens of user aren't revoked
+        self.assertStatus(self.header_client.get('/auth', headers={
+            'X-Auth-Token': self.get_token(self.regular_user_id)}), 200)
+
+    def test_token_store_required(self):
+        self.assertRaises(ValueError, factory.create_app, __name__,
+                          config=self.__config__,
+                          options={'auth': {'provider': self.provider}})
+
+    def test_token_secret_key_required(self):
+        class Config(self.__config__):
+            SECRET_KEY = None
+            CARAFE_AUTH_TOKEN_SECRET_KEYS = None
+
+        self.assertRaises(ValueError, factory.create_app, __name__, config=Config,
+                          options={'auth': {'provider': self.provider, 'token_store': cache}})
+        self.assertRaises(ValueError, TokenSigner, [None])
+        self.assertRaises(ValueError, TokenSigner, [])
+
+    def test_token_signer(self):
+        token = TokenSigner(['key']).dumps({'sub': 1, 'roles': ['a']})
+
+        self.assertEqual(token.count('.'), 1)
+        self.assertEqual(TokenSigner([u'key']).loads(token), {'sub': 1, 'roles': ['a']})
+        self.assertIsNone(TokenSigner(['other']).loads(token))
+        self.assertIsNone(TokenSigner(['key']).loads(u'\xe9.' + token))
+        self.assertIsNone(TokenSigner(['key']).loads('e30.' + token.split('.')[1]))
+
+
+class TestPermissionFactory(TestBase):
+    def setUp(self):
+        self.require = PermissionFactory()
+
+    def test_compile(self):
+        # compiled permissions are reused
+        self.assertIs(self.require._compile(['admin', 'manager']),
+                      self.require._compile(['manager', 'admin']))
+
+        identity = Identity(1)
+        identity.provides.add(RoleNeed('admin'))
+        admin = self.require._compile(['admin'])
+        both = self.require._compile(['admin', 'manager'], match_all=True)
+
+        self.assertTrue(identity.can(admin))
+        self.assertFalse(identity.can(both))
+
+        identity.provides.add(RoleNeed('manager'))
+        self.assertTrue(identity.can(both))
+
+        # swapped needs are noticed
+        identity.provides.discard(RoleNeed('admin'))
+        identity.provides.add(RoleNeed('user'))
+        self.assertFalse(identity.can(admin))
+        self.assertFalse(identity.can(both))
+
+        self.assertTrue(Identity(2).can(self.require._compile([], match_all=True)))
+        self.assertFalse(Identity(2).can(admin))
+
+    def test_role_names(self):
+        # roles named like helpers are still reachable as attributes
+        for role in ('any', 'all', 'compile', 'need', 'mask', 'bits'):
+            self.assertTrue(callable(getattr(self.require, role)))
+
+    def test_require_context(self):
+        with self.app.test_request_context():
+            g.identity = Identity(1)
+
+            with self.assertRaises(PermissionDenied):
+                with self.require.admin():
+                    pass
+
+            g.identity.provides.add(RoleNeed('admin'))
+
+            with self.require.admin():
+                pass
+
+
+class TestIdentityCache(TestBase):
+    def test_lru(self):
+        identity_cache = IdentityCache(maxsize=2)
+
+        identity_cache.set(1, {'id': 1})
+        identity_cache.set(2, {'id': 2})
+        identity_cache.get(1)
+        identity_cache.set(3, {'id': 3})
+
+        self.assertEqual(identity_cache.get(1), {'id': 1})
+        self.assertIsNone(identity_cache.get(2))
+        self.assertEqual(identity_cache.get(3), {'id': 3})
+        self.assertEqual(identity_cache.stats(),
+                         {'hits': 3, 'misses': 1, 'size': 2, 'hit_rate': 0.75})
+
+    def test_ttl(self):
+        identity_cache = IdentityCache(ttl=0.05)
+        identity_cache.set(1, {'id': 1})
+        self.assertEqual(identity_cache.get(1), {'id': 1})
+
+        sleep(0.1)
+        self.assertIsNone(identity_cache.get(1))
+
+
+##
+# mock of the SQLAlchemy column/query API used by column-only identity loading
+##
+class Column(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return (self.name, [value])
+
+    def in_(self, values):
+        return (self.name, list(values))
+
+
+class ColumnSession(object):
+    # rows of (id, role, active) as returned by the outer joined query
+    rows = [
+        {'id': 1, 'role': None, 'active': True},
+        {'id': 2, 'role': 'admin', 'active': True},
+        {'id': 2, 'role': 'manager', 'active': True},
+        {'id': 4, 'role': 'admin', 'active': False},
+    ]
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, *columns):
+        return ColumnQuery(self, columns)
+
+
+class ColumnQuery(object):
+    def __init__(self, session, columns):
+        self.session = session
+        self.columns = columns
+        self.joins = []
+        self.filters = []
+
+    def outerjoin(self, join):
+        self.joins.append(join)
+        return self
+
+    def filter(self, expression):
+        self.filters.append(expression)
+        return self
+
+    def all(self):
+        self.session.queries.append(self)
+        rows = self.session.rows
+
+        for name, values in self.filters:
+            rows = [row for row in rows if row[name] in values]
+
+        return [tuple(row[column.name] for column in self.columns) for row in rows]
+
+
+class ColumnAuthProvider(SQLAlchemyAuthProvider):
+    __id_column__ = Column('id')
+    __role_column__ = Column('role')
+    __role_joins__ = ['User.roles']
+    __active_column__ = Column('active')
+
+
+class TestColumnAuthProvider(TestBase):
+    def setUp(self):
+        self.session = ColumnSession()
+        self.provider = ColumnAuthProvider(self.session)
+
+    def identify(self, _id):
+        return self.provider.identify(Identity(_id))
+
+    def test_identify(self):
+        self.assertEqual(self.identify(1), {'id': 1, 'roles': []})
+        self.assertEqual(self.identify(2), {'id': 2, 'roles': ['admin', 'manager']})
+
+        # one query per identity
+        self.assertEqual(len(self.session.queries), 2)
+        query = self.session.queries[-1]
+        self.assertEqual([column.name for column in query.columns], ['id', 'role', 'active'])
+        self.assertEqual(query.joins, ['User.roles'])
+
+    def test_identify_missing_or_inactive(self):
+        self.assertEqual(self.identify(3), {})
+        self.assertEqual(self.identify(4), {})
+        self.assertEqual(self.identify(None), {})
+
+    def test_identify_without_roles(self):
+        class IdOnlyProvider(SQLAlchemyAuthProvider):
+            __id_column__ = Column('id')
+
+        provider = IdOnlyProvider(self.session)
+        self.assertEqual(provider.identify(Identity(2)), {'id': 2, 'roles': []})
+        self.assertEqual([column.name for column in self.session.queries[-1].columns], ['id'])
+
+
+##
+# real SQLAlchemy models backed by an in-memory SQLite database
+##
+SQLiteBase = declarative_base()
+
+user_roles = Table('user_roles', SQLiteBase.metadata,
+                   SAColumn('user_id', Integer, ForeignKey('users.id')),
+                   SAColumn('role_id', Integer, ForeignKey('roles.id')))
+
+
+class SQLiteRole(SQLiteBase):
+    __tablename__ = 'roles'
+    id = SAColumn(Integer, primary_key=True)
+    name = SAColumn(String)
+
+
+class SQLiteUser(SQLiteBase):
+    __tablename__ = 'users'
+    id = SAColumn(Integer, primary_key=True)
+    active = SAColumn(Boolean, default=True)
+    roles = relationship(SQLiteRole, secondary=user_roles, order_by=SQLiteRole.name)
+
+
+class SQLiteColumnAuthProvider(SQLAlchemyAuthProvider):
+    __id_column__ = SQLiteUser.id
+    __role_column__ = SQLiteRole.name
+    __role_joins__ = [SQLiteUser.roles]
+    __active_column__ = SQLiteUser.active
+
+
+class SQLiteModelAuthProvider(SQLAlchemyAuthProvider):
+    __model__ = SQLiteUser
+
+    def get_roles(self, user):
+        return [role.name for role in user.roles]
+
+
+class TestSQLiteAuthProvider(TestBase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        SQLiteBase.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        admin, manager = SQLiteRole(name='admin'), SQLiteRole(name='manager')
+        self.session.add_all([
+            SQLiteUser(id=1),
+            SQLiteUser(id=2, roles=[admin, manager]),
+            SQLiteUser(id=4, active=False, roles=[admin])
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_column_provider(self):
+        provider = SQLiteColumnAuthProvider(self.session)
+
+        self.assertEqual(provider.identify(Identity(1)), {'id': 1, 'roles': []})
+        self.assertEqual(provider.identify(Identity(2)), {'id': 2, 'roles': ['admin', 'manager']})
+        self.assertEqual(provider.identify(Identity(3)), {})
+        self.assertEqual(provider.identify(Identity(4)), {})
+
+        provider.identify_many_chunk_size = 2
+        self.assertEqual(provider.identify_many([1, 2, 3, 4]), {
+            1: {'id': 1, 'roles': []},
+            2: {'id': 2, 'roles': ['admin', 'manager']}
+        })
+
+    def test_model_provider(self):
+        provider = SQLiteModelAuthProvider(self.session)
+
+        self.assertEqual(provider.identify(Identity(2)), {'id': 2, 'roles': ['admin', 'manager']})
+        self.assertEqual(provider.identify(Identity(3)), {})
+        self.assertEqual(provider.identify_many([1, 2, 3]), {
+            1: {'id': 1, 'roles': []},
+            2: {'id': 2, 'roles': ['admin', 'manager']}
+        })
+
+    def test_model_provider_identify_many_loads_roles_once(self):
+        provider = SQLiteModelAuthProvider(self.session)
+        statements = []
+        event.listen(self.session.bind, 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+
+        self.session.expire_all()
+        idents = provider.identify_many([1, 2, 4])
+
+        self.assertEqual(idents[4], {'id': 4, 'roles': ['admin']})
+        # users and their roles
+        self.assertEqual(len(statements), 2)
+
+
+class ModelSession(object):
+    class User(object):
+        id = Column('id')
+
+        def __init__(self, _id, roles):
+            self.id = _id
+            self.roles = roles
+
+    users = [User(1, []), User(2, ['admin'])]
+
+    def __init__(self):
+        self.queries = 0
+
+    def query(self, model):
+        session = self
+
+        class Query(object):
+            def filter(self, expression):
+                self.ids = expression[1]
+                return self
+
+            def all(self):
+                session.queries += 1
+                return [user for user in session.users if user.id in self.ids]
+
+        return Query()
+
+
+class ModelAuthProvider(SQLAlchemyAuthProvider):
+    __model__ = ModelSession.User
+
+
+class TestIdentifyMany(TestAuthBase):
+    class __config__(object):
+        SECRET_KEY = 'secret key'
+
+    def create_app(self):
+        self.session = ColumnSession()
+        self.identity_cache = IdentityCache()
+        app = factory.create_app(__name__, config=self.__config__,
+                                 options={'auth': {'provider': ColumnAuthProvider(self.session),
+                                                   'identity_cache': self.identity_cache}})
+        self.init_app(app)
+
+        return app
+
+    def test_provider_identify_many(self):
+        provider = ColumnAuthProvider(self.session)
+        provider.identify_many_chunk_size = 2
+
+        self.assertEqual(provider.identify_many([1, 2, 3, 4, 2, None]), {
+            1: {'id': 1, 'roles': []},
+            2: {'id': 2, 'roles': ['admin', 'manager']}
+        })
+
+        # one IN query per chunk of unique ids
+        self.assertEqual([query.filters for query in self.session.queries],
+                         [[('id', [1, 2])], [('id', [3, 4])]])
+
+    def test_provider_identify_many_models(self):
+        session = ModelSession()
+        provider = ModelAuthProvider(session)
+
+        self.assertEqual(provider.identify_many([1, 2, 3]), {
+            1: {'id': 1, 'roles': []},
+            2: {'id': 2, 'roles': ['admin']}
+        })
+        self.assertEqual(session.queries, 1)
+
+    def test_auth_identify_many(self):
+        with self.app.test_request_context():
+            self.identity_cache.set(1, {'id': 1, 'roles': ['cached']})
+
+            self.assertEqual(auth.identify_many([1, 2, 3]), {
+                1: {'id': 1, 'roles': ['cached']},
+                2: {'id': 2, 'roles': ['admin', 'manager']}
+            })
+            self.assertEqual(self.session.queries[-1].filters, [('id', [2, 3])])
+
+            # loaded identities are cached
+            self.assertEqual(self.identity_cache.get(2), {'id': 2, 'roles': ['admin', 'manager']})
+            auth.identify_many([1, 2])
+            self.assertEqual(len(self.session.queries), 1)
+
+    def test_auth_identify_many_generator(self):
+        with self.app.test_request_context():
+            self.assertEqual(auth.identify_many(_id for _id in [1, 2, 3]), {
+                1: {'id': 1, 'roles': []},
+                2: {'id': 2, 'roles': ['admin', 'manager']}
+            })
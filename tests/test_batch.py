@@ -0,0 +1,138 @@
+
+from threading import current_thread
+from time import sleep
+
+from flask import g, request, session
+
+import carafe
+from carafe.ext.cache import after_post
+
+from .core import cache
+from .base import TestBase
+
+
+class TestBatch(TestBase):
+    class __config__(object):
+        SECRET_KEY = 'secret key'
+        CACHE_TYPE = 'simple'
+        CACHE_KEY_PREFIX = ''
+        CARAFE_BATCH_MAX_REQUESTS = 10
+
+    __client_class__ = carafe.JSONClient
+
+    def setUp(self):
+        self.tracker = {'items': 0, 'threads': set()}
+        self.items = []
+
+        @self.app.route('/items', methods=['GET'])
+        @cache.cached_view(namespace='items')
+        def items():
+            self.tracker['items'] += 1
+            return {'items': list(self.items), 'args': request.args.to_dict()}
+
+        @self.app.route('/items', methods=['POST'])
+        def items_post():
+            self.items.append(request.get_dict()['name'])
+            after_post.send(items)
+            return ({'created': True}, 201)
+
+        @self.app.route('/slow')
+        def slow():
+            self.tracker['threads'].add(current_thread().name)
+            sleep(0.1)
+            return {'user_id': session.get('user_id')}
+
+        @self.app.route('/session', methods=['POST'])
+        def session_post():
+            session['user_id'] = request.get_dict()['user_id']
+            return ''
+
+        @self.app.route('/error')
+        def error():
+            raise Exception('error')
+
+    def batch(self, subrequests):
+        return self.client.post('/batch', subrequests)
+
+    def test_batch(self):
+        res = self.batch([
+            {'path': '/items', 'params': {'a': '1'}},
+            {'method': 'post', 'path': '/items', 'body': {'name': 'foo'}},
+            {'path': '/items'},
+            {'path': '/missing'},
+            {'path': '/error'},
+        ])
+
+        self.assertStatus(res, 200)
+        self.assertEqual([result['status'] for result in res.json], [200, 201, 200, 404, 500])
+        self.assertEqual(res.json[0]['body'], {'items': [], 'args': {'a': '1'}})
+        self.assertEqual(res.json[1]['body'], {'created': True})
+        self.assertEqual(res.json[2]['body'], {'items': ['foo'], 'args': {}})
+        self.assertEqual(res.json[2]['headers']['Content-Type'], 'application/json')
+
+    def test_batch_cached_view(self):
+        self.client.get('/items')
+        # concurrent sub-requests are both served from the cache
+        self.batch([{'path': '/items'}, {'path': '/items'}])
+
+        self.assertEqual(self.tracker['items'], 1)
+
+    def test_batch_concurrent_gets_shared_session(self):
+        self.client.post('/session', {'user_id': 5})
+
+        res = self.batch([{'path': '/slow'} for _ in range(4)])
+
+        self.assertEqual([result['body'] for result in res.json], [{'user_id': 5}] * 4)
+        self.assertTrue(len(self.tracker['threads']) > 1)
+
+    def test_batch_session_changes(self):
+        res = self.batch([{'method': 'POST', 'path': '/session', 'body': {'user_id': 7}}])
+
+        self.assertIn('Set-Cookie', res.headers)
+        self.assertEqual(self.batch([{'path': '/slow'}]).json[0]['body'], {'user_id': 7})
+
+        # later sub-requests see session changes made by earlier ones
+        res = self.batch([
+            {'method': 'POST', 'path': '/session', 'body': {'user_id': 9}},
+            {'path': '/slow'}
+        ])
+        self.assertEqual(res.json[1]['body'], {'user_id': 9})
+
+    def test_batch_isolates_g(self):
+        @self.app.route('/g', methods=['POST'])
+        def set_g():
+            g.batch_value = 'sub'
+            return {'request_id': g.carafe_request_id}
+
+        g.batch_value = None
+
+        res = self.client.post('/batch',
+                               [{'method': 'POST', 'path': '/g'}],
+                               headers={'X-Request-Id': 'batch-1'})
+
+        self.assertEqual(res.headers['X-Request-Id'], 'batch-1')
+        self.assertNotEqual(res.json[0]['body']['request_id'], 'batch-1')
+        self.assertEqual(res.json[0]['headers']['X-Request-Id'],
+                         res.json[0]['body']['request_id'])
+        self.assertIsNone(g.batch_value)
+
+    def test_batch_invalid(self):
+        self.assertStatus(self.batch({'path': '/items'}), 400)
+        self.assertStatus(self.batch([{'path': '/items'}] * 11), 400)
+
+        res = self.batch(['/items', {'path': 'items'}, {'path': '/batch'}, {'path': 1},
+                          {'path': ['/items']}, {'path': '/items', 'params': [1]}])
+
+        self.assertEqual([result['status'] for result in res.json], [400] * 6)
+
+    def test_batch_forwards_auth_token_header(self):
+        @self.app.route('/token')
+        def token():
+            return {'token': request.headers.get('X-Auth-Token')}
+
+        res = self.client.post('/batch', [{'path': '/token'}], headers={'X-Auth-Token': 'abc'})
+        self.assertEqual(res.json[0]['body'], {'token': 'abc'})
+
+        self.app.config['CARAFE_AUTH_TOKEN_HEADER'] = None
+        res = self.client.post('/batch', [{'path': '/token'}], headers={'X-Auth-Token': 'abc'})
+        self.assertEqual(res.json[0]['body'], {'token': None})
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+
+from flask import request
+
+from carafe.bench import Benchmark, Report, main, percentile
+
+from . import factory
+from .base import TestBase
+from .core import cache
+
+
+class BenchConfig(object):
+    CACHE_TYPE = 'simple'
+    CARAFE_CACHE_STATUS_HEADER = 'X-Cache'
+
+
+def create_bench_app():
+    app = factory.create_app(__name__, config=BenchConfig)
+
+    @app.route('/items', methods=['GET', 'POST'])
+    @cache.cached_view()
+    def items():
+        if request.method == 'POST':
+            return request.get_dict()
+        return [{'id': 1}]
+
+    @app.route('/error')
+    def error():
+        raise Exception('error')
+
+    return app
+
+
+class TestBench(TestBase):
+    scenario = [
+        {'name': 'list', 'path': '/items', 'weight': 3},
+        {'name': 'create', 'method': 'POST', 'path': '/items', 'body': {'a': 1}}
+    ]
+
+    def create_app(self):
+        return create_bench_app()
+
+    def test_thread_mode(self):
+        report = Benchmark(self.app, self.scenario, requests=40, concurrency=4, warmup=2,
+                           cache_header='X-Cache').run()
+        data = report.to_dict()
+
+        self.assertEqual(data['total']['count'], 40)
+        self.assertEqual(data['total']['errors'], 0)
+        self.assertEqual(list(data['endpoints']), ['list', 'create'])
+        self.assertEqual(data['endpoints']['list']['count'], 30)
+        self.assertEqual(data['endpoints']['create']['count'], 10)
+        self.assertEqual(data['endpoints']['create']['statuses'], {200: 10})
+
+        # all recorded GETs hit the cache populated during warm-up
+        self.assertEqual(data['endpoints']['list']['cache'].keys(), ['HIT'])
+        self.assertEqual(data['endpoints']['list']['cache']['HIT']['count'], 30)
+
+        stats = data['endpoints']['list']
+        self.assertTrue(0 < stats['p50'] <= stats['p90'] <= stats['p99'] <= stats['max'])
+        self.assertTrue(stats['throughput'] > 0)
+
+        self.assertIn('TOTAL', report.format())
+
+    def test_process_mode(self):
+        report = Benchmark('tests.test_bench:create_bench_app', self.scenario,
+                           requests=9, concurrency=2, mode='process').run()
+        data = report.to_dict()
+
+        self.assertEqual(data['total']['count'], 9)
+        self.assertEqual(data['endpoints']['list']['count'], 7)
+
+    def test_errors(self):
+        report = Benchmark(self.app, [{'path': '/error'}], requests=3).run()
+        self.assertEqual(report.to_dict()['endpoints']['/error']['errors'], 3)
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, Benchmark, self.app, self.scenario, mode='foo')
+        self.assertRaises(ValueError, Benchmark, self.app, self.scenario, mode='process')
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([5], 99), 5)
+        self.assertIsNone(percentile([], 50))
+
+    def test_report(self):
+        samples = [('a', 0.001, 200, None), ('a', 0.003, 500, None), ('b', 0.002, None, None)]
+        data = Report(samples, 1.0).to_dict()
+
+        self.assertEqual(data['total']['count'], 3)
+        self.assertEqual(data['total']['errors'], 2)
+        self.assertEqual(data['total']['throughput'], 3.0)
+        self.assertEqual(data['endpoints']['a']['max'], 3.0)
+        self.assertNotIn('cache', data['endpoints']['a'])
+
+    def test_report_without_samples(self):
+        report = Report([], 1.0)
+
+        self.assertIsNone(report.to_dict()['total']['p99'])
+        self.assertIn('n/a', report.format().splitlines()[-1])
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'requests': self.scenario}, fp)
+
+            args = ['tests.test_bench:create_bench_app', path, '-n', '8', '-c', '2', '--json']
+
+            self.assertEqual(main(args), 0)
+            self.assertEqual(main(args + ['--max-p99', '0']), 1)
+            self.assertEqual(main(args[:2] + ['-n', '0', '--max-p99', '1000']), 1)
+        finally:
+            os.remove(path)
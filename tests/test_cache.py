@@ -187,6 +187,87 @@ class TestCache(TestCacheBase):
         self.assertTrue('index:view:/?a=a&b=b' in cache_keys or 'index:view:/?b=b&a=a' in cache_keys)
         self.assertIn('noviewargs:view:/noviewargs', cache_keys)
 
+    def test_cached_view_fieldset_args(self):
+        @self.app.route('/noviewargs')
+        @cache.cached_view(include_request_args=False)
+        def noviewargs():
+            return ''
+
+        # equivalent field specifications share the same key and sparse
+        # fieldsets are part of the key even when other args aren't
+        self.client.get('/noviewargs', params={'fields': 'b,a', 'x': 'y'})
+        self.client.get('/noviewargs', params={'fields': 'a,b'})
+
+        cache_keys = self.cache_keys()
+
+        self.assertEqual(len(cache_keys), 1)
+        self.assertIn('noviewargs:view:/noviewargs?fields=a%2Cb', cache_keys)
+
+
+class TestCacheETag(TestCacheBase):
+    class __config__(object):
+        CACHE_TYPE = 'simple'
+        CACHE_KEY_PREFIX = ''
+        CARAFE_ETAG_ENABLED = True
+
+    def setUp(self):
+        cache.cache._client = MockCacheServer()
+
+    def test_cached_view_etag(self):
+        tracker = {'count': 0}
+
+        @self.app.route('/etag')
+        @cache.cached_view(timeout=10)
+        def etag():
+            tracker['count'] += 1
+            return {'count': tracker['count']}
+
+        res = self.client.get('/etag')
+        etag, weak = res.get_etag()
+
+        self.assertStatus(res, 200)
+        self.assertTrue(weak)
+        self.assertIn('etag:view:/etag#etag', self.cache_keys())
+
+        # cache hit returns the same etag
+        self.assertEqual(self.client.get('/etag').get_etag(), (etag, weak))
+
+        # matching etag is answered without running the view
+        res = self.client.get('/etag', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertStatus(res, 304)
+        self.assertEqual(tracker['count'], 1)
+
+        # clearing the view key gives the recomputed view a new etag
+        cache.clear_keys('etag:view:/etag')
+        res = self.client.get('/etag', headers={'If-None-Match': 'W/"{0}"'.format(etag)})
+
+        self.assertStatus(res, 200)
+        self.assertEqual(res.json['count'], 2)
+        self.assertNotEqual(res.get_etag()[0], etag)
+
+
+class TestCacheStatusHeader(TestCacheBase):
+    class __config__(object):
+        CACHE_TYPE = 'simple'
+        CACHE_KEY_PREFIX = ''
+        CARAFE_CACHE_STATUS_HEADER = 'X-Cache'
+
+    def test_cached_view_status_header(self):
+        self.assertEqual(self.client.get('/1').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/1').headers['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/2').headers['X-Cache'], 'MISS')
+
+    def test_cached_view_status_header_etag(self):
+        self.app.config['CARAFE_ETAG_ENABLED'] = True
+
+        res = self.client.get('/1')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+        res = self.client.get('/1', headers={'If-None-Match': res.headers['ETag']})
+        self.assertStatus(res, 304)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+
 
 class TestCacheClear(TestCacheBase):
 
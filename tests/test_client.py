@@ -1,6 +1,17 @@
 
+import errno
+import httplib
+import json
+import socket
+from threading import Thread, current_thread
+from time import sleep, time
+import zlib
+
 from flask import request
-from carafe import Client, JSONClient
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from carafe import Client, JSONClient, ConcurrentClient, HTTPClient
+from carafe.client import gather, is_connection_closed
 from carafe.utils import jsonify
 
 from .base import TestBase
@@ -51,3 +62,185 @@ class TestJSONClient(TestClientBase):
         """Test that invalid data is not converted"""
         invalid = {'x': object(), 'y': 2}
         self.assertEqual(self.client.post('/', invalid).json['data'], {})
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kargs):
+        pass
+
+
+class TestHTTPClient(TestClientBase):
+    def setUp(self):
+        super(TestHTTPClient, self).setUp()
+        self.tracker = {'ports': set(), 'calls': 0}
+
+        @self.app.route('/port')
+        def port():
+            self.tracker['ports'].add(request.environ['REMOTE_PORT'])
+            return {}
+
+        @self.app.route('/flaky', methods=['GET', 'POST'])
+        def flaky():
+            # werkzeug's dev server doesn't drain unread bodies of keep-alive
+            # requests
+            request.get_dict()
+            self.tracker['calls'] += 1
+            if self.tracker['calls'] < 3:
+                return {}, 503
+            return {'calls': self.tracker['calls']}
+
+        @self.app.route('/gzip')
+        def compressed():
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            data = compressor.compress(json.dumps({'a': 'b' * 100})) + compressor.flush()
+            return self.app.response_class(data, headers={'Content-Encoding': 'gzip'},
+                                           mimetype='application/json')
+
+        @self.app.route('/slow', methods=['GET', 'POST'])
+        def slow():
+            request.get_dict()
+            self.tracker['calls'] += 1
+            sleep(0.5)
+            return {}
+
+        self.server = make_server('127.0.0.1', 0, self.app, threaded=True,
+                                  request_handler=KeepAliveRequestHandler)
+        # ignore errors of requests which the client gave up on
+        self.server.handle_error = lambda request, client_address: None
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.http = HTTPClient('http://127.0.0.1:{0}'.format(self.server.server_port),
+                               backoff=0.01)
+
+    def tearDown(self):
+        self.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_methods(self):
+        data = {'x': 1, 'y': [2]}
+        params = {'a': '3'}
+
+        self.assertEqual(self.http.get('/', params).json, {'data': {}, 'params': params})
+        self.assertEqual(self.http.get('/?a=3').json['params'], params)
+        self.assertEqual(self.http.post('/', data).json['data'], data)
+        self.assertEqual(self.http.put('/', data).json['data'], data)
+        self.assertEqual(self.http.patch('/', data).json['data'], data)
+        self.assertStatus(self.http.delete('/'), 200)
+        self.assertEqual(self.http.head('/').data, '')
+
+        res = self.http.post('/', {'x': '1'}, content_type='application/x-www-form-urlencoded')
+        self.assertEqual(res.json['data'], {'x': '1'})
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertStatus(self.http.get('/port'), 200)
+
+        self.assertEqual(len(self.tracker['ports']), 1)
+
+    def test_retry(self):
+        res = self.http.get('/flaky')
+        self.assertStatus(res, 200)
+        self.assertEqual(res.json['calls'], 3)
+
+        # non-idempotent requests aren't retried
+        self.tracker['calls'] = 0
+        self.assertStatus(self.http.post('/flaky', {}), 503)
+
+        # retries are limited
+        self.tracker['calls'] = 0
+        self.http.retries = 1
+        self.assertStatus(self.http.get('/flaky'), 503)
+
+    def test_decompress(self):
+        res = self.http.get('/gzip')
+        self.assertEqual(res.json, {'a': 'b' * 100})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+        self.http.decompress = False
+        self.assertEqual(self.http.get('/gzip').headers['Content-Encoding'], 'gzip')
+
+    def test_timeout(self):
+        http = HTTPClient(self.http.base_url, timeout=0.1, retries=0)
+        self.assertRaises(socket.timeout, http.get, '/slow')
+        http.close()
+
+    def test_timeout_not_retried(self):
+        http = HTTPClient(self.http.base_url, timeout=0.2, retries=2, backoff=0.01)
+        self.assertStatus(http.get('/port'), 200)
+
+        # timeouts on reused connections don't count as stale connections
+        self.assertRaises(socket.timeout, http.post, '/slow', {})
+        self.assertEqual(self.tracker['calls'], 1)
+        http.close()
+
+    def test_stale_connection_retried(self):
+        self.http.retries = 1
+        self.assertStatus(self.http.get('/port'), 200)
+
+        # server closed the idle connection
+        connection = self.http.pool.idle.values()[0][0]
+        connection.sock.shutdown(socket.SHUT_RDWR)
+
+        self.assertEqual(self.http.post('/', {'x': 1}).json['data'], {'x': 1})
+
+    def test_is_connection_closed(self):
+        self.assertTrue(is_connection_closed(httplib.BadStatusLine('')))
+        self.assertFalse(is_connection_closed(httplib.BadStatusLine('HTTP/1.1 2')))
+        self.assertTrue(is_connection_closed(socket.error(errno.ECONNRESET, 'reset')))
+        self.assertFalse(is_connection_closed(socket.timeout('timed out')))
+
+    def test_invalid_url(self):
+        self.assertRaises(ValueError, self.http.get, 'ftp://localhost/')
+
+
+class TestConcurrentClient(TestClientBase):
+    def setUp(self):
+        super(TestConcurrentClient, self).setUp()
+
+        @self.app.route('/slow')
+        def slow():
+            sleep(0.2)
+            return {'thread': current_thread().name}
+
+        @self.app.route('/error')
+        def error():
+            raise Exception('error')
+
+    def test_concurrent(self):
+        with ConcurrentClient(self.app, max_workers=5) as client:
+            started = time()
+            responses = gather(*[client.get('/slow') for _ in range(5)])
+
+            self.assertTrue(time() - started < 0.6)
+            self.assertEqual(len(set(res.json['thread'] for res in responses)), 5)
+
+    def test_methods(self):
+        data = {'x': 1}
+
+        with ConcurrentClient(self.app, max_workers=2) as client:
+            get, post, put, patch, delete = gather(
+                client.get('/', {'a': '1'}),
+                client.post('/', data),
+                client.put('/', data),
+                client.patch('/', data),
+                client.delete('/'))
+
+        self.assertEqual(get.json['params'], {'a': '1'})
+        self.assertEqual(post.json['data'], data)
+        self.assertEqual(put.json['data'], data)
+        self.assertEqual(patch.json['data'], data)
+        self.assertStatus(delete, 200)
+
+    def test_error(self):
+        self.app.config['TESTING'] = False
+
+        with ConcurrentClient(self.app) as client:
+            self.assertStatus(client.get('/error').get(), 500)
+
+            self.app.config['PROPAGATE_EXCEPTIONS'] = True
+            self.assertRaises(Exception, gather, client.get('/error'))
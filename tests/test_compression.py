@@ -0,0 +1,56 @@
+
+from io import BytesIO
+import gzip
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from carafe.compression import DecompressingStream
+
+from .base import TestBase
+
+
+def gzip_compress(data):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+        fp.write(data)
+    return buf.getvalue()
+
+
+class TestDecompressingStream(TestBase):
+    data = b'line one\nline two\n' * 1000
+
+    def stream(self, data, encoding='gzip', **kargs):
+        return DecompressingStream(BytesIO(data), encoding, **kargs)
+
+    def test_gzip(self):
+        stream = self.stream(gzip_compress(self.data), chunk_size=100)
+        self.assertEqual(stream.read(), self.data)
+
+    def test_deflate(self):
+        self.assertEqual(self.stream(zlib.compress(self.data), 'deflate').read(), self.data)
+
+        # raw deflate without zlib header
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = compressor.compress(self.data) + compressor.flush()
+        self.assertEqual(self.stream(raw, 'deflate').read(), self.data)
+
+    def test_read_size_and_readline(self):
+        stream = self.stream(gzip_compress(self.data), chunk_size=7)
+
+        self.assertEqual(stream.read(4), b'line')
+        self.assertEqual(stream.readline(), b' one\n')
+        self.assertEqual(list(stream), [b'line two\n'] + [b'line one\n', b'line two\n'] * 999)
+        self.assertEqual(stream.read(), b'')
+
+    def test_invalid(self):
+        self.assertRaises(BadRequest, self.stream(b'not compressed').read)
+
+    def test_max_length(self):
+        stream = self.stream(gzip_compress(self.data), max_length=len(self.data) - 1)
+        self.assertRaises(RequestEntityTooLarge, stream.read)
+
+    def test_max_ratio(self):
+        bomb = gzip_compress(b'\0' * (1024 * 1024))
+        self.assertRaises(RequestEntityTooLarge, self.stream(bomb, max_ratio=100).read)
+        self.assertEqual(len(self.stream(bomb, max_ratio=None).read()), 1024 * 1024)
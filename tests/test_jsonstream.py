@@ -0,0 +1,87 @@
+
+from io import BytesIO
+import json
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from carafe.jsonstream import JSONArrayStream, check_depth, check_value
+
+from .base import TestBase
+
+
+class TestJSONArrayStream(TestBase):
+    items = [
+        1, -2.5e3, 'string with "quotes", [brackets] and \\ slashes', None, True,
+        {'a': [1, 2, {'b': '}]'}]}, [], {}, [[u'\u2603']]
+    ]
+
+    def parse(self, body, **kargs):
+        return list(JSONArrayStream(BytesIO(body), **kargs))
+
+    def test_parse(self):
+        body = json.dumps(self.items).encode('utf-8')
+
+        for chunk_size in (1, 2, 7, 64 * 1024):
+            self.assertEqual(self.parse(body, chunk_size=chunk_size), self.items)
+
+    def test_parse_whitespace(self):
+        self.assertEqual(self.parse(b' \n[ 1 ,\n\t"a" , [ ] ]\n', chunk_size=1), [1, 'a', []])
+        self.assertEqual(self.parse(b'[]'), [])
+
+    def test_parse_invalid(self):
+        for body in (b'', b'{"a": 1}', b'[1, 2', b'[1 2]', b'[1,,2]', b'[{"a": 1]', b'["abc'):
+            self.assertRaises(BadRequest, self.parse, body, chunk_size=3)
+
+    def test_parse_is_incremental(self):
+        stream = BytesIO(b'[1, 2, ' + b' ' * 1000 + b'3]')
+        items = iter(JSONArrayStream(stream, chunk_size=8))
+
+        self.assertEqual(next(items), 1)
+        self.assertTrue(stream.tell() < 100)
+
+    def test_max_depth(self):
+        self.assertEqual(self.parse(b'[[1], {"a": 2}]', max_depth=2), [[1], {'a': 2}])
+        self.assertRaises(BadRequest, self.parse, b'[[[1]]]', max_depth=2)
+
+    def test_max_depth_scalars(self):
+        self.assertEqual(self.parse(b'[1, "a"]', max_depth=1), [1, 'a'])
+        self.assertRaises(BadRequest, self.parse, b'[1, []]', max_depth=1)
+
+    def test_parse_large_element(self):
+        item = ['x' * 100] * 1000
+        body = json.dumps([1, item, 12345]).encode('utf-8')
+
+        self.assertEqual(self.parse(body, chunk_size=16), [1, item, 12345])
+
+    def test_parse_deeply_nested(self):
+        self.assertRaises(BadRequest, self.parse, b'[' * 100000 + b']' * 100000)
+
+    def test_max_content_length(self):
+        self.assertRaises(RequestEntityTooLarge, self.parse, b'[1, 2, 3, 4]',
+                          max_content_length=5, chunk_size=2)
+
+    def test_check_depth(self):
+        check_depth('{"a": [1, "]]]]"]}', 2)
+        check_depth('[[[[1]]]]', None)
+        self.assertRaises(BadRequest, check_depth, '{"a": [{}]}', 2)
+
+    def test_max_keys_and_array_length(self):
+        self.assertEqual(self.parse(b'[{"a": 1, "b": [1, 2]}, []]', max_keys=2, max_array_length=2),
+                         [{'a': 1, 'b': [1, 2]}, []])
+        self.assertRaises(BadRequest, self.parse, b'[1, 2, 3]', max_array_length=2)
+        self.assertRaises(BadRequest, self.parse, b'[{"a": 1, "b": 2}]', max_keys=1)
+
+    def test_check_depth_strings(self):
+        check_depth('["[[[", "\\"[[[", {"a": "{{{"}]', 2)
+        check_depth('[[], {}, [{}], {"a": []}]', 3)
+        self.assertRaises(BadRequest, check_depth, '[[], {}, [{}], {"a": [[]]}]', 3)
+        # Malformed JSON is left for the parser to reject.
+        check_depth('[[[[', 2)
+
+    def test_check_value(self):
+        check_value({'a': 'x,y,z', 'b': [], 'c': {}}, max_keys=3, max_array_length=1)
+        check_value([[1, 2], [3, 4]], max_array_length=2)
+        check_value(None, max_keys=1)
+        self.assertRaises(BadRequest, check_value, {'a': {'b': 1, 'c': 2}}, max_keys=1)
+        self.assertRaises(BadRequest, check_value, [[], [1, 2, 3]], max_array_length=2)
+        self.assertRaises(BadRequest, check_value, [1, []], max_array_length=1)
@@ -1,10 +1,18 @@
 
+import json
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 import smtplib
+from StringIO import StringIO
+from threading import Event, Thread
+from time import sleep
 
-from carafe.ext.logger import Logger
+from flask import g
+from flask_principal import Identity
+
+from carafe.ext.logger import (
+    Logger, QueueHandler, DigestSMTPHandler, RequestEnviron, REDACTED, get_request_id)
 from .core import logger, Logger
 
 from .base import TestBase
@@ -194,3 +202,390 @@ class TestAdditionalLoggers(TestLoggerBase):
         self.assertIn(warn_msg, lines[0])
 
         self.assertEqual(len(self.outbox()), 1)
+
+
+class TestQueueLogger(TestLoggerBase):
+    class __config__(TestAdditionalLoggers.__config__):
+        CARAFE_LOGGER_QUEUE_ENABLED = True
+
+    def queue_handlers(self):
+        return [handler for handler in self.app.logger.handlers if isinstance(handler, QueueHandler)]
+
+    def test_queue_handlers(self):
+        @self.app.route('/log')
+        def log():
+            try:
+                raise ValueError('bad value')
+            except ValueError:
+                logger.exception('error %s', 'logged')
+            return ''
+
+        self.client.get('/log?page=2')
+
+        handlers = self.queue_handlers()
+        self.assertEqual(len(handlers), 2)
+
+        for handler in handlers:
+            handler.flush()
+
+        lines = self.get_log_lines()
+        self.assertIn('error logged', lines[0])
+        self.assertEqual(''.join(lines).count('ValueError: bad value'), 1)
+
+        msg = self.outbox()[0].fullmessage
+        self.assertIn('Application Error: http://localhost/log?page=2', msg)
+        self.assertIn("'REQUEST_ARGS': {   'page': u'2'}", msg)
+        self.assertIn('ValueError: bad value', msg)
+
+
+class TestDigestSMTPLogger(TestLoggerBase):
+    class __config__(TestSMTPLogger.__config__):
+        CARAFE_LOGGER_SMTP_DIGEST_ENABLED = True
+        CARAFE_LOGGER_SMTP_DIGEST_WINDOW = 60
+        CARAFE_LOGGER_SMTP_DIGEST_SAMPLES = 2
+        CARAFE_LOGGER_SMTP_DIGEST_FINGERPRINT_LIMIT = 2
+        CARAFE_LOGGER_SMTP_DIGEST_GLOBAL_LIMIT = 3
+
+    def setUp(self):
+        self.handler = [handler for handler in self.app.logger.handlers
+                        if isinstance(handler, DigestSMTPHandler)][0]
+
+        @self.app.route('/fail/<int:user_id>')
+        def fail(user_id):
+            try:
+                raise ValueError('user {0} failed'.format(user_id))
+            except ValueError as ex:
+                logger.exception(ex)
+            return ''
+
+        @self.app.route('/other')
+        def other():
+            logger.error('other error')
+            return ''
+
+    def tearDown(self):
+        if self.handler.timer is not None:
+            self.handler.timer.cancel()
+        super(TestDigestSMTPLogger, self).tearDown()
+
+    def test_digest(self):
+        for user_id in range(5):
+            self.client.get('/fail/{0}'.format(user_id))
+        self.client.get('/other')
+
+        # nothing is sent until the window closes
+        self.assertIsNone(self.outbox())
+        self.assertTrue(self.handler.timer.is_alive())
+
+        self.handler.flush()
+        messages = sorted(self.outbox(), key=lambda msg: len(msg.fullmessage))
+        self.assertEqual(len(messages), 2)
+
+        other, fail = messages
+        self.assertIn('Subject: [{0}] Application Error: http://localhost/other'.format(self.app.name),
+                      other.fullmessage)
+        self.assertIn('1 occurrence(s)', other.fullmessage)
+        self.assertIn('Subject: (5x) [{0}] Application Error: http://localhost/fail/0'.format(self.app.name),
+                      fail.fullmessage)
+        self.assertIn('5 occurrence(s)', fail.fullmessage)
+        self.assertIn('ValueError: user 0 failed', fail.fullmessage)
+        self.assertEqual(fail.fullmessage.count('SAMPLE REQUEST'), 1)
+        self.assertIn("'PATH_INFO': '/fail/1'", fail.fullmessage)
+        self.assertNotIn("'PATH_INFO': '/fail/2'", fail.fullmessage)
+
+    def test_rate_limits(self):
+        for _ in range(3):
+            self.client.get('/fail/1')
+            self.handler.flush()
+
+        # third digest of fingerprint is rate limited and keeps aggregating
+        self.assertEqual(len(self.outbox()), 2)
+        self.assertEqual(len(self.handler.digests), 1)
+
+        self.client.get('/other')
+        self.handler.flush()
+        self.assertEqual(len(self.outbox()), 3)
+
+        # global limit
+        self.handler.fingerprint_sent.clear()
+        self.handler.flush()
+        self.assertEqual(len(self.outbox()), 3)
+
+        # limits are per rate period
+        self.handler.rate_period = 0
+        self.client.get('/fail/1')
+        self.handler.flush()
+        self.assertEqual(len(self.outbox()), 4)
+        self.assertIn('(2x)', self.outbox()[-1].fullmessage)
+
+    def test_window(self):
+        self.handler.window = 0
+        self.client.get('/other')
+
+        # timer sends digest once the window closes
+        for _ in range(100):
+            if self.outbox():
+                break
+            sleep(0.01)
+
+        self.assertEqual(len(self.outbox()), 1)
+
+
+class TestQueuedDigestSMTPLogger(TestLoggerBase):
+    class __config__(TestDigestSMTPLogger.__config__):
+        CARAFE_LOGGER_RFILE_ENABLED = True
+        CARAFE_LOGGER_RFILE_FILENAME = '_test_logger.log'
+        CARAFE_LOGGER_QUEUE_ENABLED = True
+
+    def test_digest(self):
+        @self.app.route('/fail/<name>')
+        def fail(name):
+            try:
+                raise ValueError('user {0} failed'.format(name))
+            except ValueError:
+                logger.exception('user failed')
+            return ''
+
+        self.client.get('/fail/abc')
+        self.client.get('/fail/xyz')
+
+        queue_handlers = [handler for handler in self.app.logger.handlers
+                          if isinstance(handler, QueueHandler)]
+        self.assertEqual(len(queue_handlers), 2)
+
+        for handler in queue_handlers:
+            handler.flush()
+
+        digest_handler = [handler for queue_handler in queue_handlers
+                          for handler in queue_handler.handlers
+                          if isinstance(handler, DigestSMTPHandler)][0]
+        digest_handler.flush()
+
+        # the file handler (queued first) doesn't change the records which
+        # the digest handler fingerprints
+        self.assertEqual(len(self.outbox()), 1)
+        self.assertIn('2 occurrence(s)', self.outbox()[0].fullmessage)
+        self.assertIn('ValueError: user abc failed', self.outbox()[0].fullmessage)
+        self.assertEqual(''.join(self.get_log_lines()).count('ValueError: user'), 2)
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.unblocked = Event()
+
+    def emit(self, record):
+        self.unblocked.wait(5)
+        self.records.append(record.getMessage())
+
+
+class TestQueueHandler(TestBase):
+    def log(self, handler, *messages):
+        for message in messages:
+            handler.handle(logging.LogRecord('test', logging.ERROR, __file__, 1, message, None, None))
+
+    def test_drop_new(self):
+        target = BlockingHandler()
+        handler = QueueHandler([target], maxsize=2)
+
+        # first record is taken by the blocked listener thread
+        self.log(handler, 'a')
+        while handler.queue.qsize():
+            pass
+
+        self.log(handler, 'b', 'c', 'd', 'e')
+        self.assertEqual(handler.stats(), {'queued': 2, 'dropped': 2})
+
+        target.unblocked.set()
+        handler.close()
+
+        self.assertEqual(target.records, ['a', 'b', 'c'])
+        self.assertFalse(handler.thread.is_alive())
+
+    def test_drop_old(self):
+        target = BlockingHandler()
+        handler = QueueHandler([target], maxsize=2, drop='old')
+
+        self.log(handler, 'a')
+        while handler.queue.qsize():
+            pass
+
+        self.log(handler, 'b', 'c', 'd', 'e')
+        self.assertEqual(handler.dropped, 2)
+
+        target.unblocked.set()
+        handler.close()
+
+        self.assertEqual(target.records, ['a', 'd', 'e'])
+
+    def test_level(self):
+        target = BlockingHandler()
+        target.unblocked.set()
+        target.setLevel(logging.ERROR)
+        handler = QueueHandler([target])
+
+        self.assertEqual(handler.level, logging.ERROR)
+        handler.handle_record(logging.LogRecord('test', logging.INFO, __file__, 1, 'info', None, None))
+        self.assertEqual(target.records, [])
+
+    def test_invalid_drop(self):
+        self.assertRaises(ValueError, QueueHandler, [BlockingHandler()], drop='foo')
+
+
+class TestRequestEnviron(TestLoggerBase):
+    class __config__(TestRotatingFileLogger.__config__):
+        CARAFE_LOGGER_ENVIRON_MAX_FIELD_LENGTH = 10
+
+    def test_lazy(self):
+        records = []
+
+        @self.app.route('/log')
+        def log():
+            record = logging.LogRecord('test', logging.WARNING, __file__, 1, 'warning', None, None)
+            self.app.logger.handle(record)
+            records.append(record)
+            return ''
+
+        self.client.get('/log')
+
+        # rotating file handler's format doesn't render environ
+        self.assertIsInstance(records[0].environ, RequestEnviron)
+        self.assertFalse(records[0].environ.captured)
+
+    def test_capture(self):
+        headers = {'Authorization': 'secret', 'X-Long': 'x' * 20}
+
+        with self.app.test_request_context('/?q=' + 'y' * 20, method='POST', data='{"a": 1}',
+                                           content_type='application/json', headers=headers):
+            environ = RequestEnviron(max_field_length=10)
+            data = environ.capture()
+
+            self.assertEqual(data['REQUEST_HEADERS']['Authorization'], REDACTED)
+            self.assertEqual(data['HTTP_AUTHORIZATION'], REDACTED)
+            self.assertEqual(data['REQUEST_HEADERS']['X-Long'], 'x' * 10 + '...[10 more]')
+            self.assertEqual(data['REQUEST_ARGS']['q'], 'y' * 10 + '...[10 more]')
+            self.assertEqual(data['REQUEST_JSON'], {'a': 1})
+            self.assertEqual(data['REQUEST_BODY'], '{"a": 1}')
+
+        # rendered after the request is gone
+        self.assertIn("'REQUEST_JSON': {   u'a': 1}", str(environ))
+
+    def test_body_limits(self):
+        with self.app.test_request_context('/', method='POST', data='x' * 100):
+            data = RequestEnviron(max_body_length=50).capture()
+            self.assertEqual(data['REQUEST_BODY'], '[100 bytes not captured]')
+            self.assertNotIn('REQUEST_JSON', data)
+
+        with self.app.test_request_context('/', method='POST', data='\xff\xfe'):
+            data = RequestEnviron().capture()
+            self.assertEqual(data['REQUEST_BODY'], '[2 bytes of binary data]')
+
+        with self.app.test_request_context('/', method='POST', data={'a': 'b', 'file': (StringIO('data'), 'a.txt')}):
+            data = RequestEnviron().capture()
+            self.assertEqual(data['REQUEST_BODY'], '[multipart body not captured]')
+            self.assertEqual(data['REQUEST_FORM'], {'a': u'b'})
+            self.assertEqual(data['REQUEST_FILES'], {'file': 'a.txt (text/plain)'})
+
+    def test_max_length(self):
+        with self.app.test_request_context('/'):
+            environ = RequestEnviron(max_length=20)
+            self.assertTrue(str(environ).startswith(str(environ)[:20]))
+            self.assertIn('more]', str(environ))
+            self.assertTrue(len(str(environ)) < 40)
+
+    def test_without_request(self):
+        rendered = []
+        thread = Thread(target=lambda: rendered.append(str(RequestEnviron())))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(rendered, [''])
+
+
+class TestRequestId(TestLoggerBase):
+    def test_request_id(self):
+        @self.app.route('/id')
+        def request_id():
+            return get_request_id()
+
+        response = self.client.get('/id')
+        self.assertEqual(len(response.headers['X-Request-Id']), 32)
+        self.assertEqual(response.data, response.headers['X-Request-Id'])
+
+        response = self.client.get('/id', headers={'X-Request-Id': 'abc-123'})
+        self.assertEqual(response.headers['X-Request-Id'], 'abc-123')
+        self.assertEqual(response.data, 'abc-123')
+
+        response = self.client.get('/id', headers={'X-Request-Id': 'bad id' + 'x' * 200})
+        self.assertEqual(len(response.headers['X-Request-Id']), 32)
+
+
+class TestJSONLogger(TestLoggerBase):
+    class __config__(TestRotatingFileLogger.__config__):
+        CARAFE_LOGGER_RFILE_FORMAT = 'json'
+
+    def setUp(self):
+        @self.app.route('/log/<int:user_id>')
+        def log(user_id):
+            g.identity = Identity(user_id)
+            logger.warning('warning %s', 'logged')
+            try:
+                raise ValueError('bad value')
+            except ValueError:
+                logger.exception('error logged')
+            return ''
+
+    def get_records(self):
+        return [json.loads(line) for line in self.get_log_lines()]
+
+    def assert_records(self, warning, error):
+        self.assertEqual(warning['level'], 'WARNING')
+        self.assertEqual(warning['message'], 'warning logged')
+        self.assertEqual(warning['request_id'], 'abc')
+        self.assertEqual(warning['method'], 'GET')
+        self.assertEqual(warning['path'], '/log/2')
+        self.assertEqual(warning['user_id'], 2)
+        self.assertTrue(warning['duration'] >= 0)
+        self.assertTrue(warning['time'].endswith('Z'))
+        self.assertIn('test_logger.py:', warning['location'])
+        self.assertNotIn('environ', warning)
+
+        self.assertEqual(error['level'], 'ERROR')
+        self.assertIn('ValueError: bad value', error.get('exception', error['message']))
+        self.assertEqual(error['environ']['PATH_INFO'], '/log/2')
+
+    def test_json_format(self):
+        self.client.get('/log/2', headers={'X-Request-Id': 'abc'})
+
+        warning, error = self.get_records()
+        self.assert_records(warning, error)
+        self.assertNotIn('status', warning)
+
+
+class TestJSONLoggerMaxLength(TestJSONLogger):
+    class __config__(TestJSONLogger.__config__):
+        CARAFE_LOGGER_ENVIRON_MAX_LENGTH = 400
+
+    def test_json_format(self):
+        self.client.get('/log/2', headers={'X-Request-Id': 'abc', 'X-Long': 'x' * 200})
+
+        warning, error = self.get_records()
+        self.assert_records(warning, error)
+
+        environ = error['environ']
+        self.assertTrue(len(json.dumps(environ, separators=(',', ':'))) <= 400 + 20)
+        self.assertEqual(environ['REQUEST_ARGS'], {})
+        self.assertTrue(environ['OMITTED'] > 0)
+        self.assertNotIn('HTTP_X_LONG', environ)
+
+
+class TestQueuedJSONLogger(TestJSONLogger):
+    class __config__(TestJSONLogger.__config__):
+        CARAFE_LOGGER_QUEUE_ENABLED = True
+
+    def get_records(self):
+        for handler in self.app.logger.handlers:
+            handler.flush()
+
+        return super(TestQueuedJSONLogger, self).get_records()
@@ -0,0 +1,129 @@
+from threading import Thread
+from time import sleep
+
+import carafe
+from carafe.ext.metrics import Histogram, cpu_time
+from .core import metrics
+
+from .base import TestBase
+
+
+class TestMetrics(TestBase):
+    __client_class__ = carafe.JSONClient
+
+    class __config__(object):
+        CARAFE_METRICS_ENABLED = True
+        CARAFE_METRICS_BUCKETS = [10, 50]
+        CARAFE_METRICS_SLOW_THRESHOLD = 20
+        PROPAGATE_EXCEPTIONS = False
+
+    def setUp(self):
+        @self.app.route('/items/<int:item_id>')
+        def item(item_id):
+            return {'id': item_id}
+
+        @self.app.route('/slow')
+        def slow():
+            sleep(0.03)
+            return ''
+
+        @self.app.route('/error')
+        def error():
+            raise Exception('error')
+
+    def get_endpoints(self):
+        return self.client.get('/_metrics').json['endpoints']
+
+    def test_metrics(self):
+        for item_id in range(3):
+            self.client.get('/items/{0}'.format(item_id))
+
+        self.client.get('/missing')
+        self.client.get('/error')
+
+        endpoints = self.get_endpoints()
+
+        # keyed by URL rule
+        stats = endpoints['GET /items/<int:item_id>']
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['statuses'], {'200': 3})
+        self.assertEqual(stats['wall']['buckets'], {'le_10': 3, 'le_50': 0, 'inf': 0})
+        self.assertEqual(stats['wall']['p99'], stats['wall']['max'])
+        self.assertTrue(stats['wall']['p99'] <= 10)
+        self.assertTrue(stats['size']['mean'] > 0)
+        self.assertTrue(stats['cpu']['mean'] >= 0)
+
+        self.assertEqual(endpoints['GET <unmatched>']['statuses'], {'404': 1})
+        self.assertEqual(endpoints['GET /error']['errors'], 1)
+
+    def test_slow_request_log(self):
+        messages = []
+        self.app.logger.warning = lambda msg, *args: messages.append(msg % args)
+
+        self.client.get('/items/1')
+        self.client.get('/slow')
+
+        self.assertEqual(len(messages), 1)
+        self.assertIn('Slow request: GET /slow (/slow) took', messages[0])
+        self.assertEqual(self.get_endpoints()['GET /slow']['wall']['buckets']['le_50'], 1)
+
+    def test_threads(self):
+        def get():
+            with self.app.test_client() as client:
+                for _ in range(5):
+                    client.get('/items/1')
+
+        threads = [Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        registry = self.app.extensions['carafe.metrics']
+
+        # histograms of finished threads are retired but still counted
+        self.assertEqual(self.get_endpoints()['GET /items/<int:item_id>']['count'], 20)
+        self.assertEqual(len(registry.threads), 1)
+        self.assertEqual(registry.retired['GET /items/<int:item_id>'].count, 20)
+
+    def test_sources(self):
+        metrics.add_source('test', lambda: {'a': 1})
+
+        try:
+            self.assertEqual(self.client.get('/_metrics').json['test'], {'a': 1})
+        finally:
+            metrics.sources.clear()
+
+    def test_log_snapshot(self):
+        messages = []
+        self.app.logger.info = lambda msg, *args: messages.append(msg % args)
+
+        self.client.get('/items/1')
+        metrics.log_snapshot()
+
+        self.assertIn('"GET /items/<int:item_id>"', messages[0])
+
+
+class TestHistogram(TestBase):
+    def test_merge(self):
+        one = Histogram([10])
+        one.add(5, 1, 10, 200)
+        other = Histogram([10])
+        other.add(20, 2, None, 500)
+        one.merge(other)
+
+        data = one.to_dict()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(data['wall']['buckets'], {'le_10': 1, 'inf': 1})
+        self.assertEqual(data['wall']['max'], 20)
+        self.assertEqual(data['cpu']['mean'], 1.5)
+        self.assertEqual(data['size'], {'total': 10, 'mean': 10.0})
+        self.assertIsNone(Histogram([10]).percentile(50))
+
+    def test_cpu_time(self):
+        started = cpu_time()
+        for _ in range(10):
+            sum(range(1000000))
+        self.assertTrue(cpu_time() > started)
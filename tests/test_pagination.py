@@ -0,0 +1,103 @@
+
+from flask import request
+
+from carafe.pagination import (
+    CursorPaginator,
+    encode_cursor,
+    decode_cursor,
+    PREV
+)
+
+from .base import TestBase
+
+
+ITEMS = [{'id': i, 'name': 'item {0}'.format(i)} for i in range(1, 8)]
+
+
+def fetch(value, direction, limit):
+    if direction == PREV:
+        items = [item for item in reversed(ITEMS)
+                 if value is None or item['id'] < value]
+    else:
+        items = [item for item in ITEMS
+                 if value is None or item['id'] > value]
+    return items[:limit]
+
+
+class TestPagination(TestBase):
+    def setUp(self):
+        self.fetched = []
+
+        def tracked_fetch(value, direction, limit):
+            self.fetched.append(limit)
+            return fetch(value, direction, limit)
+
+        self.paginator = CursorPaginator(tracked_fetch, default_limit=3)
+
+        @self.app.route('/items')
+        def items():
+            return self.paginator.paginate().to_dict()
+
+        @self.app.route('/stream')
+        def stream():
+            return self.paginator.paginate().stream(fields=request.fields)
+
+    def ids(self, data):
+        return [item['id'] for item in data['items']]
+
+    def test_cursor_roundtrip(self):
+        self.assertEqual(decode_cursor(encode_cursor(5, PREV)), (PREV, 5))
+        self.assertEqual(encode_cursor({'a': 1, 'b': 2}),
+                         encode_cursor({'b': 2, 'a': 1}))
+
+    def test_invalid_cursor(self):
+        self.assertStatus(self.client.get('/items', params={'cursor': 'bad'}), 400)
+
+        # forged cursors with non-scalar values
+        for value in ([1], {'id': 1}):
+            cursor = encode_cursor(value)
+            self.assertStatus(self.client.get('/items', params={'cursor': cursor}), 400)
+
+    def test_paginate(self):
+        data = self.client.get('/items').json
+
+        self.assertEqual(self.ids(data), [1, 2, 3])
+        self.assertEqual(self.fetched, [4])
+        self.assertIsNone(data['prev'])
+
+        data = self.client.get(data['next']).json
+
+        self.assertEqual(self.ids(data), [4, 5, 6])
+
+        last = self.client.get(data['next']).json
+
+        self.assertEqual(self.ids(last), [7])
+        self.assertIsNone(last['next'])
+
+        # previous page from last page is the same as the middle page
+        self.assertEqual(self.client.get(last['prev']).json, data)
+
+        first = self.client.get(data['prev']).json
+
+        self.assertEqual(self.ids(first), [1, 2, 3])
+        self.assertIsNone(first['prev'])
+
+    def test_paginate_limit(self):
+        data = self.client.get('/items', params={'limit': 2}).json
+
+        self.assertEqual(self.ids(data), [1, 2])
+        self.assertIn('limit=2', data['next'])
+
+        self.paginator.max_limit = 5
+        data = self.client.get('/items', params={'limit': 50}).json
+
+        self.assertEqual(len(data['items']), 5)
+
+    def test_stream(self):
+        with self.app.test_request_context('/stream'):
+            self.assertTrue(self.paginator.paginate().stream().is_streamed)
+
+        data = self.client.get('/stream', params={'fields': 'id'}).json
+
+        self.assertEqual(data['items'], [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.assertEqual(data['next'], '/stream?cursor={0}&fields=id'.format(encode_cursor(3)))
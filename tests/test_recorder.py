@@ -0,0 +1,171 @@
+import os
+import tempfile
+from time import time
+
+from flask import request
+
+import carafe
+from carafe.ext.recorder import Replayer, iter_recordings, REDACTED
+from .core import recorder
+
+from .base import TestBase
+
+
+class TestRecorderBase(TestBase):
+    __client_class__ = carafe.JSONClient
+
+    class __config__(object):
+        CARAFE_RECORDER_ENABLED = True
+
+    def create_app(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+
+        self.__config__.CARAFE_RECORDER_FILENAME = self.filename
+        return super(TestRecorderBase, self).create_app()
+
+    def setUp(self):
+        self.received = []
+
+        @self.app.route('/items', methods=['GET', 'POST'])
+        def items():
+            self.received.append((request.method, request.args.to_dict(), request.get_dict()))
+            return {'ok': True}
+
+    def tearDown(self):
+        recorder.close()
+        os.remove(self.filename)
+
+    def recordings(self):
+        recorder.flush()
+        return list(iter_recordings(self.filename))
+
+
+class TestRecorder(TestRecorderBase):
+    def test_record(self):
+        self.client.get('/items', {'page': '2', 'access_token': 'abc'},
+                        headers={'If-None-Match': 'x', 'Authorization': 'secret'})
+        self.client.post('/items', {'name': 'a', 'user': {'password': 'x'}})
+        self.client.post('/items', {'name': 'b'}, content_type='application/x-www-form-urlencoded')
+
+        get, post_json, post_form = self.recordings()
+
+        self.assertEqual(get['method'], 'GET')
+        self.assertEqual(get['path'], '/items')
+        self.assertEqual(get['status'], 200)
+        self.assertEqual(get['args'], {'page': ['2'], 'access_token': REDACTED})
+        self.assertEqual(get['headers'], {'If-None-Match': 'x', 'Content-Type': 'application/json'})
+        self.assertNotIn('json', get)
+
+        self.assertEqual(post_json['json'], {'name': 'a', 'user': {'password': REDACTED}})
+        self.assertEqual(post_form['form'], {'name': ['b']})
+        self.assertTrue(get['time'] <= post_form['time'] <= time())
+
+        # views still get the body
+        self.assertEqual(self.received[1][2], {'name': 'a', 'user': {'password': 'x'}})
+
+    def test_record_max_body_length(self):
+        self.app.config['CARAFE_RECORDER_MAX_BODY_LENGTH'] = 10
+        self.client.post('/items', {'name': 'x' * 10})
+
+        self.assertNotIn('json', self.recordings()[0])
+        self.assertEqual(self.received[0][2], {'name': 'x' * 10})
+
+    def test_record_iter_json(self):
+        @self.app.route('/stream', methods=['POST'])
+        def stream():
+            return {'items': list(request.iter_json())}
+
+        response = self.client.post('/stream', [{'a': 1}, {'a': 2}])
+
+        self.assert200(response)
+        self.assertEqual(response.json, {'items': [{'a': 1}, {'a': 2}]})
+
+        recording = self.recordings()[0]
+        self.assertEqual(recording['status'], 200)
+        self.assertNotIn('json', recording)
+        self.assertNotIn('data', recording)
+
+    def test_record_unread_body(self):
+        @self.app.route('/ignore', methods=['POST'])
+        def ignore():
+            return {}
+
+        self.client.post('/ignore', {'name': 'a'})
+
+        self.assertEqual(self.recordings()[0]['json'], {'name': 'a'})
+
+    def test_record_raw_bodies(self):
+        self.client.post('/items', 'password=x', content_type='text/plain')
+        self.client.post('/items', '{"password": "x"', content_type='application/json')
+
+        for recording in self.recordings():
+            self.assertNotIn('data', recording)
+            self.assertNotIn('json', recording)
+
+        self.app.config['CARAFE_RECORDER_RAW_BODIES'] = True
+        self.client.post('/items', 'text', content_type='text/plain')
+
+        self.assertEqual(self.recordings()[-1]['data'], 'text')
+
+    def test_record_queued(self):
+        self.client.get('/items')
+
+        self.assertEqual(self.recordings()[0]['path'], '/items')
+        self.assertTrue(recorder.thread.is_alive())
+        self.assertEqual(recorder.dropped, 0)
+
+        recorder.close()
+        self.assertFalse(recorder.thread.is_alive())
+
+        self.client.get('/items')
+        self.assertEqual(len(self.recordings()), 2)
+
+    def test_record_redact_headers(self):
+        self.app.config['CARAFE_RECORDER_HEADERS'] = ['Authorization', 'X-Client']
+        self.client.get('/items', headers={'Authorization': 'secret', 'X-Client': 'a'})
+
+        self.assertEqual(self.recordings()[0]['headers'], {'Authorization': REDACTED, 'X-Client': 'a'})
+
+    def test_sample_rate(self):
+        self.app.config['CARAFE_RECORDER_SAMPLE_RATE'] = 0
+
+        for _ in range(5):
+            self.client.get('/items')
+
+        self.assertEqual(self.recordings(), [])
+        self.assertEqual(len(self.received), 5)
+
+
+class TestReplayer(TestRecorderBase):
+    def test_replay(self):
+        self.app.config['CARAFE_RECORDER_RAW_BODIES'] = True
+        self.client.get('/items', {'page': '2'})
+        self.client.post('/items', {'name': 'a'})
+        self.client.post('/items', {'name': 'b'}, content_type='application/x-www-form-urlencoded')
+        self.client.post('/items', 'text', content_type='text/plain')
+
+        received = list(self.received)
+        del self.received[:]
+
+        # don't record replayed requests
+        self.app.config['CARAFE_RECORDER_SAMPLE_RATE'] = 0
+        statuses = Replayer(self.app, self.filename).replay()
+
+        self.assertEqual(statuses, {200: 4})
+        self.assertEqual(self.received, received)
+
+    def test_replay_timing(self):
+        self.app.config['CARAFE_RECORDER_SAMPLE_RATE'] = 0
+
+        with open(self.filename, 'w') as fp:
+            fp.write('{"time": 100.0, "method": "GET", "path": "/items"}\n')
+            fp.write('{"time": 100.2, "method": "GET", "path": "/items"}\n')
+
+        started = time()
+        list(Replayer(self.app, self.filename, speed=2))
+        self.assertTrue(time() - started >= 0.1)
+
+        started = time()
+        list(Replayer(self.app, self.filename))
+        self.assertTrue(time() - started < 0.1)
@@ -1,7 +1,9 @@
 
 import json
+import zlib
 from flask import request
 
+from carafe.request import request_limits
 from carafe.utils import jsonify
 
 from .base import TestBase
@@ -54,6 +56,15 @@ class TestRequest(TestBase):
         ).json
         self.assertEqual(result, self.data)
 
+    def test_get_dict_json_form_urlencoded(self):
+        """Test request.get_dict() decodes JSON sent as form-urlencoded"""
+        result = self.client.post(
+            '/',
+            data=self.data_json,
+            content_type='application/x-www-form-urlencoded'
+        ).json
+        self.assertEqual(result, self.data)
+
     def test_get_dict_fallback_form_data(self):
         """Test request.get_dict() function using form-data content type"""
         result = self.client.post(
@@ -88,3 +99,181 @@ class TestRequest(TestBase):
             return result2
 
         self.client.post('/cached', self.data_json)
+
+    def test_fields(self):
+        """Test request.fields and request.exclude sparse fieldset parsing"""
+        @self.app.route('/fields')
+        def fields():
+            return {'fields': request.fields, 'exclude': request.exclude}
+
+        result = self.client.get(
+            '/fields?fields=id,author.name&fields=title&exclude=author.email'
+        ).json
+
+        self.assertEqual(result['fields'],
+                         {'id': {}, 'title': {}, 'author': {'name': {}}})
+        self.assertEqual(result['exclude'], {'author': {'email': {}}})
+
+    def test_body(self):
+        """Test request.body is parsed once and shared"""
+        @self.app.route('/body', methods=['POST'])
+        def body():
+            self.assertIs(request.get_dict(), request.body.dict)
+            self.assertIs(request.body.form_dict, request.body.form_dict)
+            self.assertEqual(request.body.raw, self.data_json)
+            self.assertEqual(request.body.json, self.data)
+            return ''
+
+        self.client.post('/body', data=self.data_json, content_type='application/json')
+
+    def test_body_form(self):
+        """Test request.body with form data"""
+        @self.app.route('/body', methods=['POST'])
+        def body():
+            self.assertIsNone(request.body.json)
+            self.assertIs(request.body.form_dict, request.body.dict)
+            self.assertEqual(request.body.dict, self.data)
+            return request.body.raw
+
+        res = self.client.post(
+            '/body',
+            data=self.data,
+            content_type='application/x-www-form-urlencoded')
+        self.assertEqual(res.data, 'foo=bar')
+
+        # multipart bodies aren't buffered
+        res = self.client.post(
+            '/body', data=self.data, content_type='multipart/form-data')
+        self.assertEqual(res.data, '')
+
+
+class TestRequestLimits(TestBase):
+    class __config__(object):
+        MAX_CONTENT_LENGTH = 100
+        CARAFE_REQUEST_MAX_JSON_DEPTH = 3
+
+    def setUp(self):
+        @self.app.route('/dict', methods=['POST'])
+        def get_dict():
+            return request.get_dict()
+
+        @self.app.route('/stream', methods=['POST'])
+        def stream():
+            return list(request.iter_json(chunk_size=4))
+
+    def post(self, url, data):
+        return self.client.post(url, data=json.dumps(data), content_type='application/json')
+
+    def test_iter_json(self):
+        data = [{'a': 1}, [2, [3]], 'b']
+        self.assertEqual(self.post('/stream', data).json, data)
+
+    def test_max_depth(self):
+        self.assertStatus(self.post('/stream', [[[[1]]]]), 400)
+        self.assertStatus(self.post('/dict', {'a': {'b': {'c': {}}}}), 400)
+        self.assertStatus(self.post('/dict', {'a': {'b': {}}}), 200)
+
+    def test_max_content_length(self):
+        self.assertStatus(self.post('/stream', ['x' * 100]), 413)
+        self.assertStatus(self.post('/dict', {'x': 'x' * 100}), 413)
+
+
+class TestRequestEndpointLimits(TestBase):
+    class __config__(object):
+        MAX_CONTENT_LENGTH = 100
+        CARAFE_REQUEST_MAX_JSON_KEYS = 2
+        CARAFE_REQUEST_MAX_JSON_ARRAY_LENGTH = 3
+
+    def setUp(self):
+        self.calls = []
+
+        @self.app.before_request
+        def before_request():
+            self.calls.append(request.path)
+
+        @self.app.route('/dict', methods=['POST'])
+        def get_dict():
+            return request.get_dict()
+
+        @self.app.route('/stream', methods=['POST'])
+        def stream():
+            return list(request.iter_json(chunk_size=4))
+
+        @self.app.route('/large', methods=['POST'])
+        @request_limits(max_content_length=1000,
+                        max_json_keys=None,
+                        max_json_array_length=10)
+        def large():
+            return request.get_dict()
+
+    def post(self, url, data):
+        return self.client.post(url, data=json.dumps(data), content_type='application/json')
+
+    def test_early_rejection(self):
+        self.assertStatus(self.post('/dict', {'x': 'x' * 100}), 413)
+        self.assertStatus(self.post('/stream', ['x' * 100]), 413)
+        # rejected before request processing (e.g. before_request handlers)
+        self.assertEqual(self.calls, [])
+
+    def test_max_keys(self):
+        self.assertStatus(self.post('/dict', {'a': 1, 'b': {'c': 2}}), 200)
+        self.assertStatus(self.post('/dict', {'a': 1, 'b': 2, 'c': 3}), 400)
+        self.assertStatus(self.post('/dict', {'a': {'b': 1, 'c': 2, 'd': 3}}), 400)
+        self.assertStatus(self.post('/stream', [{'a': 1, 'b': 2, 'c': 3}]), 400)
+
+    def test_max_array_length(self):
+        self.assertStatus(self.post('/dict', {'a': [1, 2, 3]}), 200)
+        self.assertStatus(self.post('/dict', {'a': [1, 2, 3, 4]}), 400)
+        self.assertStatus(self.post('/stream', [1, [], {}]), 200)
+        self.assertStatus(self.post('/stream', [1, 2, 3, 4]), 400)
+        self.assertStatus(self.post('/stream', [[1, 2, 3, 4]]), 400)
+
+    def test_endpoint_limits(self):
+        data = {'a': range(10), 'b': 'x' * 100, 'c': 3}
+        res = self.post('/large', data)
+        self.assertStatus(res, 200)
+        self.assertEqual(res.json, data)
+
+        self.assertStatus(self.post('/large', {'a': range(11)}), 400)
+        self.assertStatus(self.post('/large', {'x': 'x' * 1000}), 413)
+
+    def test_request_limits_unknown(self):
+        self.assertRaises(TypeError, request_limits, max_foo=1)
+
+
+class TestRequestCompressed(TestBase):
+    class __config__(object):
+        MAX_CONTENT_LENGTH = 1000
+
+    data = {'foo': 'bar' * 100}
+
+    def setUp(self):
+        @self.app.route('/', methods=['POST'])
+        def index():
+            return request.get_dict()
+
+    def post(self, data, encoding='deflate', **kargs):
+        kargs.setdefault('content_type', 'application/json')
+        return self.client.post('/', data=zlib.compress(data),
+                                headers={'Content-Encoding': encoding}, **kargs)
+
+    def test_get_dict_json(self):
+        self.assertEqual(self.post(json.dumps(self.data)).json, self.data)
+
+    def test_get_dict_form(self):
+        result = self.post('foo=bar&baz=qux', content_type='application/x-www-form-urlencoded').json
+        self.assertEqual(result, {'foo': 'bar', 'baz': 'qux'})
+
+    def test_decompressed_length_limit(self):
+        self.assertStatus(self.post(json.dumps({'foo': 'x' * 1000})), 413)
+
+    def test_decompressed_length_limit_default(self):
+        self.app.config['MAX_CONTENT_LENGTH'] = None
+        self.assertEqual(self.app.config['CARAFE_REQUEST_MAX_DECOMPRESSED_LENGTH'], 32 * 1024 * 1024)
+
+        self.app.config['CARAFE_REQUEST_MAX_DECOMPRESSED_LENGTH'] = 500
+        self.assertStatus(self.post(json.dumps({'foo': 'x' * 1000})), 413)
+        self.assertStatus(self.post(json.dumps(self.data)), 200)
+
+    def test_unsupported_encoding(self):
+        self.assertStatus(self.post(json.dumps(self.data), encoding='br'), 415)
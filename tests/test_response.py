@@ -0,0 +1,86 @@
+
+from carafe.response import RawJSON, RAW_JSON_PLACEHOLDER
+
+from .base import TestBase
+
+
+class TestRawJSON(TestBase):
+
+    def test_raw_json_nested(self):
+        @self.app.route('/')
+        def index():
+            return {'items': [RawJSON('{"a":[1,2]}'), RawJSON('null')],
+                    'count': 2}
+
+        res = self.client.get('/')
+
+        self.assertStatus(res, 200)
+        self.assertEqual(res.json, {'items': [{'a': [1, 2]}, None], 'count': 2})
+
+    def test_raw_json_top_level(self):
+        @self.app.route('/')
+        def index():
+            return RawJSON('{"a":1}')
+
+        res = self.client.get('/')
+
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(res.json, {'a': 1})
+
+    def test_raw_json_is_verbatim(self):
+        @self.app.route('/')
+        def index():
+            return [RawJSON('{ "a" :  1 }')]
+
+        self.assertIn('{ "a" :  1 }', self.client.get('/').data)
+
+    def test_raw_json_placeholder_in_content(self):
+        @self.app.route('/')
+        def index():
+            return [RAW_JSON_PLACEHOLDER, RawJSON('[1]'), {RAW_JSON_PLACEHOLDER: RawJSON('2')}]
+
+        self.assertEqual(self.client.get('/').json,
+                         [RAW_JSON_PLACEHOLDER, [1], {RAW_JSON_PLACEHOLDER: 2}])
+
+
+class TestETag(TestBase):
+    class __config__(object):
+        CARAFE_ETAG_ENABLED = True
+
+    def setUp(self):
+        self.tracker = {'count': 0}
+
+        @self.app.route('/')
+        def index():
+            self.tracker['count'] += 1
+            return {'data': 'content'}
+
+    def test_etag(self):
+        res = self.client.get('/')
+        etag, weak = res.get_etag()
+
+        self.assertStatus(res, 200)
+        self.assertIsNotNone(etag)
+        self.assertFalse(weak)
+
+        # same content produces the same etag
+        self.assertEqual(self.client.get('/').get_etag(), (etag, weak))
+
+    def test_if_none_match(self):
+        etag = self.client.get('/').headers['ETag']
+
+        res = self.client.get('/', headers={'If-None-Match': etag})
+
+        self.assertStatus(res, 304)
+        self.assertEqual(res.data, '')
+
+        res = self.client.get('/', headers={'If-None-Match': '"other"'})
+
+        self.assertStatus(res, 200)
+
+    def test_non_json_not_tagged(self):
+        @self.app.route('/text')
+        def text():
+            return 'content'
+
+        self.assertNotIn('ETag', self.client.get('/text').headers)
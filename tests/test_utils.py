@@ -3,7 +3,7 @@ from time import sleep
 
 from .base import TestBase
 
-from carafe.utils import async, classproperty, to_dict
+from carafe.utils import async, classproperty, to_dict, serializers
 
 
 class TestAsync(TestBase):
@@ -78,3 +78,207 @@ class TestToDict(TestBase):
 
         self.assertEqual(foo(), self.data)
         self.assertEqual(baz(), {'baz': self.data})
+
+
+class TestToDictSparse(TestBase):
+    class Author(object):
+        def __init__(self, name, email):
+            self.name = name
+            self.email = email
+
+        def to_dict(self):
+            return {'name': self.name, 'email': self.email}
+
+    class Post(object):
+        __fields__ = ('id', 'title', 'author')
+        __nested__ = ('author',)
+        loaded = []
+
+        def __init__(self, _id, title, author):
+            self.id = _id
+            self.title = title
+            self._author = author
+
+        @property
+        def author(self):
+            self.loaded.append('author')
+            return self._author
+
+    def setUp(self):
+        self.Post.loaded = []
+        author = self.Author('Jane', 'jane@example.com')
+        self.posts = [self.Post(1, 'one', author), self.Post(2, 'two', author)]
+
+    def test_to_dict_fields(self):
+        self.assertEqual(to_dict(self.posts, fields='id'), [{'id': 1}, {'id': 2}])
+
+        # unrequested relationships aren't loaded
+        self.assertEqual(self.Post.loaded, [])
+
+    def test_to_dict_nested_fields(self):
+        self.assertEqual(
+            to_dict(self.posts[0], fields='id,author.name'),
+            {'id': 1, 'author': {'name': 'Jane'}})
+
+        self.assertEqual(
+            to_dict(self.posts[0], fields='author'),
+            {'author': {'name': 'Jane', 'email': 'jane@example.com'}})
+
+    def test_to_dict_exclude(self):
+        self.assertEqual(
+            to_dict(self.posts[0], exclude='title,author.email'),
+            {'id': 1, 'author': {'name': 'Jane'}})
+
+        self.assertEqual(
+            to_dict(self.posts[0], fields='id,author', exclude='author.email'),
+            {'id': 1, 'author': {'name': 'Jane'}})
+
+    def test_to_dict_hidden_fields(self):
+        class User(object):
+            password_hash = 'SECRET'
+
+            def to_dict(self):
+                return {'id': 1}
+
+        class DeclaredUser(User):
+            __fields__ = ('id',)
+            id = 1
+
+        for user in (User(), DeclaredUser()):
+            self.assertEqual(to_dict(user, fields='id,password_hash'), {'id': 1})
+            self.assertEqual(to_dict(user, fields='__class__,_author'), {})
+
+        self.assertEqual(to_dict(self.posts[0], fields='id,_author'), {'id': 1})
+
+    def test_to_dict_exclude_dict_not_mutated(self):
+        data = {'a': 1, 'b': 2}
+        self.assertEqual(to_dict(data, exclude='b'), {'a': 1})
+        self.assertEqual(data, {'a': 1, 'b': 2})
+
+    def test_to_dict_sparse_from_request(self):
+        @self.app.route('/posts')
+        @to_dict(sparse=True, namespace='posts')
+        def posts():
+            return self.posts
+
+        res = self.client.get('/posts', params={'fields': 'id,author.name'})
+
+        self.assertEqual(res.json['posts'], [
+            {'id': 1, 'author': {'name': 'Jane'}},
+            {'id': 2, 'author': {'name': 'Jane'}}
+        ])
+
+
+class TestSerializerRegistry(TestBase):
+    class Model(object):
+        def to_dict(self):  # pragma: no cover
+            raise AssertionError('compiled serializer should be used')
+
+    class Declared(Model):
+        __fields__ = ('id', 'name')
+
+        def __init__(self, _id, name, secret='secret'):
+            self.id = _id
+            self.name = name
+            self.secret = secret
+
+    class Dynamic(object):
+        def __getattr__(self, attr):
+            if attr == 'to_dict':
+                return lambda: {'dynamic': True}
+            raise AttributeError(attr)
+
+    def setUp(self):
+        serializers.clear()
+
+    def test_declared_fields(self):
+        items = [self.Declared(1, 'one'), self.Declared(2, 'two')]
+
+        self.assertEqual(to_dict(items), [{'id': 1, 'name': 'one'},
+                                          {'id': 2, 'name': 'two'}])
+        self.assertEqual(to_dict(items[0]), {'id': 1, 'name': 'one'})
+
+    def test_declared_fields_exclude(self):
+        self.assertEqual(to_dict([self.Declared(1, 'one')], exclude='name'),
+                         [{'id': 1}])
+
+    def test_mixed_list(self):
+        items = [TestToDict.DictClass({'a': 1}), 'x', self.Dynamic(), {'b': 2}]
+
+        self.assertEqual(to_dict(items), [{'a': 1}, 'x', {'dynamic': True}, {'b': 2}])
+
+    def test_register(self):
+        serializers.register(self.Declared, lambda obj: obj.secret)
+
+        self.assertEqual(to_dict([self.Declared(1, 'one')]), ['secret'])
+
+    def test_declared_keyword_fields(self):
+        class Range(object):
+            __fields__ = ('id', 'from', 'to')
+
+        obj = Range()
+        obj.id = 1
+        setattr(obj, 'from', 2)
+        obj.to = 3
+
+        self.assertEqual(to_dict(obj), {'id': 1, 'from': 2, 'to': 3})
+
+    def test_declared_nested_fields(self):
+        class Parent(object):
+            __fields__ = ('id', 'child', 'children', 'tags')
+            __nested__ = ('child', 'children')
+
+        parent = Parent()
+        parent.id = 1
+        parent.child = self.Declared(2, 'two')
+        parent.children = [self.Declared(3, 'three'), TestToDict.DictClass({'a': 1})]
+        parent.tags = ['x', 'y']
+
+        self.assertEqual(to_dict(parent), {
+            'id': 1,
+            'child': {'id': 2, 'name': 'two'},
+            'children': [{'id': 3, 'name': 'three'}, {'a': 1}],
+            'tags': ['x', 'y']
+        })
+
+    def test_declared_back_reference(self):
+        class Node(object):
+            __fields__ = ('id', 'parent', 'children')
+            __nested__ = ('parent', 'children')
+
+            def __init__(self, _id, parent=None):
+                self.id = _id
+                self.parent = parent
+                self.children = []
+
+        root = Node(1)
+        root.children.append(Node(2, root))
+
+        self.assertEqual(to_dict(root), {
+            'id': 1,
+            'parent': None,
+            'children': [{'id': 2, 'parent': None, 'children': []}]
+        })
+
+    def test_own_to_dict(self):
+        class Custom(self.Declared):
+            __fields__ = ('id', 'name', 'secret')
+
+            def to_dict(self):
+                return {'id': self.id}
+
+        obj = Custom(1, 'one')
+
+        self.assertEqual(to_dict(obj), {'id': 1})
+        self.assertEqual(to_dict(obj, fields='id,secret'), {'id': 1})
+        self.assertEqual(to_dict(obj, exclude='name'), {'id': 1})
+
+    def test_declared_non_identifier_fields(self):
+        class Odd(object):
+            __fields__ = ['id', 'not-an-identifier']
+
+        obj = Odd()
+        obj.id = 1
+        setattr(obj, 'not-an-identifier', 2)
+
+        self.assertEqual(to_dict(obj), {'id': 1, 'not-an-identifier': 2})